@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+'''
+Base of the action plugins running the AOS modules of the role inside the
+Ansible worker process
+'''
+
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import sys
+import traceback
+
+from ansible.module_utils._text import to_text
+from ansible.plugins.action import ActionBase
+
+try:
+    from ansible.module_utils.common.arg_spec import ArgumentSpecValidator
+    from ansible.module_utils.common.parameters import remove_values
+    HAS_VALIDATOR = True
+except ImportError:
+    # Before Ansible 2.11 the modules run as usual
+    HAS_VALIDATOR = False
+
+try:
+    from importlib.util import module_from_spec, spec_from_file_location
+    HAS_IMPORTLIB_UTIL = True
+except ImportError:
+    # On Python 2.7 the modules run as usual
+    HAS_IMPORTLIB_UTIL = False
+
+ROLE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# module_utils of the role in import order, a module_util only imports the
+# ones before it
+MODULE_UTILS = ('aos_config', 'aos_http')
+
+
+def load_source(name, path):
+    """
+    Import the Python file path as the module name and register it in
+    sys.modules
+    """
+    spec = spec_from_file_location(name, path)
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def load_module(module_name):
+    """
+    Import the module module_name of the role, after the module_utils it
+    imports from ansible.module_utils, which AnsiballZ would have packaged
+    """
+    for name in MODULE_UTILS:
+        if 'ansible.module_utils.' + name not in sys.modules:
+            load_source('ansible.module_utils.' + name,
+                        os.path.join(ROLE_DIR, 'module_utils', name + '.py'))
+    name = 'ansible_role_aos_' + module_name
+    if name in sys.modules:
+        return sys.modules[name]
+    return load_source(name, os.path.join(ROLE_DIR, 'library', module_name + '.py'))
+
+
+class ModuleExit(BaseException):
+    """
+    Raised by exit_json and fail_json of InProcessModule with the result of
+    the module. Not an Exception, so that the except clauses of the modules
+    do not catch it, like the SystemExit of AnsibleModule.
+    """
+
+    def __init__(self, result):
+        super(ModuleExit, self).__init__()
+        self.result = result
+
+
+class InProcessModule(object):
+    """
+    Stand-in for AnsibleModule with the attributes used by the AOS modules,
+    validating the arguments like AnsibleModule does. exit_json and
+    fail_json raise ModuleExit instead of printing the result and exiting.
+    """
+    name = None
+    args = None
+    check_mode_requested = False
+    diff = False
+    socket_path = None
+
+    def __init__(self, argument_spec, bypass_checks=False, no_log=False,
+                 mutually_exclusive=None, required_together=None, required_one_of=None,
+                 add_file_common_args=False, supports_check_mode=False, required_if=None,
+                 required_by=None):
+        self._name = self.name
+        self._diff = self.diff
+        self._socket_path = self.socket_path
+        self._warnings = []
+        self.no_log_values = set()
+        self.check_mode = self.check_mode_requested
+        self.supports_check_mode = supports_check_mode
+        self.params = dict(self.args)
+
+        validator = ArgumentSpecValidator(argument_spec, mutually_exclusive, required_together,
+                                          required_one_of, required_if, required_by)
+        result = validator.validate(self.params)
+        self.params.update(result.validated_parameters)
+        self.no_log_values.update(result._no_log_values)
+        if result.error_messages:
+            msg = result.errors.msg
+            if result.unsupported_parameters:
+                msg = "Unsupported parameters for (%s) module: %s" % (self._name, msg)
+            self.fail_json(msg=msg)
+        if self.check_mode and not supports_check_mode:
+            self.exit_json(skipped=True,
+                           msg="remote module (%s) does not support check mode" % self._name)
+
+    def warn(self, warning):
+        self._warnings.append(warning)
+
+    def _result(self, kwargs):
+        kwargs.setdefault('invocation', {'module_args': self.params})
+        if self._warnings:
+            kwargs['warnings'] = self._warnings
+        return remove_values(kwargs, self.no_log_values)
+
+    def exit_json(self, **kwargs):
+        raise ModuleExit(self._result(kwargs))
+
+    def fail_json(self, msg, **kwargs):
+        kwargs['failed'] = True
+        kwargs['msg'] = msg
+        raise ModuleExit(self._result(kwargs))
+
+
+class ActionModule(ActionBase):
+    """
+    Runs the main() of the module named like the action in this process,
+    with the persistent connection of the task, instead of packaging the
+    module with AnsiballZ and starting a new interpreter. Falls back to the
+    module when the task is not on a persistent connection, is async, or
+    Ansible is older than 2.11. The arguments of fact_args which are not
+    set default to the fact of the host they are mapped to.
+
+    The facts of fact_args set by the module are bound to the persistent
+    connection in the fact named fact_socket. Its socket path differs from
+    one playbook run to the next, facts left by another run, as with fact
+    caching, are not passed to the module and are cleared.
+    """
+    _supports_async = True
+    _supports_check_mode = True
+    fact_args = {}
+    fact_socket = None
+
+    def run(self, tmp=None, task_vars=None):
+        result = super(ActionModule, self).run(tmp, task_vars)
+        del tmp
+
+        module_name = self._task.action.split('.')[-1]
+        args = dict(self._task.args)
+        socket_path = getattr(self._connection, 'socket_path', None)
+        facts = (task_vars or {}).get('ansible_facts') or {}
+        stale = bool(self.fact_socket) and facts.get(self.fact_socket) not in (None, socket_path)
+        for arg, fact in self.fact_args.items():
+            if args.get(arg) is None and facts.get(fact) and not stale:
+                args[arg] = facts[fact]
+        if not (HAS_VALIDATOR and HAS_IMPORTLIB_UTIL) or not socket_path or \
+                self._task.async_val:
+            wrap_async = self._task.async_val and not self._connection.has_native_async
+            result.update(self._execute_module(module_name=module_name, module_args=args,
+                                               task_vars=task_vars, wrap_async=wrap_async))
+        else:
+            result.update(self._run_in_process(module_name, args, socket_path))
+        if self.fact_socket:
+            self._bind_facts(result, socket_path, stale)
+        return result
+
+    def _bind_facts(self, result, socket_path, stale):
+        # Record the connection the facts of fact_args are set on, clear the
+        # ones of another playbook run
+        new_facts = result.get('ansible_facts') or {}
+        if stale:
+            for fact in list(self.fact_args.values()) + [self.fact_socket]:
+                new_facts.setdefault(fact, None)
+        if any(fact in new_facts for fact in self.fact_args.values()):
+            bound = any(new_facts.get(fact) for fact in self.fact_args.values())
+            new_facts[self.fact_socket] = socket_path if bound else None
+        if new_facts:
+            result['ansible_facts'] = new_facts
+
+    def _run_in_process(self, module_name, args, socket_path):
+        # Result of the main() of the module run in this process
+        result = {}
+        module = load_module(module_name)
+        in_process = type('InProcessModule', (InProcessModule,), {
+            'name': module_name, 'args': args, 'socket_path': socket_path,
+            'check_mode_requested': bool(self._task.check_mode),
+            'diff': bool(self._task.diff)})
+        module.AnsibleModule = in_process
+        try:
+            module.main()
+            result.update(failed=True, msg="%s returned without a result" % module_name)
+        except ModuleExit as err:
+            result.update(err.result)
+        except Exception as err:
+            result.update(failed=True, msg="%s failed: %s" % (module_name, to_text(err)),
+                          exception=traceback.format_exc())
+        result.setdefault('changed', False)
+        return result
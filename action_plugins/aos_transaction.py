@@ -0,0 +1,34 @@
+#!/usr/bin/python3
+'''
+Action plugin running the aos_transaction module in process, see aos_module
+'''
+
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible.plugins.loader import action_loader
+
+
+# The base is loaded by the plugin loader, action plugins of a role are not
+# importable from each other
+class ActionModule(action_loader.get('aos_module', class_only=True)):
+    # Set by the begin task of aos_transaction
+    fact_args = {'transaction_id': 'aos_transaction_id'}
+    fact_socket = 'aos_transaction_socket'
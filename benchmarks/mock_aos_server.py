@@ -0,0 +1,570 @@
+#!/usr/bin/python3
+'''
+Stand-in for the AOS8 REST API (/v1) used to exercise and benchmark the
+modules of this role without a Mobility Conductor
+'''
+
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import copy
+import gzip
+import json
+import random
+import re
+import threading
+import time
+import uuid
+import zlib
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import urlparse, parse_qs
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import urlparse, parse_qs
+
+# Key parameter of the multi-instance objects known to the mock. Any other
+# configuration object is treated as a single-instance object.
+MULTI_INSTANCE_KEYS = {
+    'aaa_prof': 'profile-name',
+    'ap_group': 'profile-name',
+    'ap_sys_prof': 'profile-name',
+    'dot1x_auth_profile': 'profile-name',
+    'int_gig': 'id',
+    'int_pc': 'id',
+    'int_vlan': 'id',
+    'mgmt_user_cfg_int': 'name',
+    'netdst': 'dstname',
+    'rad_server': 'rad_server_name',
+    'server_group_prof': 'sg_name',
+    'ssid_prof': 'profile-name',
+    'syslog_server': 'ipaddr',
+    'tacacs_server': 'tacacs_server_name',
+    'user_role': 'rname',
+    'virtual_ap': 'profile-name',
+    'vlan_id': 'id',
+    'vlan_name': 'name',
+    'vlan_name_id': 'name',
+}
+
+# Objects that trigger an action instead of being stored in the configuration
+ACTION_OBJECTS = ('write_memory', 'wdb_cpsec_add_mac', 'wdb_cpsec_del_mac',
+                  'wdb_cpsec_modify_mac', 'copy_scp_system', 'copy_tftp_system',
+                  'copy_flash_tftp', 'reload', 'configuration_node')
+
+
+def success(status_str="Success"):
+    return {"status": 0, "status_str": status_str}
+
+
+def failure(status_str):
+    return {"status": 1, "status_str": status_str}
+
+
+class MockController(object):
+    '''
+    In-memory model of the configuration hierarchy of a Mobility Conductor
+    '''
+
+    def __init__(self, config_size=0, latency=0.0, error_rate=0.0, image_copy_time=2.0,
+                 object_error_rate=0.0, reject_object_filter=False, blocking_copy=False):
+        self.lock = threading.RLock()
+        self.reject_object_filter = reject_object_filter
+        self.blocking_copy = blocking_copy
+        self.latency = latency
+        self.error_rate = error_rate
+        self.object_error_rate = object_error_rate
+        self.image_copy_time = image_copy_time
+        self.sessions = set()
+        self.nodes = ['/md', '/mm', '/mm/mynode']
+        self.config = {'/md': {}, '/mm': {'hostname': {'hostname': 'mock-mm'}},
+                       '/mm/mynode': {}}
+        self.pending = set()
+        self.whitelist = {}
+        self.copy_started = None
+        self.copy_partition = None
+        self.copy_version = None
+        self.partitions = {'partition0': '8.6.0.0', 'partition1': None}
+        self.boot_partition = 'partition0'
+        self.stats = {}
+        self.reset_stats()
+        self.populate(config_size)
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {'requests': 0, 'connections': 0, 'logins': 0, 'bytes_in': 0,
+                          'bytes_out': 0, 'write_memory': 0, 'by_endpoint': {}}
+
+    def populate(self, config_size):
+        # Pad /md with netdst objects so that full-config dumps have a
+        # realistic size, roughly config_size bytes
+        if not config_size:
+            return
+        entries = []
+        size = 0
+        while size < config_size:
+            index = len(entries)
+            entry = {'dstname': 'mock-netdst-%05d' % index,
+                     'netdst__host': [{'address': '10.%d.%d.%d' % (
+                         (index >> 16) & 255, (index >> 8) & 255, index & 255)}]}
+            entries.append(entry)
+            size += len(json.dumps(entry)) + 2
+        self.config['/md']['netdst'] = entries
+
+    # ---------------------------------------------------------------- nodes
+
+    def add_node(self, node_path):
+        with self.lock:
+            node_path = node_path.rstrip('/')
+            parts = node_path.split('/')
+            for pos in range(2, len(parts) + 1):
+                path = '/'.join(parts[:pos])
+                if path not in self.config:
+                    self.nodes.append(path)
+                    self.config[path] = {}
+
+    def hierarchy(self):
+        root = {'name': '/', 'type': 'root', 'childnodes': []}
+
+        def child(parent, name, node_type):
+            for node in parent['childnodes']:
+                if node['name'] == name:
+                    return node
+            node = {'name': name, 'type': node_type, 'childnodes': []}
+            parent['childnodes'].append(node)
+            return node
+
+        for path in sorted(self.nodes):
+            parent = root
+            for name in path.strip('/').split('/'):
+                parent = child(parent, name, 'mynode' if name == 'mynode' else 'group')
+        return root
+
+    # -------------------------------------------------------------- objects
+
+    def get_objects(self, config_path, names=None, offset=0, limit=None):
+        # Pages are sliced before the copy so that paging through a large
+        # object does not cost a copy of the whole object per request
+        with self.lock:
+            config = self.config.get(config_path)
+            if config is None:
+                return None, {}
+            config = self.inherit(config_path, config, names)
+            objects = {}
+            totals = {}
+            for key, value in config.items():
+                if names is not None and key not in names:
+                    continue
+                if isinstance(value, list):
+                    totals[key] = len(value)
+                    if limit is not None:
+                        value = value[offset:offset + limit]
+                objects[key] = copy.deepcopy(value)
+            return objects, totals
+
+    def inherit(self, config_path, config, names=None):
+        # Configuration of config_path with the instances of the nodes above
+        # it it does not configure itself, flagged as inherited
+        ancestors = [path for path in self.config
+                     if path != config_path and config_path.startswith(path + '/')]
+        if not ancestors:
+            return config
+        merged = dict(config)
+        for path in sorted(ancestors, key=len, reverse=True):
+            for name, value in self.config[path].items():
+                if names is not None and name not in names:
+                    continue
+                key_name = MULTI_INSTANCE_KEYS.get(name)
+                if key_name is None:
+                    if name not in merged:
+                        merged[name] = dict(value, _flags={'inherited': True})
+                    continue
+                entries = list(merged.get(name, []))
+                keys = set(str(entry.get(key_name)) for entry in entries)
+                entries.extend(dict(entry, _flags={'inherited': True}) for entry in value
+                               if str(entry.get(key_name)) not in keys)
+                merged[name] = entries
+        return merged
+
+    def apply(self, config_path, name, instance):
+        '''
+        Apply a single object instance to the configuration of config_path.
+        Returns the _result to embed in the response.
+        '''
+        if name in ACTION_OBJECTS:
+            return self.action(config_path, name, instance)
+        if not isinstance(instance, dict):
+            return failure("Invalid payload for %s" % name)
+        if self.object_error_rate and random.random() < self.object_error_rate:
+            return failure("Configuration is locked by another session")
+        if name == 'vlan_id' and not 1 <= int(instance.get('id', 0)) <= 4094:
+            return failure("Invalid VLAN ID %s" % instance.get('id'))
+        action = instance.get('_action', 'add')
+        body = dict((key, value) for key, value in instance.items()
+                    if not key.startswith('_'))
+        with self.lock:
+            config = self.config.setdefault(config_path, {})
+            key_name = MULTI_INSTANCE_KEYS.get(name)
+            if key_name is None:
+                if action == 'delete':
+                    config.pop(name, None)
+                elif action == 'modify' or name in config:
+                    config.setdefault(name, {}).update(body)
+                else:
+                    config[name] = body
+            else:
+                if key_name not in body:
+                    return failure("Missing key %s for %s" % (key_name, name))
+                entries = config.setdefault(name, [])
+                match = [entry for entry in entries
+                         if str(entry.get(key_name)) == str(body[key_name])]
+                if action == 'delete':
+                    for entry in match:
+                        entries.remove(entry)
+                    if not entries:
+                        config.pop(name)
+                elif match:
+                    match[0].update(body)
+                else:
+                    entries.append(body)
+            self.pending.add(config_path)
+        return success()
+
+    def action(self, config_path, name, instance):
+        with self.lock:
+            if name == 'write_memory':
+                self.stats['write_memory'] += 1
+                self.pending.discard(config_path)
+            elif name == 'wdb_cpsec_add_mac':
+                self.whitelist[instance['name'].lower()] = dict(instance)
+            elif name == 'wdb_cpsec_modify_mac':
+                if instance['name'].lower() not in self.whitelist:
+                    return failure("Entry %s does not exist" % instance['name'])
+                self.whitelist[instance['name'].lower()].update(instance)
+            elif name == 'wdb_cpsec_del_mac':
+                if self.whitelist.pop(instance['name'].lower(), None) is None:
+                    return failure("Entry %s does not exist" % instance['name'])
+            elif name == 'configuration_node':
+                self.add_node(instance['node-path'])
+            elif name.startswith('copy_'):
+                self.copy_started = time.time()
+                self.copy_partition = instance.get('partition_num', 'partition1')
+                version = re.search(r'\d+\.\d+\.\d+\.\d+', str(instance.get('filename')))
+                self.copy_version = version.group(0) if version else '8.6.0.0'
+        return success()
+
+    def copy_done(self):
+        '''
+        True once the image copy is over, the copied partition then holds the
+        new image and becomes the default boot partition
+        '''
+        with self.lock:
+            if self.copy_started is None or \
+                    time.time() - self.copy_started < self.image_copy_time:
+                return False
+            if self.copy_version:
+                self.partitions[self.copy_partition] = self.copy_version
+                self.boot_partition = self.copy_partition
+                self.copy_version = None
+            return True
+
+    def post(self, config_path, url_object, payload):
+        if url_object:
+            payload = {url_object: payload}
+        parts = payload.get('_list', [payload]) if isinstance(payload, dict) else []
+        response_parts = []
+        status = 0
+        for part in parts:
+            response_part = {}
+            for name, value in part.items():
+                if name.startswith('_'):
+                    continue
+                instances = value if isinstance(value, list) else [value]
+                results = []
+                for instance in instances:
+                    result = self.apply(config_path, name, instance)
+                    status = status or result['status']
+                    echoed = dict(instance) if isinstance(instance, dict) else {}
+                    echoed['_result'] = result
+                    results.append(echoed)
+                response_part[name] = results if isinstance(value, list) else results[0]
+            response_parts.append(response_part)
+        if '_list' in payload:
+            response = {'_list': response_parts}
+        else:
+            response = response_parts[0] if response_parts else {}
+        global_result = success() if status == 0 else failure("Failed to apply configuration")
+        global_result['_pending'] = config_path in self.pending
+        response['_global_result'] = global_result
+        return response
+
+    # --------------------------------------------------------- show command
+
+    def show(self, command):
+        command = ' '.join(command.split()).lower()
+        if command == 'show version':
+            return {'_data': ['Aruba Operating System Software.',
+                              'ArubaOS (MODEL: MOCK-MM), Version 8.6.0.0']}
+        if command == 'show hostname':
+            return {'_data': ['Hostname is mock-mm']}
+        if command == 'show inventory':
+            return {'_data': ['System Serial# : MOCK0000001',
+                              'SC Model# : MOCK-MM',
+                              'Mgmt Port HW MAC Address : 00:0b:86:00:00:01']}
+        if command == 'show ip interface brief':
+            return {'IP Interface List': [
+                {'Interface': 'vlan 1', 'IP Address / IP Netmask': '127.0.0.1/255.0.0.0',
+                 'Admin': 'up', 'Protocol': 'up', 'VRRP': 'No'}]}
+        if command == 'show switches':
+            return {'All Switches': [{'IP Address': '127.0.0.1', 'Name': 'mock-mm',
+                                      'Type': 'conductor', 'Version': '8.6.0.0'}]}
+        if command.startswith('show ap database'):
+            return {'AP Database': [{'Name': 'ap-%d' % index, 'Group': 'default',
+                                     'Status': 'Up'} for index in range(20)]}
+        if command == 'show whitelist-db cpsec':
+            with self.lock:
+                return {'Control-Plane Security Whitelist-entry Details': [
+                    {'MAC-Address': mac, 'AP-Group': entry.get('ap_group'),
+                     'AP-Name': entry.get('ap_name'), 'Description': entry.get('description')}
+                    for mac, entry in sorted(self.whitelist.items())]}
+        if command == 'show image version':
+            self.copy_done()
+            lines = []
+            with self.lock:
+                for index, partition in enumerate(sorted(self.partitions)):
+                    lines.append('Partition : 0:%d (/dev/usb/flash%d)%s' % (
+                        index, index + 1,
+                        ' **Default boot**' if partition == self.boot_partition else ''))
+                    lines.append('Software Version : ArubaOS %s' % (
+                        self.partitions[partition] or 'none'))
+            return {'_data': lines}
+        if command.startswith('show copy'):
+            if self.copy_started is None:
+                return {'_data': ['No copy in progress']}
+            if self.copy_done():
+                return {'_data': ['Copy status: Completed']}
+            percent = int(100 * (time.time() - self.copy_started) / self.image_copy_time)
+            return {'_data': ['Copy status: In progress %d%%' % percent]}
+        return {'_data': ['Output of %s' % command]}
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    controller = None
+
+    def log_message(self, *args):
+        pass
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        with self.controller.lock:
+            self.controller.stats['connections'] += 1
+
+    def reply(self, code, body, headers=None):
+        data = json.dumps(body).encode('utf-8')
+        raw_length = len(data)
+        encoding = None
+        accepted = self.headers.get('Accept-Encoding', '')
+        if 'gzip' in accepted:
+            data = gzip.compress(data) if hasattr(gzip, 'compress') else zlib.compress(data)
+            encoding = 'gzip'
+        elif 'deflate' in accepted:
+            data = zlib.compress(data)
+            encoding = 'deflate'
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(data)
+        with self.controller.lock:
+            stats = self.controller.stats
+            stats['bytes_out'] += len(data)
+            stats['raw_bytes_out'] = stats.get('raw_bytes_out', 0) + raw_length
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        body = self.rfile.read(length) if length else b''
+        with self.controller.lock:
+            self.controller.stats['bytes_in'] += len(body) + len(self.path)
+        return body
+
+    def record(self, endpoint):
+        with self.controller.lock:
+            stats = self.controller.stats
+            stats['requests'] += 1
+            stats['by_endpoint'][endpoint] = stats['by_endpoint'].get(endpoint, 0) + 1
+
+    def session(self, query):
+        token = query.get('UIDARUBA', [None])[0]
+        cookie = self.headers.get('Cookie') or ''
+        if not token and 'SESSION=' in cookie:
+            token = cookie.split('SESSION=')[1].split(';')[0]
+        return token in self.controller.sessions
+
+    def do_GET(self):
+        self.handle_request('GET')
+
+    def do_POST(self):
+        self.handle_request('POST')
+
+    def handle_request(self, method):
+        controller = self.controller
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        body = self.read_body()
+        path = url.path
+
+        if path.startswith('/mock/'):
+            if path == '/mock/reset':
+                controller.reset_stats()
+            return self.reply(200, controller.stats)
+
+        self.record(method + ' ' + path)
+        if controller.latency:
+            time.sleep(controller.latency)
+
+        if path == '/v1/api/login':
+            if method == 'POST':
+                query.update(parse_qs(body.decode('utf-8')))
+            if query.get('password', [None])[0] is None:
+                return self.reply(401, {'_global_result': failure('Authentication failed')})
+            token = uuid.uuid4().hex
+            with controller.lock:
+                controller.sessions.add(token)
+                controller.stats['logins'] += 1
+            return self.reply(200, {'_global_result': {
+                'status': '0', 'status_str': "You've logged in successfully.",
+                'UIDARUBA': token}}, headers={'Set-Cookie': 'SESSION=%s' % token})
+
+        if not self.session(query):
+            return self.reply(401, {'Error': 'Unauthorized'})
+
+        if controller.error_rate and random.random() < controller.error_rate:
+            with controller.lock:
+                controller.stats['injected_errors'] = controller.stats.get('injected_errors', 0) + 1
+            if method == 'POST':
+                return self.reply(200, {'_global_result': failure(
+                    'Configuration is locked by another session, try again later')})
+            return self.reply(503, {'Error': 'Service Unavailable'})
+
+        if path == '/v1/api/logout':
+            return self.reply(200, {'_global_result': success('You have been logged out')})
+
+        config_path = query.get('config_path', ['/md'])[0]
+        if path == '/v1/configuration/showcommand':
+            return self.reply(200, controller.show(query.get('command', [''])[0]))
+
+        prefix = '/v1/configuration/object'
+        if not path.startswith(prefix):
+            return self.reply(404, {'Error': 'Not found'})
+        url_object = path[len(prefix):].strip('/')
+
+        if method == 'POST':
+            try:
+                payload = json.loads(body.decode('utf-8')) if body else {}
+            except ValueError:
+                return self.reply(400, {'Error': 'Invalid JSON'})
+            result = controller.post(config_path, url_object, payload)
+            if controller.blocking_copy and url_object.startswith('copy_'):
+                # Answered once the image is copied, like some controllers
+                time.sleep(controller.image_copy_time)
+            return self.reply(200, result)
+
+        if url_object == 'node_hierarchy':
+            return self.reply(200, controller.hierarchy())
+
+        names = None
+        if url_object and url_object != 'config':
+            names = [url_object]
+        if 'filter' in query:
+            for flt in json.loads(query['filter'][0]) or []:
+                if 'OBJECT' in flt:
+                    if self.controller.reject_object_filter:
+                        return self.reply(400, {'Error': 'Invalid filter'})
+                    names = [name.split('.')[0] for name in flt['OBJECT'].get('$eq', [])]
+        paged = url_object and url_object != 'config' and 'limit' in query
+        objects, totals = controller.get_objects(
+            config_path, names, offset=int(query.get('offset', ['0'])[0]) if paged else 0,
+            limit=int(query['limit'][0]) if paged else None)
+        if objects is None:
+            return self.reply(200, {'Error': 'Invalid config_path %s' % config_path})
+        if url_object and url_object != 'config':
+            return self.reply(200, {'_data': {url_object: objects.get(url_object, [])},
+                                    '_meta': {'total': totals.get(url_object, 0)}})
+        return self.reply(200, {'_data': objects})
+
+
+class ThreadedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(port, controller, certfile=None):
+    handler = type('BoundHandler', (Handler,), {'controller': controller})
+    server = ThreadedServer(('127.0.0.1', port), handler)
+    if certfile:
+        import ssl
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(certfile)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=4343)
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='Seconds added to every request')
+    parser.add_argument('--error-rate', type=float, default=0.0,
+                        help='Fraction of authenticated requests answered with a 503 '
+                             'or a configuration locked error')
+    parser.add_argument('--object-error-rate', type=float, default=0.0,
+                        help='Fraction of the objects of a POST failing with a '
+                             'configuration locked _result')
+    parser.add_argument('--config-size', type=int, default=0,
+                        help='Approximate size in bytes of the /md configuration')
+    parser.add_argument('--image-copy-time', type=float, default=2.0,
+                        help='Seconds an image copy takes')
+    parser.add_argument('--reject-object-filter', action='store_true',
+                        help='Answer GETs with an OBJECT filter with a 400, like '
+                             'controllers which do not support it')
+    parser.add_argument('--blocking-copy', action='store_true',
+                        help='Answer an image copy request only once the copy is over')
+    parser.add_argument('--certfile', default=None,
+                        help='PEM file with certificate and key to serve HTTPS')
+    args = parser.parse_args()
+    controller = MockController(config_size=args.config_size, latency=args.latency,
+                                error_rate=args.error_rate,
+                                object_error_rate=args.object_error_rate,
+                                image_copy_time=args.image_copy_time,
+                                reject_object_filter=args.reject_object_filter,
+                                blocking_copy=args.blocking_copy)
+    serve(args.port, controller, args.certfile).serve_forever()
+
+
+if __name__ == '__main__':
+    main()
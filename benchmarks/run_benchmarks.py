@@ -0,0 +1,249 @@
+#!/usr/bin/python3
+'''
+End-to-end benchmarks of the modules of this role against the mock AOS8
+REST server, reporting per task the HTTP round trips, connections, bytes transferred,
+wall time and peak memory
+'''
+
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ET
+
+from mock_aos_server import MockController, serve
+
+ROLE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROLE_NAME = 'aos-wlan-ansible-role'
+MEASURED_TASK = 'benchmark'
+
+ANSIBLE_CFG = """[defaults]
+roles_path = {roles_path}
+host_key_checking = False
+retry_files_enabled = False
+callbacks_enabled = junit
+callback_whitelist = junit
+[persistent_connection]
+command_timeout = 120
+"""
+
+
+def get_scenarios(args):
+    '''
+    Name, setup tasks and measured task of every benchmark, with the
+    settings of its mock controller and its play vars when it needs them
+    '''
+    macs = [{'mac': 'AA:BB:CC:%02X:%02X:%02X' % (i >> 16 & 255, i >> 8 & 255, i & 255),
+             'ap_name': 'bench-ap%d' % i} for i in range(args.aps)]
+    # The mock pads /md with netdst objects, the payload uses another object
+    # so that scoped idempotency only fetches what it posts
+    servers = [{'rad_server': [{'rad_server_name': 'bench-radius%d' % i,
+                                'rad_host': {'host': '10.%d.%d.1' % (i >> 8 & 255, i & 255)}}
+                               for i in range(args.servers)]}]
+    vlan_ids = '2-%d' % (args.vlans + 1)
+    return [
+        ('aos_api_config POST (scoped)', [], {
+            'aos_api_config': {'method': 'POST', 'config_path': '/md', 'data': servers}}),
+        ('aos_api_config POST (full)', [], {
+            'aos_api_config': {'method': 'POST', 'config_path': '/md', 'data': servers,
+                               'idempotency': 'full'}}),
+        ('aos_api_config POST (no change)', [{
+            'aos_api_config': {'method': 'POST', 'config_path': '/md', 'data': servers}}], {
+                'aos_api_config': {'method': 'POST', 'config_path': '/md', 'data': servers}}),
+        ('aos_api_config GET netdst', [], {
+            'aos_api_config': {'method': 'GET', 'config_path': '/md', 'api_object': 'netdst'}}),
+        ('aos_api_config GET netdst (paginate)', [], {
+            'aos_api_config': {'method': 'GET', 'config_path': '/md', 'api_object': 'netdst',
+                               'paginate': True}}),
+        ('aos_vlan create %d' % args.vlans, [], {
+            'aos_vlan': {'action': 'create', 'vlan_id': vlan_ids, 'config_path': '/md'}}),
+        ('aos_vlan create %d (no change)' % args.vlans, [{
+            'aos_vlan': {'action': 'create', 'vlan_id': vlan_ids, 'config_path': '/md'}}], {
+                'aos_vlan': {'action': 'create', 'vlan_id': vlan_ids, 'config_path': '/md'}}),
+        ('aos_cap_whitelist add %d' % args.aps, [], {
+            'aos_cap_whitelist': {'action': 'add', 'entries': macs}}),
+        ('aos_show_command x%d' % args.commands, [], {
+            'aos_show_command': {'commands': ['show version', 'show switches',
+                                              'show ap database long', 'show clock'] *
+                                             (args.commands // 4) +
+                                             ['show version'] * (args.commands % 4)}}),
+        # The copy request is only answered once the image is copied, after
+        # the command timeout of the persistent connection
+        ('aos_firmware_upgrade copy (blocking)', [], {
+            'aos_firmware_upgrade': {'action': 'copy', 'host': '10.1.1.1', 'username': 'admin',
+                                     'password': 'password',
+                                     'filename': 'ArubaOS_70xx_8.7.0.0_74441', 'wait': True,
+                                     'request_timeout': 5, 'poll_interval': 2,
+                                     'poll_interval_max': 4}},
+         {'mock': {'image_copy_time': args.copy_time, 'blocking_copy': True},
+          'vars': {'ansible_command_timeout': 10}}),
+    ]
+
+
+def write_playbook(path, port, setup, task, play_vars=None):
+    '''
+    Playbook opening the connection, running the setup tasks, then the task
+    measured between a reset and a read of the mock server counters
+    '''
+    local = {'delegate_to': 'localhost', 'vars': {'ansible_connection': 'local'}}
+    mock_url = 'http://127.0.0.1:%d/mock/' % port
+    tasks = [{'name': 'login', 'aos_show_command': {'command': 'show clock'}}]
+    tasks.extend(setup)
+    tasks.append(dict(local, name='reset counters', uri={'url': mock_url + 'reset'}))
+    tasks.append(dict(task, name=MEASURED_TASK))
+    tasks.append(dict(local, name='read counters', register='mock_stats',
+                      uri={'url': mock_url + 'stats'}))
+    tasks.append(dict(local, name='save counters',
+                      copy={'content': '{{ mock_stats.json | to_json }}',
+                            'dest': path + '.stats'}))
+    play = {'hosts': 'all', 'gather_facts': False, 'roles': [{'role': ROLE_NAME}],
+            'vars': play_vars or {}, 'tasks': tasks}
+    with open(path, 'w') as playbook:
+        json.dump([play], playbook, indent=2)
+
+
+def get_task_time(junit_dir):
+    '''
+    Duration in seconds of the measured task from the junit callback reports
+    '''
+    for name in os.listdir(junit_dir):
+        for case in ET.parse(os.path.join(junit_dir, name)).iter('testcase'):
+            # name is "[host] play: task module arguments"
+            if (': ' + MEASURED_TASK + ' ') in case.get('name', '') + ' ':
+                return float(case.get('time', 0))
+    return None
+
+
+def run_scenario(workdir, port, index, setup, task, play_vars=None):
+    '''
+    Run the playbook of a scenario, return its measures or an error
+    '''
+    path = os.path.join(workdir, 'scenario%d.json' % index)
+    junit_dir = os.path.join(workdir, 'junit%d' % index)
+    write_playbook(path, port, setup, task, play_vars)
+    env = dict(os.environ, ANSIBLE_CONFIG=os.path.join(workdir, 'ansible.cfg'),
+               JUNIT_OUTPUT_DIR=junit_dir, ANSIBLE_NOCOLOR='1')
+    with open(path + '.log', 'w') as log:
+        start = time.time()
+        process = subprocess.Popen(['ansible-playbook', '-i', os.path.join(workdir, 'inventory.json'),
+                                    path], env=env, stdout=log, stderr=subprocess.STDOUT)
+        # wait4 gives the peak RSS of ansible-playbook and of its workers and
+        # modules, the persistent connection process is detached from it
+        _, status, rusage = os.wait4(process.pid, 0)
+        process.returncode = status
+        elapsed = time.time() - start
+    if status != 0 or not os.path.exists(path + '.stats'):
+        return {'error': 'ansible-playbook failed, see ' + path + '.log'}
+    with open(path + '.stats') as stats_file:
+        stats = json.load(stats_file)
+    stats.pop('by_endpoint', None)
+    maxrss = rusage.ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+    return {'round_trips': stats['requests'], 'connections': stats['connections'],
+            'bytes_in': stats['bytes_in'],
+            'bytes_out': stats['bytes_out'], 'write_memory': stats['write_memory'],
+            'task_time': get_task_time(junit_dir), 'playbook_time': elapsed,
+            'peak_rss_mb': maxrss / (1024.0 * 1024.0)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=18443)
+    parser.add_argument('--latency', type=float, default=0.05,
+                        help='Seconds added by the mock server to every request')
+    parser.add_argument('--config-size', type=int, default=1000000,
+                        help='Approximate size in bytes of the /md configuration')
+    parser.add_argument('--vlans', type=int, default=500, help='VLANs created by aos_vlan')
+    parser.add_argument('--aps', type=int, default=1000,
+                        help='Access Points whitelisted by aos_cap_whitelist')
+    parser.add_argument('--servers', type=int, default=200,
+                        help='RADIUS servers posted by aos_api_config')
+    parser.add_argument('--commands', type=int, default=16,
+                        help='Show commands run by aos_show_command')
+    parser.add_argument('--copy-time', type=float, default=30,
+                        help='Seconds the image copy of aos_firmware_upgrade takes')
+    parser.add_argument('--only', default=None,
+                        help='Only run the scenarios whose name contains this text')
+    parser.add_argument('--json', default=None, help='Also write the results to this file')
+    parser.add_argument('--keep', action='store_true',
+                        help='Keep the playbooks and logs in the work directory')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='aos-bench-')
+    os.mkdir(os.path.join(workdir, 'roles'))
+    os.symlink(ROLE_DIR, os.path.join(workdir, 'roles', ROLE_NAME))
+    with open(os.path.join(workdir, 'ansible.cfg'), 'w') as cfg:
+        cfg.write(ANSIBLE_CFG.format(roles_path=os.path.join(workdir, 'roles')))
+    with open(os.path.join(workdir, 'inventory.json'), 'w') as inventory:
+        json.dump({'all': {'hosts': {'controller': {
+            'ansible_host': '127.0.0.1', 'ansible_user': 'admin',
+            'ansible_password': 'password', 'ansible_connection': 'httpapi',
+            'ansible_network_os': 'aos', 'ansible_httpapi_port': args.port,
+            'ansible_httpapi_use_ssl': False, 'ansible_httpapi_validate_certs': False,
+            'ansible_python_interpreter': sys.executable}}}}, inventory)
+
+    results = []
+    for index, scenario in enumerate(get_scenarios(args)):
+        name, setup, task = scenario[:3]
+        options = scenario[3] if len(scenario) > 3 else {}
+        if args.only and args.only not in name:
+            continue
+        # Fresh controller for every scenario so that they do not depend on each other
+        controller = MockController(config_size=args.config_size, latency=args.latency,
+                                    **options.get('mock', {}))
+        server = serve(args.port, controller)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            result = run_scenario(workdir, args.port, index, setup, task, options.get('vars'))
+        finally:
+            server.shutdown()
+            server.server_close()
+        result['name'] = name
+        results.append(result)
+        if 'error' in result:
+            print('%-36s %s' % (name, result['error']))
+        else:
+            print('%(name)-36s %(round_trips)6d trips %(connections)4d conns'
+                  ' %(bytes_in)10d B in %(bytes_out)10d B out'
+                  ' %(task_time)8.3f s task %(playbook_time)8.3f s run %(peak_rss_mb)7.1f MB'
+                  % result)
+        sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, 'w') as output:
+            json.dump({'parameters': vars(args), 'results': results}, output, indent=2)
+    if args.keep:
+        print('Playbooks and logs kept in ' + workdir)
+    else:
+        shutil.rmtree(workdir)
+    return 1 if any('error' in result for result in results) else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
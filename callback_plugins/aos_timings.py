@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+'''
+Callback Ansible plugin aggregating the request timings returned by the
+AOS modules into a latency table per host and endpoint
+'''
+
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+DOCUMENTATION = """
+---
+author: Aruba Networks
+callback: aos_timings
+callback_type: aggregate
+short_description: Latency percentiles of the requests sent by the AOS modules
+description:
+  - Collects the timings returned by the modules of the role for every request
+    sent to the controllers, and prints at the end of the playbook a table of
+    the number of requests, p50, p95, p99 and maximum latency, bytes
+    transferred and compression ratio of the responses per host and endpoint
+    (method and path without query string).
+  - Retries are counted as separate requests.
+  - The percentiles need every request in the results, set the
+    ansible_aos_request_timings variable of the hosts to requests. Otherwise
+    the table is built from the totals per endpoint of every task.
+requirements:
+  - enable in ansible.cfg with callbacks_enabled (callback_whitelist before
+    Ansible 2.11) and add the callback_plugins directory of the role to
+    callback_plugins
+options:
+  output_file:
+    description:
+      - Path of a JSON file the aggregated timings and the raw request timings
+        are also written to.
+    env:
+      - name: ANSIBLE_AOS_TIMINGS_FILE
+    ini:
+      - section: callback_aos_timings
+        key: output_file
+    type: path
+"""
+
+import json
+
+from ansible.plugins.callback import CallbackBase
+
+
+def percentile(values, percent):
+    """
+    Nearest-rank percentile of a sorted list of values
+    """
+    if not values:
+        return 0.0
+    rank = int(round(percent / 100.0 * len(values) + 0.5)) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+class CallbackModule(CallbackBase):
+    CALLBACK_VERSION = 2.0
+    CALLBACK_TYPE = 'aggregate'
+    CALLBACK_NAME = 'aos_timings'
+    CALLBACK_NEEDS_WHITELIST = True
+    CALLBACK_NEEDS_ENABLED = True
+
+    def __init__(self, *args, **kwargs):
+        super(CallbackModule, self).__init__(*args, **kwargs)
+        self.requests = {}
+        self.endpoints = {}
+        self.output_file = None
+
+    def set_options(self, *args, **kwargs):
+        super(CallbackModule, self).set_options(*args, **kwargs)
+        self.output_file = self.get_option('output_file')
+
+    def _record(self, result):
+        timings = result._result.get('timings')
+        if not isinstance(timings, dict):
+            return
+        host = result._host.get_name()
+        task = result._task.get_name()
+        if 'requests' not in timings:
+            # Only the totals per endpoint of the task
+            endpoints = self.endpoints.setdefault(host, {})
+            for endpoint, values in (timings.get('by_endpoint') or {}).items():
+                totals = endpoints.setdefault(endpoint, {})
+                for key, value in values.items():
+                    totals[key] = max(totals.get(key, 0), value) if key == 'max' \
+                        else totals.get(key, 0) + value
+            return
+        for request in timings['requests']:
+            request = dict(request, task=task)
+            self.requests.setdefault(host, []).append(request)
+
+    def v2_runner_on_ok(self, result):
+        self._record(result)
+
+    def v2_runner_on_failed(self, result, ignore_errors=False):
+        self._record(result)
+
+    # The result of a loop only holds the results of its items, which are
+    # recorded one by one
+    def v2_runner_item_on_ok(self, result):
+        self._record(result)
+
+    def v2_runner_item_on_failed(self, result):
+        self._record(result)
+
+    def aggregate(self):
+        """
+        Statistics per host and endpoint of the collected requests
+        """
+        summary = {}
+        for host, endpoints in self.endpoints.items():
+            summary[host] = dict((endpoint, dict(values, time=round(values['time'], 4),
+                                                 p50=None, p95=None, p99=None))
+                                 for endpoint, values in endpoints.items())
+        for host, requests in self.requests.items():
+            endpoints = {}
+            for request in requests:
+                endpoints.setdefault(request['method'] + ' ' + request['path'], []).append(request)
+            summary.setdefault(host, {})
+            for endpoint, entries in endpoints.items():
+                latencies = sorted(entry['latency'] for entry in entries)
+                summary[host][endpoint] = {
+                    'count': len(entries),
+                    'errors': len([entry for entry in entries
+                                   if entry.get('status') is None or entry['status'] >= 400]),
+                    'time': round(sum(latencies), 4),
+                    'p50': percentile(latencies, 50),
+                    'p95': percentile(latencies, 95),
+                    'p99': percentile(latencies, 99),
+                    'max': latencies[-1],
+                    'request_bytes': sum(entry.get('request_bytes') or 0 for entry in entries),
+                    'response_bytes': sum(entry.get('response_bytes') or 0 for entry in entries),
+                    'wire_bytes': sum(entry.get('wire_bytes', entry.get('response_bytes')) or 0
+                                      for entry in entries),
+                }
+        return summary
+
+    def v2_playbook_on_stats(self, stats):
+        if not self.requests and not self.endpoints:
+            return
+        summary = self.aggregate()
+        self._display.banner('AOS REQUEST TIMINGS')
+        header = '%-52s %6s %6s %8s %8s %8s %8s %9s %11s %6s' % (
+            'endpoint', 'count', 'errors', 'p50', 'p95', 'p99', 'max', 'sent', 'received',
+            'ratio')
+        for host in sorted(summary):
+            self._display.display(host + ':')
+            self._display.display(header)
+            endpoints = summary[host]
+            for endpoint in sorted(endpoints, key=lambda name: -endpoints[name]['time']):
+                values = endpoints[endpoint]
+                ratio = float(values['response_bytes']) / values['wire_bytes'] \
+                    if values['wire_bytes'] else 1.0
+                percentiles = ['%8s' % '-' if values[name] is None else '%8.3f' % values[name]
+                               for name in ('p50', 'p95', 'p99')]
+                self._display.display('%-52s %6d %6d %s %8.3f %9d %11d %6.1f' % (
+                    endpoint[:52], values['count'], values['errors'], ' '.join(percentiles),
+                    values['max'], values['request_bytes'], values['wire_bytes'], ratio))
+        if self.output_file:
+            try:
+                with open(self.output_file, 'w') as output:
+                    json.dump({'summary': summary, 'requests': self.requests}, output, indent=2)
+            except (IOError, OSError) as err:
+                self._display.warning('Unable to write %s: %s' % (self.output_file, str(err)))
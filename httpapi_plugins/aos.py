@@ -21,12 +21,40 @@ running on the Mobility Master and Standalone controllers
 # specific language governing permissions and limitations
 # under the License.
 
+import gzip
+import hashlib
 import json
-from ansible.module_utils._text import to_text
+import os
+import random
+import re
+import socket
+import ssl
+import sys
+import threading
+import time
+import uuid
+import zlib
+from collections import OrderedDict, deque
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+from ansible.errors import AnsibleError
+from ansible.module_utils._text import to_bytes, to_text
 from ansible.module_utils.connection import ConnectionError
+from ansible.module_utils.six.moves import http_client
 from ansible.module_utils.six.moves.urllib.error import HTTPError
+from ansible.module_utils.six.moves.urllib.parse import urlencode, urlparse, parse_qs
+from ansible.module_utils.six.moves.urllib.request import getproxies, proxy_bypass
+from ansible.module_utils.six.moves.urllib.response import addinfourl
+from ansible.parsing.vault import VaultLib, VaultSecret
 from ansible.plugins.httpapi import HttpApiBase
 
+try:
+    import ijson
+    HAS_IJSON = True
+except ImportError:
+    HAS_IJSON = False
+
+
 DOCUMENTATION = """
 ---
 author: Aruba Networks
@@ -36,24 +64,1209 @@ description:
   - This ArubaOS module provides REST interactions with ArubaOS Mobility Master
     and standalone controllers
 version_added: 2.8.1
+options:
+  config_cache:
+    type: bool
+    default: True
+    description:
+      - Keep the configuration snapshots fetched by the modules in the persistent
+        connection so that the next task on the same config_path does not
+        download them again. Entries are dropped by any POST to the node or to
+        one of its ancestors.
+    vars:
+      - name: ansible_aos_config_cache
+  config_cache_size:
+    type: int
+    default: 64
+    description:
+      - Maximum number of configuration snapshots kept in the cache.
+    vars:
+      - name: ansible_aos_config_cache_size
+  show_cache:
+    type: bool
+    default: False
+    description:
+      - Keep the results of the show commands run by aos_show_command in the
+        persistent connection for show_cache_ttl seconds, so that tasks running
+        the same command on the same host shortly after reuse them. Every
+        configuration POST on the connection empties the cache. Tasks can
+        also enable the cache or force a refresh with their own options.
+    vars:
+      - name: ansible_aos_show_cache
+  show_cache_ttl:
+    type: float
+    default: 30
+    description:
+      - Seconds a show command result is served from the cache.
+    vars:
+      - name: ansible_aos_show_cache_ttl
+  show_cache_size:
+    type: int
+    default: 32
+    description:
+      - Maximum number of show command results kept in the cache, the least
+        recently used are evicted first.
+    vars:
+      - name: ansible_aos_show_cache_size
+  session_cache:
+    type: bool
+    default: False
+    description:
+      - Keep the UIDARUBA session of the host and user in an encrypted file so
+        that later playbook runs reuse it instead of logging in again. A cached
+        session is checked with a show command before use and a new login is
+        done only when it has expired. Sessions are not logged out at the end
+        of the play when enabled.
+    vars:
+      - name: ansible_aos_session_cache
+  session_cache_dir:
+    type: path
+    default: ~/.ansible/aos_sessions
+    description:
+      - Directory of the session cache files. The files are encrypted with
+        ansible-vault using the password of the user as secret.
+    vars:
+      - name: ansible_aos_session_cache_dir
+  retries:
+    type: int
+    default: 5
+    description:
+      - Number of times a request is resent when the controller answers with a
+        retryable status (429, 502, 503, 504) or reports that the configuration
+        is locked. Other errors fail immediately.
+    vars:
+      - name: ansible_aos_retries
+  retry_backoff:
+    type: float
+    default: 0.5
+    description:
+      - Base delay in seconds of the exponential backoff between retries. The
+        delay before retry n is drawn at random between 0 and
+        retry_backoff * 2^n, capped by retry_backoff_max, or is the
+        Retry-After of the response when the controller sends one.
+    vars:
+      - name: ansible_aos_retry_backoff
+  retry_backoff_max:
+    type: float
+    default: 30
+    description:
+      - Maximum delay in seconds between two retries.
+    vars:
+      - name: ansible_aos_retry_backoff_max
+  rate_limit:
+    type: float
+    default: 20
+    description:
+      - Maximum number of requests per second sent to the host. The actual rate
+        adapts between rate_limit_min and this value, it is halved on every
+        retryable error and on responses slower than rate_limit_latency, and
+        grows back while the controller answers quickly. Set to 0 to disable.
+    vars:
+      - name: ansible_aos_rate_limit
+  rate_limit_min:
+    type: float
+    default: 1
+    description:
+      - Lowest request rate per second the adaptive rate limit can go down to.
+    vars:
+      - name: ansible_aos_rate_limit_min
+  rate_limit_latency:
+    type: float
+    default: 2
+    description:
+      - Response time in seconds above which the controller is considered
+        overloaded and the request rate is reduced.
+    vars:
+      - name: ansible_aos_rate_limit_latency
+  compression:
+    type: boolean
+    default: True
+    description:
+      - Ask the controller for gzip or deflate compressed responses. Bodies
+        sent uncompressed by firmwares which ignore the request are used as is.
+    vars:
+      - name: ansible_aos_compression
+  keepalive:
+    type: boolean
+    default: True
+    description:
+      - Send the requests over HTTP/1.1 keep-alive connections owned by the
+        plugin, one per concurrent worker, instead of a new connection and TLS
+        handshake per request. A new TLS connection resumes the session of the
+        previous one when the controller allows it. Requests go through the
+        connection of ansible-core when a proxy applies to the host.
+    vars:
+      - name: ansible_aos_keepalive
+  request_timings:
+    type: str
+    default: summary
+    choices:
+      - summary
+      - requests
+    description:
+      - Timings returned by the modules in their result. summary returns the
+        totals per endpoint of the requests of the task, requests also returns
+        every request, which the aos_timings callback needs for percentiles.
+    vars:
+      - name: ansible_aos_request_timings
 """
 
+# POST requests on these objects do not change the configuration tree
+NON_CONFIG_OBJECTS = ('write_memory',)
+
+# HTTP status codes of requests that can be resent, anything else is fatal
+RETRY_STATUS_CODES = (429, 502, 503, 504)
+RETRY_ERROR_RE = re.compile(r'config(uration)?[ _-]?lock|is locked|busy|try again', re.I)
+
+# Number of request timings kept by the connection for the tasks to collect
+TIMINGS_SIZE = 10000
+
+# Idle keep-alive connections kept open to a controller
+IDLE_CONNECTIONS = 8
+
+# Errors of a request on a keep-alive connection closed by the controller
+# while idle, the request is resent once on a new connection
+STALE_CONNECTION_ERRORS = (http_client.BadStatusLine, http_client.CannotSendRequest,
+                           socket.error, ssl.SSLError)
+
+# Top level keys of a response kept when only a subtree of it is decoded
+STATUS_KEYS = ('_global_result', '_meta', 'Error')
+
+def load_module_util(name):
+    """
+    Import the module_util name of the role as ansible.module_utils.name, as
+    the modules import it. Only AnsiballZ and the action plugins of the role
+    make the module_utils of a role importable.
+    """
+    fullname = 'ansible.module_utils.' + name
+    if fullname in sys.modules:
+        return sys.modules[fullname]
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                        'module_utils', name + '.py')
+    try:
+        from importlib.util import module_from_spec, spec_from_file_location
+    except ImportError:
+        # Python 2.7
+        import imp
+        return imp.load_source(fullname, path)
+    spec = spec_from_file_location(fullname, path)
+    module = module_from_spec(spec)
+    sys.modules[fullname] = module
+    spec.loader.exec_module(module)
+    return module
+
+aos_config = load_module_util('aos_config')
+
+def get_path_template(path):
+    """
+    Path of a request without its query string, where the session token,
+    config_path and filters are, so that timings group by endpoint
+    """
+    return urlparse(path).path
+
+def get_content_encoding(response):
+    headers = getattr(response, 'headers', None)
+    if headers is None:
+        return None
+    encoding = headers.get('Content-Encoding')
+    return encoding.strip().lower() if encoding else None
+
+def decompress_stream(stream, encoding):
+    """
+    Decompress the gzip or deflate body of the ResponseStream stream as it is
+    read, returns a ResponseStream of the decompressed body. The stream is
+    returned as is when its body is not compressed, as when the HTTP client
+    already decompressed it.
+    """
+    head = bytearray(stream.peek(2))
+    if encoding in ('gzip', 'x-gzip') and head == bytearray(b'\x1f\x8b'):
+        return ResponseStream(gzip.GzipFile(fileobj=stream, mode='rb'))
+    if encoding == 'deflate' and len(head) == 2 and head[0] & 0x0f == 8 and \
+            (head[0] * 256 + head[1]) % 31 == 0:
+        return ResponseStream(InflateStream(stream, zlib.MAX_WBITS))
+    if encoding == 'deflate' and head and head[:1] not in (bytearray(b'{'), bytearray(b'[')):
+        # Some servers send a raw deflate stream without the zlib header
+        return ResponseStream(InflateStream(stream, -zlib.MAX_WBITS))
+    return stream
+
+def iter_json_paths(stream, paths):
+    """
+    Incrementally decode the JSON document in stream and yield a (path,
+    value) pair for every value found at one of the dotted paths, as
+    prefixes of ijson, like _data.netdst.item for the items of a list.
+    Only the values at these paths are built in memory.
+    """
+    events = ijson.parse(stream, use_float=True)
+    for prefix, event, value in events:
+        if prefix not in paths or event in ('map_key', 'end_map', 'end_array'):
+            continue
+        if event not in ('start_map', 'start_array'):
+            yield prefix, value
+            continue
+        path = prefix
+        builder = ijson.ObjectBuilder()
+        depth = 1
+        while depth:
+            builder.event(event, value)
+            prefix, event, value = next(events)
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+        yield path, builder.value
+
+def is_json(stream):
+    # Whether the body in stream starts like a JSON document, from its first bytes
+    peek = getattr(stream, 'peek', None)
+    return peek is None or peek(64).lstrip()[:1] in (b'{', b'[')
+
+def rewind(stream, err):
+    """
+    Rewind stream to decode it again after ijson failed with err. A body
+    streamed from the socket cannot be read again, err is raised instead.
+    """
+    try:
+        stream.seek(0)
+    except (AttributeError, IOError, ValueError):
+        raise ConnectionError("Invalid JSON in the response: %s" % to_text(err))
+
+def get_json_path(document, path):
+    # Value at the dotted path of a decoded document, raises KeyError if absent
+    for key in path.split('.') if path else []:
+        if not isinstance(document, dict):
+            raise KeyError(path)
+        document = document[key]
+    return document
+
+def set_json_path(document, path, value):
+    keys = path.split('.')
+    for key in keys[:-1]:
+        document = document.setdefault(key, {})
+    document[keys[-1]] = value
+
+def load_json(stream):
+    """
+    Decode the JSON document in stream, or return its bytes if it is not JSON
+    """
+    body = stream.read()
+    try:
+        # bytes are decoded without an intermediate text copy
+        return json.loads(body)
+    except TypeError:
+        return json.loads(to_text(body))
+    except ValueError:
+        return body
+
+def select_json(stream, select):
+    """
+    Decode only the subtree at the dotted path select of the JSON document
+    in stream, and the status keys, into a document of the same shape. With
+    ijson the rest of the document is skipped without being built.
+    """
+    paths = set(STATUS_KEYS)
+    paths.add(select)
+    if HAS_IJSON and is_json(stream):
+        document = {}
+        try:
+            for path, value in iter_json_paths(stream, paths):
+                set_json_path(document, path, value)
+            return document
+        except ijson.JSONError as err:
+            rewind(stream, err)
+    full = load_json(stream)
+    if not isinstance(full, dict):
+        return full
+    document = {}
+    for path in paths:
+        try:
+            set_json_path(document, path, get_json_path(full, path))
+        except KeyError:
+            pass
+    return document
+
+class ResponseStream(object):
+    """
+    Body of a response read from the socket as it is decoded, counting the
+    bytes read. peek returns its first bytes without consuming them. close
+    calls release, which gives the keep-alive connection back.
+    """
+
+    def __init__(self, stream, release=None):
+        self.stream = stream
+        self.release = release
+        self.bytes_read = 0
+        self._head = b''
+
+    def peek(self, size):
+        while len(self._head) < size:
+            chunk = self._read(size - len(self._head))
+            if not chunk:
+                break
+            self._head += chunk
+        return self._head[:size]
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            data = self._head + self._read(-1)
+            self._head = b''
+        elif self._head:
+            data, self._head = self._head[:size], self._head[size:]
+        else:
+            data = self._read(size)
+        self.bytes_read += len(data)
+        return data
+
+    def _read(self, size):
+        try:
+            return self.stream.read() if size < 0 else self.stream.read(size)
+        except (http_client.HTTPException, socket.error, ssl.SSLError, zlib.error,
+                EOFError) as err:
+            raise ConnectionError("Could not read the response: %s" % to_text(err))
+
+    def seek(self, offset, whence=0):
+        # Only a body read at once, in a BytesIO, can be read again
+        self._head = b''
+        self.bytes_read = self.stream.seek(offset, whence)
+        return self.bytes_read
+
+    def close(self):
+        release, self.release = self.release, None
+        if release:
+            release()
+
+
+class InflateStream(object):
+    """
+    Deflate body of stream, decompressed chunk by chunk as it is read
+    """
+
+    def __init__(self, stream, wbits, chunk_size=65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        self._decompressor = zlib.decompressobj(wbits)
+        self._done = False
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(self.chunk_size), b''))
+        decompressor = self._decompressor
+        while size and not self._done:
+            chunk = decompressor.unconsumed_tail
+            if not chunk and not decompressor.eof:
+                chunk = self.stream.read(self.chunk_size)
+            if not chunk:
+                self._done = True
+                return decompressor.flush()
+            data = decompressor.decompress(chunk, size)
+            if data:
+                return data
+        return b''
+
+
+class ResumingHTTPSConnection(http_client.HTTPSConnection):
+    """
+    HTTPS connection offering tls_session to the controller during the
+    handshake, so that a reconnection skips the full TLS handshake
+    """
+    tls_session = None
+
+    def connect(self):
+        http_client.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(self.sock, server_hostname=self.host,
+                                              session=self.tls_session)
+
+
+class KeepAliveTransport(object):
+    """
+    Pool of HTTP/1.1 keep-alive connections to a controller. A request takes
+    an idle connection or opens one, so there is one connection per
+    concurrent worker, and gives it back once its response is read. count is
+    called with connections for every connection opened, tls_handshakes or
+    tls_resumed for its TLS handshake, and reused for every request sent on
+    an already open connection.
+    """
+
+    def __init__(self, host, port, use_ssl, context, timeout, count):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.context = context
+        self.timeout = timeout
+        self.count = count
+        self.tls_session = None
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if self.use_ssl:
+            conn = ResumingHTTPSConnection(self.host, self.port, timeout=self.timeout,
+                                           context=self.context)
+            conn.tls_session = self.tls_session
+        else:
+            conn = http_client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+        self.count('connections')
+        return conn
+
+    def request(self, method, path, data, headers, timeout=None):
+        """
+        Send a request, returns the connection and the response with its body
+        left unread, the connection is given to release once it is read.
+        timeout replaces the timeout of the transport for this request.
+        """
+        with self._lock:
+            conn = self._idle.pop() if self._idle else None
+        reused = conn is not None
+        if conn is None:
+            conn = self._open()
+        while True:
+            conn.timeout = timeout or self.timeout
+            if conn.sock is not None:
+                conn.sock.settimeout(conn.timeout)
+            try:
+                conn.request(method, path, body=data, headers=headers)
+                if not reused and self.use_ssl:
+                    self.count('tls_resumed' if conn.sock.session_reused else 'tls_handshakes')
+                response = conn.getresponse()
+                break
+            except socket.timeout:
+                # The controller may have received the request, never resent
+                conn.close()
+                raise
+            except STALE_CONNECTION_ERRORS:
+                conn.close()
+                if not reused:
+                    raise
+                # Closed by the controller while idle, not sent
+                reused = False
+                conn = self._open()
+        if reused:
+            self.count('reused')
+        if self.use_ssl and conn.sock is not None:
+            # TLS 1.3 session tickets are only received with the response
+            self.tls_session = conn.sock.session
+        return conn, response
+
+    def release(self, conn, response):
+        """
+        Keep the connection of a response as idle if its body was read to the
+        end, close it otherwise
+        """
+        if response.will_close or not response.isclosed():
+            conn.close()
+            return
+        with self._lock:
+            if len(self._idle) < IDLE_CONNECTIONS:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class RateLimiter(object):
+    """
+    Token bucket whose rate adapts to the controller. The rate is halved on
+    errors and slow responses and increases by one request per second on
+    every fast response, up to max_rate.
+    """
+    def __init__(self, max_rate, min_rate, latency):
+        self.max_rate = float(max_rate)
+        self.min_rate = min(float(min_rate), self.max_rate)
+        self.latency = float(latency)
+        self.rate = self.max_rate
+        self.tokens = self.max_rate
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        # Take a token, returns the time waited for it in seconds
+        with self.lock:
+            now = time.time()
+            self.tokens = min(self.rate, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= 1
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+    def success(self, latency):
+        with self.lock:
+            if latency > self.latency:
+                self.rate = max(self.min_rate, self.rate / 2)
+            else:
+                self.rate = min(self.max_rate, self.rate + 1)
+
+    def failure(self):
+        with self.lock:
+            self.rate = max(self.min_rate, self.rate / 2)
+
 class HttpApi(HttpApiBase):
     def __init__(self, *args, **kwargs):
         super(HttpApi, self).__init__(*args, **kwargs)
+        self._config_cache = OrderedDict()
+        self._show_cache = OrderedDict()
+        self._cache_lock = threading.RLock()
+        self._pending_commits = []
+        self._transaction = None
+        self._transaction_ids = set()
+        self._checking_session = False
+        self._init_stats()
+        self._transport = None
+        self._transport_lock = threading.Lock()
+
+    def _init_stats(self):
+        # Counters and timings live as long as the connection and are never
+        # reset, the modules compute the share of their task from baselines
+        self._rate_limiter = None
+        self._stats_lock = threading.Lock()
+        self._stats = {'requests': 0, 'retries': 0, 'errors': 0,
+                       'throttled': 0, 'throttle_wait': 0.0, 'connections': 0,
+                       'tls_handshakes': 0, 'tls_resumed': 0, 'reused': 0}
+        self._timings = deque(maxlen=TIMINGS_SIZE)
+
+    def _get_option(self, option, default=None):
+        # Options are only set when the connection loads them from the
+        # inventory, fall back to the default otherwise
+        try:
+            value = self.get_option(option)
+        except (KeyError, AttributeError):
+            return default
+        return default if value is None else value
+
+    def _get_connection_option(self, option, default=None):
+        # Options of the httpapi connection, some are missing before
+        # Ansible 2.10, like ca_path, client_cert, client_key and http_agent
+        try:
+            value = self.connection.get_option(option)
+        except KeyError:
+            return default
+        return default if value is None else value
 
     def login(self, username, password):
-        path = '/v1/api/login?username='+username+'&password='+password
-        method = 'GET'
-        self.send_request(data=None, path=path, method=method)
+        session_cache = self._get_option('session_cache', False)
+        if session_cache and self._load_session(username, password):
+            return
+        self.connection._auth = None
+        # Credentials are sent in the body, not in the URL
+        path = '/v1/api/login'
+        data = urlencode({'username': username, 'password': password})
+        headers = {'Content-Type': 'application/x-www-form-urlencoded'}
+        method = 'POST'
+        self.send_request(data=data, path=path, method=method, headers=headers)
+        if session_cache and self.connection._auth:
+            self._save_session(username, password)
 
     def logout(self):
-        path = '/v1/api/logout'
-        data = None
-        method = 'GET'
-        self.send_request(data=data, path=path, method=method)
+        # Deferred write_memory are flushed when the connection is closed,
+        # the POSTs of a transaction which was never committed are dropped
+        if self._transaction and self._transaction['entries']:
+            self.connection.queue_message('warning', 'Discarding %d POSTs buffered in a'
+                                          ' transaction which was not committed'
+                                          % len(self._transaction['entries']))
+        self._transaction = None
+        try:
+            self.flush_write_memory()
+            # A cached session is kept alive for the next playbook run
+            if not self.connection._auth or self._get_option('session_cache', False):
+                return
+            path = '/v1/api/logout'
+            data = None
+            method = 'GET'
+            self.send_request(data=data, path=path, method=method)
+        finally:
+            # The keep-alive connections are closed whether or not the
+            # session is logged out
+            if self._transport:
+                self._transport.close()
+
+    def _session_file(self, username):
+        host = '%s:%s:%s' % (self.connection.get_option('host'),
+                             self.connection.get_option('port'), username)
+        cache_dir = os.path.expanduser(self._get_option('session_cache_dir',
+                                                        '~/.ansible/aos_sessions'))
+        return os.path.join(cache_dir, hashlib.sha256(to_bytes(host)).hexdigest())
+
+    def _load_session(self, username, password):
+        # Reuse the cached session if the controller still accepts it
+        session_file = self._session_file(username)
+        try:
+            with open(session_file, 'rb') as cache:
+                vault = VaultLib([('default', VaultSecret(to_bytes(password)))])
+                session = json.loads(to_text(vault.decrypt(cache.read())))
+        except (IOError, OSError, ValueError, AnsibleError):
+            return False
+        token = session.get('UIDARUBA') if isinstance(session, dict) else None
+        if not token:
+            return False
+
+        self.connection._auth = {'Cookie': "SESSION=" + token}
+        self._checking_session = True
+        try:
+            path = '/v1/configuration/showcommand?' + urlencode({'command': 'show clock'})
+            response_data, code = self.send_request(data=None, path=path, method='GET')
+            valid = code == 200 and isinstance(response_data, dict) \
+                and 'Error' not in response_data
+        except (ConnectionError, HTTPError):
+            valid = False
+        finally:
+            self._checking_session = False
+        if not valid:
+            self.connection._auth = None
+            try:
+                os.remove(session_file)
+            except OSError:
+                pass
+        return valid
+
+    def _save_session(self, username, password):
+        session_file = self._session_file(username)
+        session = {'UIDARUBA': self.connection._auth['Cookie'].split("SESSION=")[1],
+                   'created': int(time.time())}
+        try:
+            vault = VaultLib([('default', VaultSecret(to_bytes(password)))])
+            encrypted = vault.encrypt(to_bytes(json.dumps(session)))
+            if not os.path.isdir(os.path.dirname(session_file)):
+                os.makedirs(os.path.dirname(session_file), 0o700)
+            cache = os.open(session_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(cache, 'wb') as cache:
+                cache.write(encrypted)
+        except (IOError, OSError, AnsibleError) as err:
+            self.connection.queue_message('warning', 'Unable to cache AOS session: %s'
+                                          % to_text(err))
+
+    def handle_httperror(self, exc):
+        # An expired cached session is not an error, login() falls back to
+        # a new login instead of retrying with the same credentials
+        if self._checking_session:
+            return False
+        return super(HttpApi, self).handle_httperror(exc)
+
+    def get_config(self, config_path, objects=None, refresh=False):
+        """
+        Return the configuration of config_path, restricted to objects with an
+        OBJECT filter when given. Served from the snapshot cache of the
+        connection unless refresh is set, the fetched snapshot is cached.
+        A filter rejected with an HTTP error is returned as {'Error': ...}
+        for the caller to fall back to the full configuration.
+        """
+        key = (config_path, tuple(sorted(objects)) if objects else None)
+        cache_enabled = self._get_option('config_cache', True)
+        with self._cache_lock:
+            if cache_enabled and not refresh and key in self._config_cache:
+                self._config_cache[key] = self._config_cache.pop(key)
+                return self._config_cache[key]
+
+        params = {'config_path': config_path}
+        if objects:
+            params['filter'] = json.dumps([{'OBJECT': {'$eq': sorted(objects)}}])
+        path = '/v1/configuration/object/config?' + urlencode(params)
+        try:
+            response_data, code = self.send_request(data=None, path=path, method='GET')
+        except ConnectionError as err:
+            if not objects:
+                raise
+            return {'Error': to_text(err)}
+
+        if cache_enabled and code == 200 and isinstance(response_data, dict) \
+                and 'Error' not in response_data:
+            with self._cache_lock:
+                self._config_cache.pop(key, None)
+                self._config_cache[key] = response_data
+                while len(self._config_cache) > self._get_option('config_cache_size', 64):
+                    self._config_cache.popitem(last=False)
+        return response_data
+
+    def get_configs(self, config_paths, objects=None, refresh=False, max_workers=4):
+        """
+        get_config on several config_paths concurrently, returns the
+        snapshots keyed by config_path
+        """
+        def fetch(config_path):
+            try:
+                return self.get_config(config_path, objects, refresh)
+            except Exception as err:
+                return {'Error': to_text(err)}
+
+        snapshots = self._run_concurrently(fetch, config_paths, max_workers)
+        return dict(zip(config_paths, snapshots))
+
+    def backup_configs(self, backups, max_workers=4):
+        """
+        Fetch the configuration of several nodes concurrently, bypassing the
+        snapshot cache, and write the objects configured on each node,
+        without the inherited instances and the metadata keys, as canonical
+        JSON with sorted keys and compact separators. backups is a list of dictionaries with the config_path,
+        the dest file and the sha256 of its last content. dest is only
+        written if its content changes, and not at all when it is not given.
+        Returns per backup the sha256 and size of the content, if it was
+        written, the response code and the error.
+        """
+        def backup(entry):
+            result = {'config_path': entry['config_path'], 'sha256': None, 'bytes': 0,
+                      'written': False, 'code': None, 'error': None}
+            path = '/v1/configuration/object/config?' + \
+                urlencode({'config_path': entry['config_path']})
+            try:
+                response_data, result['code'] = self.send_request(data=None, path=path,
+                                                                  method='GET', select='_data')
+            except Exception as err:
+                result['error'] = to_text(err)
+                return result
+            if result['code'] != 200 or not isinstance(response_data, dict) or \
+                    'Error' in response_data:
+                result['error'] = to_text(response_data)
+                return result
+            content = to_bytes(aos_config.canonical(aos_config.get_local_config(response_data)))
+            result['sha256'] = hashlib.sha256(content).hexdigest()
+            result['bytes'] = len(content)
+            dest = entry.get('dest')
+            if dest and (result['sha256'] != entry.get('sha256') or not os.path.exists(dest)):
+                try:
+                    dest_dir = os.path.dirname(dest)
+                    if dest_dir and not os.path.isdir(dest_dir):
+                        os.makedirs(dest_dir)
+                    # Written aside then renamed, an interrupted backup
+                    # never leaves a truncated file
+                    with open(dest + '.tmp', 'wb') as dest_file:
+                        dest_file.write(content)
+                    os.rename(dest + '.tmp', dest)
+                    result['written'] = True
+                except (IOError, OSError) as err:
+                    result['error'] = to_text(err)
+            return result
+
+        return self._run_concurrently(backup, backups, max_workers)
+
+    def invalidate_config_cache(self, config_path=None):
+        """
+        Drop cached snapshots of config_path and of all nodes below it,
+        or every snapshot when config_path is not given
+        """
+        with self._cache_lock:
+            if not config_path or config_path == '/':
+                self._config_cache.clear()
+                return
+            config_path = config_path.rstrip('/')
+            for key in list(self._config_cache):
+                if key[0] == config_path or key[0].startswith(config_path + '/'):
+                    del self._config_cache[key]
+
+    def _invalidate_posted_path(self, path):
+        url = urlparse(path)
+        if url.path.rstrip('/').split('/')[-1] in NON_CONFIG_OBJECTS:
+            return
+        config_path = parse_qs(url.query).get('config_path', [None])[0]
+        self.invalidate_config_cache(config_path)
+
+    def show_commands(self, commands, max_workers=4, ttl=None, refresh=False):
+        """
+        Run show commands concurrently like send_requests, through the show
+        command cache. ttl is the number of seconds a result stays cached, None
+        for show_cache_ttl when the show_cache option is set, 0 to bypass the
+        cache. With refresh the commands are run again and their results
+        replace the cached ones. Every result tells if it was cached.
+        """
+        if ttl is None:
+            ttl = self._get_option('show_cache_ttl', 30) \
+                if self._get_option('show_cache', False) else 0
+        host = self.connection.get_option('host')
+        keys = [(host, ' '.join(command.split())) for command in commands]
+        results = [None] * len(commands)
+        if ttl and not refresh:
+            now = time.time()
+            with self._cache_lock:
+                for index, key in enumerate(keys):
+                    entry = self._show_cache.get(key)
+                    if entry is None:
+                        continue
+                    if entry['expires'] <= now:
+                        del self._show_cache[key]
+                        continue
+                    self._show_cache[key] = self._show_cache.pop(key)
+                    results[index] = dict(entry['result'], cached=True, latency=0.0,
+                                          age=round(now - entry['stored'], 3))
+
+        misses = [index for index, result in enumerate(results) if result is None]
+        requests = [{'path': '/v1/configuration/showcommand?' +
+                             urlencode({'command': keys[index][1]}),
+                     'method': 'GET'} for index in misses]
+        for index, result in zip(misses, self.send_requests(requests, max_workers)):
+            results[index] = dict(result, cached=False, age=0.0)
+            if ttl and result['error'] is None and result['code'] == 200 and result['response']:
+                self._store_show_result(keys[index], result, ttl)
+        return results
+
+    def _store_show_result(self, key, result, ttl):
+        now = time.time()
+        with self._cache_lock:
+            self._show_cache.pop(key, None)
+            self._show_cache[key] = {'stored': now, 'expires': now + float(ttl),
+                                     'result': {'response': result['response'],
+                                                'code': result['code'], 'error': None}}
+            while len(self._show_cache) > max(1, self._get_option('show_cache_size', 32)):
+                self._show_cache.popitem(last=False)
+
+    def invalidate_show_cache(self):
+        """
+        Drop every cached show command result
+        """
+        with self._cache_lock:
+            self._show_cache.clear()
+
+    def defer_write_memory(self, config_path):
+        """
+        Record that config_path has changes to commit. A single write_memory
+        is sent per recorded path by flush_write_memory, at the latest when
+        the connection is closed.
+        """
+        if config_path not in self._pending_commits:
+            self._pending_commits.append(config_path)
+        return list(self._pending_commits)
+
+    def get_pending_write_memory(self):
+        return list(self._pending_commits)
+
+    def flush_write_memory(self, config_paths=None):
+        """
+        Send write_memory for the pending config_paths, restricted to
+        config_paths when given. Returns the status of every write_memory
+        sent, keyed by config_path.
+        """
+        results = {}
+        for config_path in list(self._pending_commits):
+            if config_paths is not None and config_path not in config_paths:
+                continue
+            path = '/v1/configuration/object/write_memory?' + \
+                   urlencode({'config_path': config_path})
+            try:
+                response_data, code = self.send_request(data=json.dumps({}), path=path,
+                                                        method='POST')
+                status = code == 200 and 'Error' not in response_data
+                results[config_path] = {'status': status, 'response': response_data}
+            except ConnectionError as err:
+                results[config_path] = {'status': False, 'response': to_text(err)}
+            if results[config_path]['status']:
+                self._pending_commits.remove(config_path)
+            else:
+                self.connection.queue_message('warning', 'write_memory failed on %s: %s'
+                                              % (config_path, results[config_path]['response']))
+        return results
 
-    def send_request(self, data, headers={}, **message_kwargs):
+    def begin_transaction(self):
+        """
+        Open a transaction. Until it is ended by end_transaction, the modules
+        buffer their POSTs with buffer_post instead of sending them. Returns
+        the id of the transaction, False if a transaction is already open.
+        """
+        if self._transaction is not None:
+            return False
+        transaction_id = uuid.uuid4().hex
+        self._transaction = {'id': transaction_id, 'entries': [], 'configs': {}}
+        self._transaction_ids.add(transaction_id)
+        return transaction_id
+
+    def opened_transaction(self, transaction_id):
+        """
+        True if this connection opened the transaction transaction_id, open
+        or ended since. A transaction and its buffered POSTs live in the
+        connection, a connection started again, after a reset, never opened
+        the transactions of the connection it replaces.
+        """
+        return transaction_id in self._transaction_ids
+
+    def get_transaction(self, config_path=None, transaction_id=None):
+        """
+        None if no transaction is open. Otherwise its id, the number of
+        buffered POSTs and, for config_path when given, the objects fetched
+        by the transaction and their configuration after the buffered POSTs.
+        With transaction_id, the id returned by begin_transaction, lost is
+        set if this connection never opened it, see opened_transaction.
+        """
+        if transaction_id and not self.opened_transaction(transaction_id):
+            return {'id': transaction_id, 'entries': 0, 'config': None, 'lost': True}
+        if self._transaction is None:
+            return None
+        return {'id': self._transaction['id'], 'entries': len(self._transaction['entries']),
+                'config': self._transaction['configs'].get(config_path), 'lost': False}
+
+    def get_buffered_posts(self):
+        """
+        Buffered POSTs of the open transaction in order, which stays open.
+        None if no transaction is open.
+        """
+        if self._transaction is None:
+            return None
+        return list(self._transaction['entries'])
+
+    def buffer_post(self, config_path, data, config, changed, commit=False):
+        """
+        Buffer the POST of data on config_path in the open transaction, with
+        the change predicted by the module and config, the configuration of
+        config_path after it. Returns the position of the POST in the
+        transaction, None if no transaction is open.
+        """
+        if self._transaction is None:
+            return None
+        self._transaction['entries'].append({'config_path': config_path, 'data': data,
+                                             'changed': changed, 'commit': commit})
+        self._transaction['configs'][config_path] = config
+        return len(self._transaction['entries']) - 1
+
+    def end_transaction(self):
+        """
+        Close the open transaction and return its buffered POSTs in order,
+        for the caller to send or drop them. None if no transaction is open.
+        """
+        if self._transaction is None:
+            return None
+        entries = self._transaction['entries']
+        self._transaction = None
+        return entries
+
+    def send_requests(self, requests, max_workers=4):
+        """
+        Send a batch of requests concurrently over the session with a pool of
+        at most max_workers threads. requests is a list of dictionaries with
+        the path, method and data of each request. Returns, in the same
+        order, a dictionary per request with its response, code, latency
+        in seconds and error, set when the request failed.
+        """
+        def send(request):
+            start = time.time()
+            result = {'response': None, 'code': None, 'error': None}
+            try:
+                result['response'], result['code'] = self.send_request(
+                    data=request.get('data'), path=request['path'],
+                    method=request.get('method', 'GET'))
+            except Exception as err:
+                result['error'] = to_text(err)
+                result['code'] = getattr(err, 'code', None)
+            result['latency'] = round(time.time() - start, 3)
+            return result
+
+        return self._run_concurrently(send, requests, max_workers)
+
+    def _run_concurrently(self, func, items, max_workers):
+        # map func on items with a pool of at most max_workers threads
+        if not items:
+            return []
+        # Log in once before the workers share the session
+        if not self.connection._connected:
+            self.connection._connect()
+        pool = ThreadPool(max(1, min(int(max_workers), len(items))))
+        try:
+            return pool.map(func, items)
+        finally:
+            pool.close()
+            pool.join()
+
+    def get_request_stats(self):
+        """
+        Counters of the requests sent by the connection: requests, retries,
+        errors, throttled (requests delayed by the rate limit), throttle_wait
+        (seconds spent waiting on the rate limit), rate (current request
+        rate limit per second), and for keep-alive, connections opened,
+        tls_handshakes (full handshakes), tls_resumed (resumed TLS sessions)
+        and reused (requests sent on an open connection)
+        """
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['throttle_wait'] = round(stats['throttle_wait'], 3)
+        if self._rate_limiter:
+            stats['rate'] = round(self._rate_limiter.rate, 2)
+        return stats
+
+    def get_timings(self, since=0):
+        """
+        Timings of the requests sent after the first since requests of the
+        connection, as counted by get_request_stats: their number, total
+        latency and totals per endpoint. With the request_timings option set
+        to requests, also every request in requests, a dictionary with the
+        method, path template, status, latency in seconds, request and
+        response body bytes and retry attempt of the request.
+        """
+        with self._stats_lock:
+            requests = [dict(timing) for timing in self._timings if timing['seq'] > since]
+        by_endpoint = {}
+        for request in requests:
+            request.pop('seq', None)
+            endpoint = by_endpoint.setdefault(request['method'] + ' ' + request['path'],
+                                              {'count': 0, 'errors': 0, 'time': 0.0,
+                                               'max': 0.0, 'request_bytes': 0,
+                                               'response_bytes': 0, 'wire_bytes': 0})
+            endpoint['count'] += 1
+            if request['status'] is None or request['status'] >= 400:
+                endpoint['errors'] += 1
+            endpoint['time'] = round(endpoint['time'] + request['latency'], 4)
+            endpoint['max'] = max(endpoint['max'], request['latency'])
+            endpoint['request_bytes'] += request['request_bytes']
+            endpoint['response_bytes'] += request['response_bytes']
+            endpoint['wire_bytes'] += request.get('wire_bytes', request['response_bytes'])
+        timings = {'count': len(requests), 'by_endpoint': by_endpoint,
+                   'time': round(sum(request['latency'] for request in requests), 4)}
+        if self._get_option('request_timings', 'summary') == 'requests':
+            timings['requests'] = requests
+        return timings
+
+    def _count(self, counter, value=1):
+        with self._stats_lock:
+            self._stats[counter] += value
+            return self._stats[counter]
+
+    def _record_timing(self, seq, method, path, status, latency, data, response_bytes,
+                       wire_bytes, attempt):
+        # response_bytes is the size of the decompressed body, wire_bytes the
+        # size received from the controller
+        with self._stats_lock:
+            self._timings.append({'seq': seq, 'method': method, 'path': get_path_template(path),
+                                  'status': status, 'latency': round(latency, 4),
+                                  'request_bytes': len(data) if data else 0,
+                                  'response_bytes': response_bytes, 'wire_bytes': wire_bytes,
+                                  'compression': round(float(response_bytes) / wire_bytes, 2)
+                                                 if wire_bytes else 1.0,
+                                  'attempt': attempt})
+
+    def _throttle(self):
+        # The rate limiter is created by the first request, which may be sent
+        # by one of several concurrent workers
+        with self._stats_lock:
+            if self._rate_limiter is None:
+                max_rate = self._get_option('rate_limit', 20)
+                if not max_rate:
+                    return
+                self._rate_limiter = RateLimiter(max_rate, self._get_option('rate_limit_min', 1),
+                                                 self._get_option('rate_limit_latency', 2))
+            rate_limiter = self._rate_limiter
+        wait = rate_limiter.acquire()
+        if wait:
+            self._count('throttled')
+            self._count('throttle_wait', wait)
+
+    def _is_retryable(self, response, response_data):
+        if isinstance(response, HTTPError):
+            if response.code in RETRY_STATUS_CODES:
+                return True
+            if response.code >= 500 and RETRY_ERROR_RE.search(to_text(response_data)):
+                return True
+            return False
+        if isinstance(response_data, dict):
+            global_result = response_data.get('_global_result', {})
+            if str(global_result.get('status', 0)) != '0':
+                return bool(RETRY_ERROR_RE.search(to_text(global_result.get('status_str', ''))))
+            if 'Error' in response_data:
+                return bool(RETRY_ERROR_RE.search(to_text(response_data['Error'])))
+        return False
+
+    def _backoff(self, attempt, response):
+        retry_after = None
+        if isinstance(response, HTTPError):
+            try:
+                retry_after = float(response.headers.get('Retry-After'))
+            except (AttributeError, TypeError, ValueError):
+                pass
+        backoff_max = self._get_option('retry_backoff_max', 30)
+        if retry_after is not None:
+            return min(retry_after, backoff_max)
+        backoff = self._get_option('retry_backoff', 0.5) * (2 ** attempt)
+        return random.uniform(0, min(backoff, backoff_max))
+
+    def send_request(self, data, headers=None, select=None, timeout=None, **message_kwargs):
+        """
+        Send a request over the session, retried and rate limited, and
+        return its decoded response and code. With select, a dotted path like
+        _data.netdst, only this subtree of the response and its status keys
+        are decoded, incrementally when ijson is installed. timeout, in
+        seconds, replaces persistent_command_timeout for this request: when
+        the response does not come in time, a ConnectionError with the code
+        timeout is raised and the request is not sent again.
+        """
+        def decode(stream):
+            return select_json(stream, select) if select else load_json(stream)
+
+        response, response_data = self._send(data, headers, decode, timeout=timeout,
+                                             **message_kwargs)
+        return self.handle_response(response, response_data)
+
+    def save_records(self, path, dest, select='_data', append=False):
+        """
+        GET path and write the records of the list at the dotted path select
+        of the response to the file dest, one JSON document per line. With
+        ijson the records are decoded and written one at a time, so memory
+        use does not depend on the size of the response. Returns the number
+        of records written with their digest, the response code and the
+        response without the records.
+        """
+        records_path = select + '.item'
+        with open(dest, 'a' if append else 'w') as dest_file:
+            start = dest_file.tell()
+
+            def decode(stream):
+                # A retried request rewrites the records of its first attempt
+                dest_file.seek(start)
+                dest_file.truncate()
+                status = {}
+                count = 0
+                digest = hashlib.sha1()
+                if HAS_IJSON and is_json(stream):
+                    try:
+                        paths = set(STATUS_KEYS + (records_path,))
+                        for json_path, value in iter_json_paths(stream, paths):
+                            if json_path == records_path:
+                                line = json.dumps(value, sort_keys=True) + '\n'
+                                dest_file.write(line)
+                                digest.update(to_bytes(line))
+                                count += 1
+                            else:
+                                status[json_path] = value
+                        status['records'] = count
+                        status['digest'] = digest.hexdigest()
+                        return status
+                    except ijson.JSONError as err:
+                        rewind(stream, err)
+                        dest_file.seek(start)
+                        dest_file.truncate()
+                        digest = hashlib.sha1()
+                document = load_json(stream)
+                if not isinstance(document, dict):
+                    return document
+                try:
+                    records = get_json_path(document, select)
+                except KeyError:
+                    records = []
+                for record in records if isinstance(records, list) else []:
+                    line = json.dumps(record, sort_keys=True) + '\n'
+                    dest_file.write(line)
+                    digest.update(to_bytes(line))
+                    count += 1
+                status = dict((key, document[key]) for key in STATUS_KEYS if key in document)
+                status['records'] = count
+                status['digest'] = digest.hexdigest()
+                return status
+
+            response, response_data = self._send(None, None, decode, path=path, method='GET')
+        response_data, code = self.handle_response(response, response_data)
+        records = response_data.pop('records', 0) if isinstance(response_data, dict) else 0
+        digest = response_data.pop('digest', None) if isinstance(response_data, dict) else None
+        return {'response': response_data, 'code': code, 'records': records,
+                'digest': digest}
+
+    def _send(self, data, headers, decode, timeout=None, **message_kwargs):
+        # Send with retries, returns the response and the body decoded by decode
+        if message_kwargs['method'] == 'POST' and self._config_cache:
+            self._invalidate_posted_path(message_kwargs['path'])
+        if message_kwargs['method'] == 'POST' and self._show_cache and \
+                '/configuration/' in message_kwargs['path']:
+            self.invalidate_show_cache()
+
+        headers = dict(headers or {})
+        # The login response is left uncompressed for update_auth to read the session
+        if self._get_option('compression', True) and '/api/login' not in message_kwargs['path']:
+            headers.setdefault('Accept-Encoding', 'gzip, deflate')
         # Ensure Connection
         if not self.connection._connected:
             self.connection._connect()
@@ -61,18 +1274,159 @@ class HttpApi(HttpApiBase):
             headers["Cookie"] = self.connection._auth["Cookie"]
             if 'logout' not in message_kwargs['path']:
                 sess_tok = self.connection._auth["Cookie"].split("SESSION=")[1]
-                message_kwargs['path'] = message_kwargs['path'] + "&UIDARUBA=" + sess_tok
+                separator = '&' if '?' in message_kwargs['path'] else '?'
+                message_kwargs['path'] = message_kwargs['path'] + separator + "UIDARUBA=" + sess_tok
 
-        response, response_data = self.connection.send(data=data, headers=headers,
-                                                       path=message_kwargs['path'],
-                                                       method=message_kwargs['method'])
+        retries = self._get_option('retries', 5)
+        attempt = 0
+        while True:
+            self._throttle()
+            seq = self._count('requests')
+            start = time.time()
+            response, stream = self._http_send(data, headers, message_kwargs['path'],
+                                               message_kwargs['method'], timeout=timeout)
+            try:
+                body = stream
+                encoding = get_content_encoding(response)
+                if encoding and encoding != 'identity':
+                    body = decompress_stream(stream, encoding)
+                response_data = decode(body)
+                # Read to the end for the connection to be kept alive
+                stream.read()
+            finally:
+                stream.close()
+            latency = time.time() - start
+            size = wire_bytes = stream.bytes_read
+            if body is not stream:
+                size = body.bytes_read
+            elif encoding and encoding != 'identity':
+                # Recent ansible-core decompresses gzip bodies itself
+                try:
+                    wire_bytes = int(response.headers.get('Content-Length'))
+                except (TypeError, ValueError):
+                    pass
+            self._record_timing(seq, message_kwargs['method'], message_kwargs['path'],
+                                getattr(response, 'code', None), latency, data, size,
+                                wire_bytes, attempt)
+
+            retryable = self._is_retryable(response, response_data)
+            if retryable or isinstance(response, HTTPError):
+                self._count('errors')
+                if self._rate_limiter:
+                    self._rate_limiter.failure()
+            elif self._rate_limiter:
+                self._rate_limiter.success(latency)
+            if not retryable or attempt >= retries:
+                break
+            attempt += 1
+            self._count('retries')
+            time.sleep(self._backoff(attempt, response))
+        return response, response_data
+
+    def _get_transport(self):
+        # Keep-alive transport of the connection, None to send the requests
+        # with the connection of ansible-core
+        if not self._get_option('keepalive', True):
+            return None
+        with self._transport_lock:
+            if self._transport is None:
+                connection = self.connection
+                host = connection.get_option('host')
+                use_ssl = connection.get_option('use_ssl')
+                proxies = getproxies() if connection.get_option('use_proxy') else {}
+                if proxies.get('https' if use_ssl else 'http') and not proxy_bypass(host):
+                    self._transport = False
+                    return None
+                context = None
+                if use_ssl:
+                    context = self._ssl_context()
+                port = connection.get_option('port') or (443 if use_ssl else 80)
+                self._transport = KeepAliveTransport(
+                    host, port, use_ssl, context,
+                    connection.get_option('persistent_command_timeout'), self._count)
+        return self._transport or None
+
+    def _ssl_context(self):
+        # TLS settings of the httpapi connection options
+        ca_path = self._get_connection_option('ca_path')
+        context = ssl.create_default_context(
+            cafile=ca_path if ca_path and not os.path.isdir(ca_path) else None,
+            capath=ca_path if ca_path and os.path.isdir(ca_path) else None)
+        if not self._get_connection_option('validate_certs', True):
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+        client_cert = self._get_connection_option('client_cert')
+        if client_cert:
+            context.load_cert_chain(client_cert, self._get_connection_option('client_key'))
+        ciphers = self._get_connection_option('ciphers')
+        if ciphers:
+            context.set_ciphers(':'.join(ciphers) if isinstance(ciphers, list) else ciphers)
+        return context
+
+    def _http_send(self, data, headers, path, method, retry_auth=True, timeout=None):
+        """
+        Send a request over the keep-alive transport, with the behavior of
+        the send of the httpapi connection: HTTP errors are handled by
+        handle_httperror and the session is read from the login response by
+        update_auth. Returns the response and its body in a ResponseStream,
+        read from the socket as it is decoded, which gives the connection
+        back to the transport when it is closed.
+        """
+        transport = self._get_transport()
+        url = self.connection._url + path
+        if transport is None:
+            kwargs = {'timeout': timeout} if timeout else {}
+            try:
+                response, response_buffer = self.connection.send(
+                    data=data, headers=headers, path=path, method=method, **kwargs)
+            except socket.timeout:
+                raise ConnectionError("No response from %s in time" % url, code='timeout')
+            return response, ResponseStream(response_buffer)
+        connection = self.connection
+        request_headers = dict(headers)
+        if connection._auth:
+            request_headers.update(connection._auth)
+        request_headers.setdefault('User-Agent',
+                                   self._get_connection_option('http_agent') or
+                                   'ansible-httpapi')
         try:
-            response_data = json.loads(to_text(response_data.read()))
-        except ValueError:
-            response_data = response_data.read()
-        except AttributeError as arr:
-            raise Exception(str(response) + str(arr))
-        return self.handle_response(response, response_data)
+            conn, response = transport.request(
+                method, path, to_bytes(data) if data is not None else None, request_headers,
+                timeout)
+        except socket.timeout:
+            raise ConnectionError("No response from %s in time" % url, code='timeout')
+        except (http_client.HTTPException, socket.error, ssl.SSLError) as err:
+            raise ConnectionError("Could not connect to %s: %s" % (url, to_text(err)))
+        status, reason, response_headers = response.status, response.reason, response.msg
+        if status < 400 and '/api/login' not in path:
+            connection._log_messages("received response: %s %s" % (status, reason))
+            stream = ResponseStream(response, lambda: transport.release(conn, response))
+            return addinfourl(stream, response_headers, url, status), stream
+
+        # Error and login responses are read at once for handle_httperror and update_auth
+        try:
+            body = response.read()
+        except (http_client.HTTPException, socket.error, ssl.SSLError) as err:
+            raise ConnectionError("Could not connect to %s: %s" % (url, to_text(err)))
+        finally:
+            transport.release(conn, response)
+        connection._log_messages("received response: '%s'" % body)
+
+        if status >= 400:
+            error = HTTPError(url, status, reason, response_headers, BytesIO(body))
+            handled = self.handle_httperror(error)
+            if handled is True and retry_auth:
+                return self._http_send(data, headers, path, method, retry_auth=False,
+                                       timeout=timeout)
+            if handled is True or handled is False:
+                raise error
+            response = handled
+        else:
+            response = addinfourl(BytesIO(body), response_headers, url, status)
+        response_buffer = BytesIO(body)
+        connection._auth = self.update_auth(response, response_buffer) or connection._auth
+        response_buffer.seek(0)
+        return response, ResponseStream(response_buffer)
 
     def update_auth(self, response, response_text):
         """Return per-request auth token.
@@ -80,8 +1434,12 @@ class HttpApi(HttpApiBase):
         headers of a request. The default implementation uses cookie data.
         If no authentication data is found, return None
         """
+        body = response_text.getvalue()
+        # Only the login response carries the session, skip decoding the others
+        if b'UIDARUBA' not in body:
+            return None
         try:
-            cookie = json.loads(to_text(response_text.getvalue()))
+            cookie = json.loads(to_text(body))
             if '_global_result' in cookie.keys():
                 if 'UIDARUBA' in cookie['_global_result'].keys():
                     return {'Cookie': "SESSION=" + cookie['_global_result']['UIDARUBA']}
@@ -35,7 +35,11 @@ module: aos_api_config
 version_added: 2.8.1
 short_descriptions: REST API module for ArubaOS 8.X
 description: This module provides a configuration mechanism of ArubaOS products like Mobility Master and
-                   Mobility Controllers using AOS 8 API
+                   Mobility Controllers using AOS 8 API. POST requests support check mode,
+                   the configuration after the request is computed locally from the
+                   objects in data and returned as a diff. Between the begin and
+                   commit tasks of aos_transaction, POST requests are buffered by the
+                   persistent connection and changed is predicted locally.
 options:
     api_object:
         description:
@@ -57,9 +61,41 @@ options:
     config_path:
         description:
             - Path in the hierarchy where the API call should be applied
+            - For POST requests, it can be a glob pattern matched against the
+              node hierarchy, one level at a time, to push data to several nodes
+              like with config_paths. Example: /md/region/*/building
+            - One of config_path or config_paths is required
         required: false
         type: str
 
+    config_paths:
+        description:
+            - List of paths in the hierarchy, or glob patterns, a POST request
+              is applied to. The requests are sent concurrently, a node below
+              another node of the list after it, and one result per node is
+              returned in nodes. With commit, write_memory is sent
+              once per changed node after all the nodes are configured.
+        required: false
+        type: list
+
+    max_workers:
+        description:
+            - Maximum number of nodes configured at the same time with config_paths
+        required: false
+        default: 4
+        type: int
+
+    retry_failed:
+        description:
+            - Number of times the objects of a POST request which failed in the
+              response are sent again, alone, for example when the
+              configuration was locked by another session. The failed objects
+              left are returned in failures, with their object name, position
+              in data, key and status. Not used with config_paths.
+        required: false
+        default: 0
+        type: int
+
     data:
         description:
             - list of dictionaries where each element of list is a key value pairs
@@ -70,9 +106,55 @@ options:
     commit:
         description:
             - If set to True, it does a write_memory to flash
+            - Inside a transaction, the write_memory is done by the
+              aos_transaction commit task
         required: false
         type: bool
 
+    transaction_id:
+        description:
+            - Id of the transaction opened by the aos_transaction begin task,
+              set by the action plugin of the role from the aos_transaction_id
+              fact. A POST fails if the persistent connection did not open this
+              transaction, as when the connection was reset since the begin
+              task.
+        required: false
+        type: str
+
+    commit_mode:
+        description:
+            - When to do the write_memory requested by commit.
+              immediate - write_memory at the end of this task.
+              deferred - record config_path in the persistent connection and do a
+                         single write_memory per config_path with the
+                         aos_write_memory module, like the aos write memory
+                         handler of the role, or when the connection is closed
+                         at the end of the play. A write_memory which fails
+                         when the connection is closed is only a warning.
+        required: false
+        default: immediate
+        choices:
+            - immediate
+            - deferred
+        type: str
+
+    idempotency:
+        description:
+            - Method used to detect if a POST request changed the configuration
+              of the node at config_path.
+              scoped - only the objects present in data are fetched, with an
+                       OBJECT filter, before and after the POST. Falls back to
+                       full when the objects can not be determined, e.g. for
+                       action objects like write_memory or reload.
+              full - the complete configuration of the node is fetched and
+                     compared before and after the POST.
+        required: false
+        default: scoped
+        choices:
+            - scoped
+            - full
+        type: str
+
     filter:
         description:
             - Filter applied on the data received by a GET request
@@ -168,6 +250,25 @@ options:
         required: false
         type: int
 
+    paginate:
+        description:
+            - If set to True, a GET request fetches all the instances of api_object
+              in pages of limit objects (100 if limit is not set), starting from
+              offset, instead of a single page.
+        required: false
+        default: false
+        type: bool
+
+    dest:
+        description:
+            - Path of a file on the Ansible controller where the records of a
+              paginated GET request are written as JSON lines, one object per
+              line, page by page. The records are then left out of the module
+              result. They are written by the persistent connection, one record
+              decoded at a time when the ijson Python library is installed.
+        required: false
+        type: path
+
 """
 EXAMPLES = """
 #Usage Examples
@@ -198,6 +299,42 @@ EXAMPLES = """
                  ipmask: 255.0.0.0
        commit: True
 
+    - name: Add a radius server, write_memory once for the play at the end
+      aos_api_config:
+        method: POST
+        config_path: /md/SLR
+        data:
+         - rad_server:
+             - rad_server_name: test-dot1x
+               rad_host:
+                 host: 1.1.1.1
+        commit: True
+        commit_mode: deferred
+      notify: aos write memory
+
+    - name: Preview the changes of a POST request, nothing is sent to the controller
+      aos_api_config:
+        method: POST
+        config_path: /md/SLR
+        data:
+         - rad_server:
+             - rad_server_name: test-dot1x
+               rad_host:
+                 host: 1.1.1.2
+      check_mode: True
+      diff: True
+
+    - name: Push the same syslog server to all buildings of all sites
+      aos_api_config:
+        method: POST
+        config_paths:
+          - /md/region/*/building*
+        max_workers: 8
+        data:
+          - syslog_server:
+              - ipaddr: 10.1.1.50
+        commit: True
+
     - name: GET the hostname of MM
       aos_api_config:
         method: GET
@@ -211,12 +348,153 @@ EXAMPLES = """
         config_path: /md/Boston
         filter: [ {'OBJECT': { '$eq': [ 'ssid_prof.profile-name' ] } } ]
 
+    - name: Save all netdst aliases configured at /md to a JSON lines file
+      aos_api_config:
+        method: GET
+        api_object: netdst
+        config_path: /md
+        paginate: True
+        limit: 500
+        dest: /tmp/netdst.jsonl
+
 
 
 
 """
+import json
+import os
 from ansible.module_utils.basic import AnsibleModule
-from ansible.module_utils.aos_http import AosApi
+from ansible.module_utils.aos_http import AosApi, get_records
+from ansible.module_utils.aos_config import apply_payload, get_config_data, remove_inherited, \
+    strip_meta
+
+def predict_post(module, config_path, snapshot, objects, data):
+    '''
+    Result of a POST of data on config_path computed locally from the
+    snapshot of the objects it touches
+    '''
+    if not isinstance(snapshot, dict) or 'Error' in snapshot:
+        return dict(changed=False, failed=True, response=snapshot,
+                    msg="Unable to fetch the configuration of " + str(config_path))
+    running = get_config_data(snapshot, objects)
+    before = strip_meta(remove_inherited(running))
+    after = strip_meta(apply_payload(running, data))
+    result = dict(changed=before != after)
+    if module._diff:
+        result['diff'] = dict(before=json.dumps(before, indent=2, sort_keys=True) + '\n',
+                              after=json.dumps(after, indent=2, sort_keys=True) + '\n',
+                              before_header=config_path, after_header=config_path)
+    return result
+
+def check_post(module, api, config_url, data, config_paths=None):
+    '''
+    Check mode POST, predicts the configuration after the POST from a single
+    GET of the objects in data without sending any write request
+    '''
+    objects = api.get_payload_objects(config_url, data)
+    if objects is None:
+        api.exit_json(changed=True, msg="Changes made by action objects can not be"
+                                        " predicted in check mode")
+    if config_paths is None:
+        config_path = module.params.get('config_path')
+        snapshot = api.get_config_snapshot(config_path, objects)
+        result = predict_post(module, config_path, snapshot, objects, data)
+        if result.pop('failed', False):
+            api.fail_json(**result)
+        api.exit_json(**result)
+
+    snapshots = api.get_config_snapshots(config_paths, objects,
+                                         max_workers=module.params.get('max_workers'))
+    nodes = dict((config_path, predict_post(module, config_path, snapshots[config_path],
+                                            objects, data))
+                 for config_path in config_paths)
+    result = dict(changed=any(node['changed'] for node in nodes.values()), nodes=nodes)
+    if module._diff:
+        result['diff'] = [node.pop('diff') for node in nodes.values() if 'diff' in node]
+    failed = sorted(path for path, node in nodes.items() if node.get('failed'))
+    if failed:
+        api.fail_json(msg="Unable to fetch the configuration of " + ", ".join(failed), **result)
+    api.exit_json(**result)
+
+def post_fan_out(module, api, patterns, data):
+    '''
+    POST data to every config_path matching patterns concurrently, then
+    commit once per node
+    '''
+    config_paths = api.expand_config_paths(patterns)
+    if not config_paths:
+        api.fail_json(changed=False, msg="No node matches " + ", ".join(patterns))
+    if module.check_mode:
+        check_post(module, api, api.get_url('/configuration/object'), data, config_paths)
+
+    max_workers = module.params.get('max_workers')
+    nodes = {}
+    to_commit = []
+    for config_path, result in api.post_nodes(config_paths, data, max_workers).items():
+        node = dict(changed=result['changed'], response=result['resp'],
+                    response_code=result['code'], failed=True, msg=result['error'] or "")
+        if result['error'] is None and result['code'] == 200 and result['resp']:
+            res, pending, node['msg'] = api.validate_response(result['resp'])
+            node['failed'] = not res
+            if res and pending != 0:
+                to_commit.append(config_path)
+        nodes[config_path] = node
+
+    # write_memory once per node, after all the nodes are configured
+    if module.params.get('commit') and to_commit:
+        if module.params.get('commit_mode') == 'deferred':
+            for config_path in to_commit:
+                nodes[config_path]['commit'] = api.write_mem(config_path, defer=True)
+        else:
+            requests = [{'url': api.get_url('/configuration/object/write_memory',
+                                            params={'config_path': config_path}),
+                         'method': 'POST', 'data': json.dumps({})}
+                        for config_path in to_commit]
+            for config_path, result in zip(to_commit, api.http_requests(requests, max_workers)):
+                nodes[config_path]['commit'] = result['code'] == 200 and \
+                    result['error'] is None and 'Error' not in result['response']
+
+    changed = any(node['changed'] for node in nodes.values())
+    failed = sorted(path for path, node in nodes.items() if node['failed'])
+    if failed:
+        api.fail_json(changed=changed, nodes=nodes,
+                      msg="POST failed on " + ", ".join(failed))
+    api.exit_json(changed=changed, nodes=nodes)
+
+def get_all_pages(module, api, query_url):
+    '''
+    Paginated GET, returns the records of all pages or writes them to dest
+    '''
+    api_object = module.params.get('api_object')
+    dest = module.params.get('dest')
+    if dest:
+        # dest is written by the connection, whose working directory is /
+        dest = os.path.abspath(dest)
+    records = []
+    pages = 0
+    count = 0
+    code = None
+    # Only the records of api_object are decoded, dest is written by the connection
+    for result in api.get_pages(query_url, select='_data.' + api_object, dest=dest):
+        resp = result['resp']
+        code = result['code']
+        if not isinstance(resp, dict) or 'Error' in resp or (not dest and '_data' not in resp):
+            api.fail_json(changed=False, response=resp, response_code=code, pages=pages,
+                          msg="Page at offset %d could not be fetched" % count)
+        pages += 1
+        if dest:
+            count += result['records']
+        else:
+            page = get_records(resp)
+            count += len(page)
+            records.extend(page)
+
+    result = dict(changed=False, response_code=code, pages=pages, records=count)
+    if dest:
+        result['dest'] = dest
+    else:
+        result['response'] = {'_data': {api_object: records}}
+    api.exit_json(**result)
 
 def main():
     '''
@@ -225,9 +503,16 @@ def main():
     module = AnsibleModule(
         argument_spec=dict(
             method=dict(required=True, type='str', choices=['GET', 'POST']),
-            config_path=dict(required=True, type='str', default=None),
+            config_path=dict(required=False, type='str', default=None),
+            config_paths=dict(required=False, type='list', elements='str', default=None),
+            max_workers=dict(required=False, type='int', default=4),
+            retry_failed=dict(required=False, type='int', default=0),
             data=dict(required=False, type='list', elements='dict', default=list()),
             commit=dict(required=False, type='bool', default=False),
+            commit_mode=dict(required=False, type='str', choices=['immediate', 'deferred'],
+                             default='immediate'),
+            idempotency=dict(required=False, type='str', choices=['scoped', 'full'],
+                             default='scoped'),
             api_object=dict(required=False, type='str', default=None),
             #GET response modifiers
             filter=dict(required=False, type='list', default=list()),
@@ -237,16 +522,31 @@ def main():
             offset=dict(required=False, type='int', default=None),
             total=dict(required=False, type='int', default=None),
             type=dict(required=False, type='str', default=None),
+            paginate=dict(required=False, type='bool', default=False),
+            dest=dict(required=False, type='path', default=None),
+            transaction_id=dict(required=False, type='str', default=None),
 
-        ))
+        ),
+        required_one_of=[['config_path', 'config_paths']],
+        mutually_exclusive=[['config_path', 'config_paths']],
+        supports_check_mode=True)
 
     config_path = module.params.get('config_path')
     method = module.params.get('method')
     api = AosApi(module)
 
+    config_paths = module.params.get('config_paths')
+    if config_path and any(char in config_path for char in '*?['):
+        config_paths = [config_path]
+    if config_paths and method != "POST":
+        api.fail_json(changed=False, msg="Several config_paths are only supported"
+                                         " with the POST method")
+
     if method == "GET":
         api_object = module.params.get('api_object')
         query_url = '/configuration/object/' + api_object
+        if module.params.get('paginate'):
+            get_all_pages(module, api, query_url)
         query_params = api.get_query_params()
         request = api.get_url(query_url, params=query_params)
         result = api.get(url=request)
@@ -255,15 +555,15 @@ def main():
 
         try:
             if "_data" in resp.keys():
-                module.exit_json(changed=False, response=resp, response_code=code)
+                api.exit_json(changed=False, response=resp, response_code=code)
             elif resp is not None:
-                module.exit_json(changed=False, response=resp, response_code=code)
+                api.exit_json(changed=False, response=resp, response_code=code)
             else:
-                module.fail_json(change=False, response=resp, response_code=code,
-                                 msg=str("Check if valid parameters are provided"
-                                         " in the playbook."))
+                api.fail_json(change=False, response=resp, response_code=code,
+                              msg=str("Check if valid parameters are provided"
+                                      " in the playbook."))
         except AttributeError:
-            module.exit_json(changed=False, response=resp, response_code=code)
+            api.exit_json(changed=False, response=resp, response_code=code)
 
     if method == "POST":
         failed = False
@@ -271,9 +571,29 @@ def main():
         commit = module.params.get('commit')
         config_url = api.get_url('/configuration/object', params={'config_path': config_path})
         data = api.format_data()
+        # Inside a transaction the POST is buffered by the connection and
+        # sent by the aos_transaction commit task
+        transaction = api.get_transaction(config_path, module.params.get('transaction_id'))
+        if module.check_mode:
+            transaction = None
+        if transaction is not None:
+            if config_paths:
+                api.fail_json(changed=False, msg="POSTs on several config_paths can not be"
+                                                 " buffered in a transaction")
+            result = api.buffer_post(config_path, data, transaction, commit)
+            if result.pop('failed', False):
+                api.fail_json(**result)
+            api.exit_json(**result)
+        if config_paths:
+            post_fan_out(module, api, config_paths, data)
+        if module.check_mode:
+            check_post(module, api, config_url, data)
         result, changed = api.post(url=config_url, data=data)
         resp = result['resp']
         code = result['code']
+        # Failed objects left and earlier attempts when retry_failed is set
+        retried = dict((key, result[key]) for key in ('failures', 'attempts') if key in result)
+        status_str = ""
         if code == 200:
             if resp and resp != "":
                 res, pending, status_str = api.validate_response(resp)
@@ -281,20 +601,21 @@ def main():
 
                 # write_memory if commit is true
                 if commit and pending != 0:
-                    commit_status = api.write_mem()
+                    commit_status = api.write_mem(
+                        defer=module.params.get('commit_mode') == 'deferred')
         else:
             failed = True
 
         if failed:
-            module.fail_json(changed=changed, response=resp,
-                             response_code=code, msg=status_str)
+            api.fail_json(changed=changed, response=resp,
+                          response_code=code, msg=status_str, **retried)
         else:
-            module.exit_json(changed=changed, response=resp,
-                             response_code=code, msg=status_str)
+            api.exit_json(changed=changed, response=resp,
+                          response_code=code, msg=status_str, **retried)
     else:
-        module.fail_json(changed=False, msg="Invalid method type."
-                         " Only GET and POST methods are supported on"
-                         " Aruba Mobility Master and Controllers")
+        api.fail_json(changed=False, msg="Invalid method type."
+                      " Only GET and POST methods are supported on"
+                      " Aruba Mobility Master and Controllers")
 
 if __name__ == '__main__':
     main()
@@ -48,23 +48,50 @@ options:
     ap_name:
         description:
             - Name you would like to give to the the Access Point
+            - In bulk mode, applies to the entries which do not set ap_name
         required: false
         type: str
     ap_group:
         description:
             - Name of AP group where the Access Point needs to be added
+            - In bulk mode, applies to the entries which do not set ap_group
         required: false
         type: str
     mac_address:
         description:
             - MAC address of the Campus Access Point
-        required: true
+            - One of mac_address, entries or csv_path is required
+        required: false
         type: str
     description:
         description:
             - Short description for the Access Point
+            - In bulk mode, applies to the entries which do not set description
         required: false
         type: str
+    entries:
+        description:
+            - List of Access Points to add or delete in bulk. Each element is a
+              dictionary with the keys mac, ap_name, ap_group and description,
+              only mac is required. Access Points already whitelisted with
+              other attributes are modified.
+        required: false
+        type: list
+    csv_path:
+        description:
+            - Path of a CSV file on the Ansible controller listing the Access
+              Points to add or delete in bulk. The header row must name the
+              columns mac, ap_name, ap_group and description, only mac is
+              required.
+        required: false
+        type: path
+    chunk_size:
+        description:
+            - Maximum number of MAC addresses sent in a single multipart
+              request in bulk mode, at least 1.
+        required: false
+        default: 100
+        type: int
 
 """
 EXAMPLES = """
@@ -96,28 +123,196 @@ EXAMPLES = """
        mac_address: "zx:32:32:32:32:33"
        description: This is just for testing
 
+    - name: Whitelist a list of Access Points
+      aos_cap_whitelist:
+       action: add
+       entries:
+         - mac: "ab:32:32:32:32:34"
+           ap_name: test-ap-3
+           ap_group: test-ap-group
+         - mac: "ab:32:32:32:32:35"
+           ap_name: test-ap-4
+           ap_group: test-ap-group
 
+    - name: Whitelist the Access Points of a CSV file, 200 per request
+      aos_cap_whitelist:
+       action: add
+       csv_path: /home/admin/campus_aps.csv
+       chunk_size: 200
 
 """
 
+import csv
+import json
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.aos_http import AosApi
 
+ENTRY_KEYS = ('mac', 'ap_name', 'ap_group', 'description')
+
+# Status of a MAC sent in bulk with each endpoint
+BULK_STATUS = {'wdb_cpsec_add_mac': 'added',
+               'wdb_cpsec_modify_mac': 'modified',
+               'wdb_cpsec_del_mac': 'deleted'}
+
+def read_entries(module):
+    # Bulk entries from the entries option or the CSV file
+    entries = module.params.get('entries')
+    csv_path = module.params.get('csv_path')
+    if csv_path:
+        try:
+            with open(csv_path) as csv_file:
+                entries = [row for row in csv.DictReader(csv_file)]
+        except (IOError, OSError, csv.Error) as err:
+            module.fail_json(changed=False, msg="Unable to read %s: %s" % (csv_path, str(err)))
+
+    bulk = []
+    for index, entry in enumerate(entries):
+        entry = dict((key.strip(), value.strip() if isinstance(value, str) else value)
+                     for key, value in entry.items() if key and value not in (None, ''))
+        if 'mac' not in entry:
+            module.fail_json(changed=False, msg="Entry %d has no mac: %s" % (index, str(entry)))
+        unknown = set(entry) - set(ENTRY_KEYS)
+        if unknown:
+            module.fail_json(changed=False, msg="Entry %d has unsupported keys: %s"
+                             % (index, ", ".join(sorted(unknown))))
+        entry['mac'] = str(entry['mac']).lower()
+        bulk.append(entry)
+    return bulk
+
+def get_whitelist(api):
+    # Attributes of every MAC address of the whitelist-db keyed by MAC, None
+    # if the output can not be parsed
+    request = api.get_url("/configuration/showcommand",
+                          params={"command": "show whitelist-db cpsec"})
+    resp = api.get(url=request)['resp']
+    if not isinstance(resp, dict):
+        return None
+    whitelist = None
+    for table in resp.values():
+        if not isinstance(table, list) or not all(isinstance(row, dict) for row in table):
+            continue
+        whitelist = whitelist or {}
+        for row in table:
+            mac = None
+            attributes = {}
+            for key, value in row.items():
+                column = key.lower().replace('-', '_').replace(' ', '_')
+                if 'mac' in column and value:
+                    mac = str(value).lower()
+                elif column in ENTRY_KEYS[1:] and value not in (None, ''):
+                    attributes[column] = str(value)
+            if mac:
+                whitelist[mac] = attributes
+    return whitelist
+
+def is_unchanged(entry, whitelist, action):
+    # True if the MAC of entry is already in the requested state, with the
+    # same attributes when it is added
+    if whitelist is None:
+        return False
+    if action == 'delete':
+        return entry['mac'] not in whitelist
+    current = whitelist.get(entry['mac'])
+    return current is not None and \
+        all(str(entry[key]) == current.get(key) for key in ENTRY_KEYS[1:] if key in entry)
+
+def get_mac_results(resp, chunk):
+    # Status of every MAC in a multipart response, falls back to the
+    # _global_result when the controller does not return per object results
+    global_result = resp.get("_global_result", {"status": 1, "status_str": str(resp)})
+    mac_results = dict((entry['mac'], global_result) for entry in chunk)
+    for part in resp.get("_list", []):
+        for endpoint in BULK_STATUS:
+            item = part.get(endpoint)
+            if isinstance(item, dict) and "_result" in item and "name" in item:
+                mac_results[str(item["name"]).lower()] = item["_result"]
+    return mac_results
+
+def bulk_whitelist(module, api, action):
+    entries = read_entries(module)
+    chunk_size = module.params.get('chunk_size')
+    if action == 'add':
+        # ap_name, ap_group and description apply to the entries which do
+        # not set them
+        defaults = dict((key, module.params.get(key)) for key in ENTRY_KEYS[1:]
+                        if module.params.get(key) is not None)
+        entries = [dict(defaults, **entry) for entry in entries]
+
+    # Only send the MACs which are not already in the requested state, the
+    # MACs already whitelisted with other attributes are modified
+    whitelist = get_whitelist(api)
+    statuses = {}
+    pending = []
+    for entry in entries:
+        if is_unchanged(entry, whitelist, action):
+            statuses[entry['mac']] = {'mac': entry['mac'], 'status': 'unchanged', 'status_str': ''}
+        else:
+            pending.append(entry)
+
+    changed = False
+    failed = []
+    code = None
+    config_url = "/v1/configuration/object?"
+    for index in range(0, len(pending), chunk_size):
+        chunk = pending[index:index + chunk_size]
+        data_list = []
+        endpoints = {}
+        for entry in chunk:
+            data = {"name": entry['mac']}
+            endpoints[entry['mac']] = "wdb_cpsec_del_mac"
+            if action == 'add':
+                data.update((key, entry[key]) for key in ENTRY_KEYS[1:] if key in entry)
+                exists = whitelist is not None and entry['mac'] in whitelist
+                endpoints[entry['mac']] = "wdb_cpsec_modify_mac" if exists \
+                    else "wdb_cpsec_add_mac"
+            data_list.append({endpoints[entry['mac']]: data})
+        resp, code = api.http_request(url=config_url, method="POST",
+                                      data=json.dumps({"_list": data_list}))
+        if not isinstance(resp, dict):
+            resp = {"_global_result": {"status": 1, "status_str": str(resp)}}
+        mac_results = get_mac_results(resp, chunk)
+        for entry in chunk:
+            mac_result = mac_results[entry['mac']]
+            if str(mac_result["status"]) == "0":
+                changed = True
+                status = BULK_STATUS[endpoints[entry['mac']]]
+            else:
+                failed.append(entry['mac'])
+                status = 'failed'
+            statuses[entry['mac']] = {'mac': entry['mac'], 'status': status,
+                                      'status_str': mac_result.get("status_str", "")}
+
+    results = [statuses[entry['mac']] for entry in entries]
+    if failed:
+        api.fail_json(changed=changed, mac_status=results, response_code=code,
+                      msg="Failed to %s MAC address(es) %s" % (action, ", ".join(failed)))
+    api.exit_json(changed=changed, mac_status=results, response_code=code)
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
             action=dict(required=True, type='str', choices=['add', 'delete']),
             ap_name=dict(required=False, type='str'),
             ap_group=dict(required=False, type='str'),
-            mac_address=dict(required=True, type='str'),
-            description=dict(required=False, type='str')
-        ))
+            mac_address=dict(required=False, type='str'),
+            description=dict(required=False, type='str'),
+            entries=dict(required=False, type='list', elements='dict'),
+            csv_path=dict(required=False, type='path'),
+            chunk_size=dict(required=False, type='int', default=100)
+        ),
+        required_one_of=[['mac_address', 'entries', 'csv_path']],
+        mutually_exclusive=[['mac_address', 'entries', 'csv_path']])
     action = module.params.get('action')
     ap_name = module.params.get('ap_name')
     ap_group = module.params.get('ap_group')
     mac_address = module.params.get('mac_address')
     description = module.params.get('description')
     api = AosApi(module)
+    if module.params.get('chunk_size') < 1:
+        api.fail_json(changed=False, msg="chunk_size must be at least 1")
+
+    if mac_address is None:
+        bulk_whitelist(module, api, action)
 
     if action == 'add':
         config_url = "/v1/configuration/object/wdb_cpsec_add_mac?"
@@ -130,12 +325,12 @@ def main():
 
     result, changed = api.post(url=config_url, data=data)
     resp = result['resp']
-    if resp.has_key("_global_result") and resp["_global_result"]["status"] == 0:
-        module.exit_json(changed=changed, response=resp, response_code=result['code'])
+    if "_global_result" in resp and resp["_global_result"]["status"] == 0:
+        api.exit_json(changed=changed, response=resp, response_code=result['code'])
 
     else:
-        module.fail_json(changed=False, response=resp, response_code=result['code'],
-                         msg=str(resp["_global_result"]["status_str"]))
+        api.fail_json(changed=False, response=resp, response_code=result['code'],
+                      msg=str(resp["_global_result"]["status_str"]))
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,308 @@
+#!/usr/bin/python3
+'''
+Module for backing up the configuration of the nodes of the hierarchy to
+files, rewriting only the nodes which changed, and restoring the nodes which
+differ from their backup
+'''
+
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = """
+---
+module: aos_config_backup
+version_added: 2.8.1
+short_description: Incremental backup and restore of the configuration hierarchy
+description: Walks the configuration hierarchy and writes the objects
+             configured on every node, without the inherited ones, to a file
+             per node as canonical JSON, sorted keys and compact separators.
+             The configurations are written from the persistent connection and
+             never returned in the result. A manifest in dest keeps the sha256
+             of every file, only the nodes whose content changed are rewritten.
+             Restore compares the running configuration of every node with the
+             manifest and only sends the delta to the nodes which differ.
+options:
+    action:
+        description:
+            - backup writes the nodes which changed, restore replays the
+              backup of the nodes which differ from it.
+        required: false
+        default: backup
+        choices:
+            - backup
+            - restore
+        type: str
+    dest:
+        description:
+            - Directory of the backup, holding manifest.json and a JSON file
+              per node, like md/Boston.json for /md/Boston and _root.json for
+              the root node /
+        required: true
+        type: path
+    config_paths:
+        description:
+            - Nodes to back up or restore, glob patterns like /md/* are
+              matched one level at a time. By default every node of the
+              hierarchy for backup, every node of the manifest for restore.
+        required: false
+        type: list
+    max_workers:
+        description:
+            - Maximum number of nodes fetched or restored concurrently
+        required: false
+        default: 4
+        type: int
+    purge:
+        description:
+            - If set to True, restore deletes the instances of the objects of
+              the backup which are configured on the node but not in the
+              backup, see aos_config_state.
+        required: false
+        default: false
+        type: bool
+    retry_failed:
+        description:
+            - Number of times the objects rejected by a restore are sent again,
+              alone. Objects are restored in alphabetical order, objects
+              rejected because they use an object restored later succeed when
+              sent again.
+        required: false
+        default: 1
+        type: int
+    commit:
+        description:
+            - If set to True, a write_memory is done on every restored node
+        required: false
+        default: false
+        type: bool
+    commit_mode:
+        description:
+            - When to do the write_memory requested by commit, see aos_api_config
+        required: false
+        default: immediate
+        choices:
+            - immediate
+            - deferred
+        type: str
+"""
+EXAMPLES = """
+#Usage Examples
+    - name: Nightly backup, only the nodes which changed are rewritten
+      aos_config_backup:
+        dest: /var/backups/aos/mm1
+
+    - name: Back up the nodes below /md
+      aos_config_backup:
+        dest: /var/backups/aos/mm1
+        config_paths:
+          - /md
+          - /md/*
+
+    - name: Show which nodes differ from the backup
+      aos_config_backup:
+        action: restore
+        dest: /var/backups/aos/mm1
+      check_mode: True
+
+    - name: Restore the nodes which differ from the backup
+      aos_config_backup:
+        action: restore
+        dest: /var/backups/aos/mm1
+        purge: True
+        commit: True
+"""
+
+import datetime
+import hashlib
+import json
+import os
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils._text import to_bytes
+from ansible.module_utils.aos_http import AosApi
+from ansible.module_utils.aos_config import canonical, compute_delta, get_config_data, \
+    get_local_config
+
+MANIFEST = "manifest.json"
+
+def get_node_file(config_path):
+    # Path of the backup of config_path relative to dest, the root node is
+    # saved to _root.json, which no node named root can collide with
+    return (config_path.strip('/') or '_root') + '.json'
+
+def get_sha256(snapshot):
+    # sha256 of the backup of a node, as written by the connection
+    return hashlib.sha256(to_bytes(canonical(get_local_config(snapshot)))).hexdigest()
+
+def load_manifest(dest):
+    # Nodes of the manifest of dest, empty if there is no manifest yet
+    path = os.path.join(dest, MANIFEST)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as manifest_file:
+        return json.load(manifest_file).get('nodes', {})
+
+def save_manifest(dest, nodes):
+    # Written aside then renamed so that the manifest is never truncated
+    path = os.path.join(dest, MANIFEST)
+    with open(path + '.tmp', 'w') as manifest_file:
+        json.dump({'nodes': nodes}, manifest_file, indent=2, sort_keys=True)
+    os.rename(path + '.tmp', path)
+
+def backup(module, api, dest, config_paths):
+    # Fetch every node, rewrite the files and the manifest entries which changed
+    max_workers = module.params.get('max_workers')
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    nodes = load_manifest(dest)
+    backups = [{'config_path': config_path,
+                'dest': os.path.join(dest, get_node_file(config_path)),
+                'sha256': nodes.get(config_path, {}).get('sha256')}
+               for config_path in config_paths]
+    if module.check_mode:
+        # Only the hashes are computed, nothing is written
+        backups = [dict(entry, dest=None) for entry in backups]
+    results = api.backup_configs(backups, max_workers)
+
+    changed_nodes = []
+    failed = {}
+    now = datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%SZ')
+    for result in results:
+        config_path = result['config_path']
+        if result['error'] is not None:
+            failed[config_path] = result['error']
+        elif result['sha256'] != nodes.get(config_path, {}).get('sha256') or result['written']:
+            changed_nodes.append(config_path)
+            nodes[config_path] = {'file': get_node_file(config_path), 'sha256': result['sha256'],
+                                  'bytes': result['bytes'], 'updated': now}
+    if changed_nodes and not module.check_mode:
+        save_manifest(dest, nodes)
+
+    output = dict(changed=bool(changed_nodes), changed_nodes=sorted(changed_nodes),
+                  unchanged=len(results) - len(changed_nodes) - len(failed),
+                  manifest=os.path.join(dest, MANIFEST))
+    if failed:
+        api.fail_json(msg="Failed to back up " + ", ".join(sorted(failed)), failed=failed,
+                      **output)
+    api.exit_json(**output)
+
+def restore(module, api, dest, config_paths):
+    # Send the delta between the backup and the running configuration of
+    # the nodes whose hash differs from the manifest
+    max_workers = module.params.get('max_workers')
+    nodes = load_manifest(dest)
+    if not nodes:
+        api.fail_json(changed=False, msg="No backup manifest in " + dest)
+    missing = [config_path for config_path in config_paths if config_path not in nodes]
+    if missing:
+        api.fail_json(changed=False, msg="No backup of " + ", ".join(missing))
+
+    # The nodes are fetched once, their hash computed as the backup does
+    snapshots = api.get_config_snapshots(config_paths, refresh=True, max_workers=max_workers)
+    failed = dict((config_path, str(snapshot)) for config_path, snapshot in snapshots.items()
+                  if not isinstance(snapshot, dict) or 'Error' in snapshot)
+    if failed:
+        api.fail_json(changed=False, failed=failed,
+                      msg="Failed to fetch " + ", ".join(sorted(failed)))
+    differ = [config_path for config_path in config_paths
+              if get_sha256(snapshots[config_path]) != nodes[config_path]['sha256']]
+
+    payloads = {}
+    for config_path in differ:
+        snapshot = snapshots[config_path]
+        with open(os.path.join(dest, nodes[config_path]['file'])) as node_file:
+            saved = json.load(node_file)
+        desired = [{name: saved[name]} for name in sorted(saved)]
+        operations = compute_delta(get_config_data(snapshot), desired, module.params.get('purge'))
+        if operations:
+            payloads[config_path] = {"_list": [{name: payload} for name, payload in operations]}
+
+    restored = dict((config_path, {'operations': len(data['_list'])})
+                    for config_path, data in payloads.items())
+    output = dict(changed=bool(payloads), differ_nodes=sorted(differ), restored_nodes=restored)
+    if not payloads or module.check_mode:
+        api.exit_json(**output)
+
+    urls = dict((config_path, api.get_url('/configuration/object',
+                                          params={'config_path': config_path}))
+                for config_path in payloads)
+    requests = [{'url': urls[config_path], 'method': 'POST',
+                 'data': json.dumps(payloads[config_path])} for config_path in sorted(payloads)]
+    responses = api.http_requests(requests, max_workers)
+    for config_path, response in zip(sorted(payloads), responses):
+        result = {'resp': response['response'], 'code': response['code']}
+        if response['error'] is None and module.params.get('retry_failed'):
+            result = api.retry_failed(urls[config_path], payloads[config_path], result,
+                                      module.params.get('retry_failed'))
+        status = restored[config_path]
+        if response['error'] is not None or result['code'] != 200 or \
+                not isinstance(result['resp'], dict):
+            status['status_str'] = response['error'] or str(result['resp'])
+            failed[config_path] = status['status_str']
+            continue
+        res, pending, status['status_str'] = api.validate_response(result['resp'])
+        if not res:
+            failed[config_path] = status['status_str']
+        elif module.params.get('commit') and pending != 0:
+            api.write_mem(config_path=config_path,
+                          defer=module.params.get('commit_mode') == 'deferred')
+    if failed:
+        api.fail_json(msg="Failed to restore " + ", ".join(sorted(failed)), failed=failed,
+                      **output)
+    api.exit_json(**output)
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            action=dict(required=False, type='str', default='backup',
+                        choices=['backup', 'restore']),
+            dest=dict(required=True, type='path'),
+            config_paths=dict(required=False, type='list', elements='str'),
+            max_workers=dict(required=False, type='int', default=4),
+            purge=dict(required=False, type='bool', default=False),
+            retry_failed=dict(required=False, type='int', default=1),
+            commit=dict(required=False, type='bool', default=False),
+            commit_mode=dict(required=False, type='str', choices=['immediate', 'deferred'],
+                             default='immediate')
+        ),
+        supports_check_mode=True)
+    action = module.params.get('action')
+    dest = os.path.abspath(module.params.get('dest'))
+    api = AosApi(module)
+
+    config_paths = module.params.get('config_paths')
+    if config_paths:
+        config_paths = api.expand_config_paths(config_paths)
+    elif action == "backup":
+        config_paths = api.get_node_paths()
+    else:
+        config_paths = sorted(load_manifest(dest))
+
+    if action == "backup":
+        backup(module, api, dest, config_paths)
+    else:
+        restore(module, api, dest, config_paths)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/python3
+'''
+Module for converging the configuration of a node to a desired state
+'''
+
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = """
+---
+module: aos_config_state
+version_added: 2.8.1
+short_description: Declarative configuration of a node of the hierarchy on
+                   ArubaOS products like Mobility Master and Mobility Controllers
+description: Takes the desired state of configuration objects for a config_path,
+             reads the running objects once and sends only the additions,
+             modifications and deletions needed to converge, in a single
+             multipart request. A node already in the desired state costs one
+             GET and no write. Supports check mode and diff.
+options:
+    config_path:
+        description:
+            - Path in the hierarchy where the configuration applies
+        required: true
+        type: str
+    config:
+        description:
+            - Desired state, a list of dictionaries where each element is an api
+              object and its configuration, in the same format as the data of
+              aos_api_config. List objects in dependency order, objects which are
+              used by others first (servers, then server groups, then AAA
+              profiles, then SSID and virtual AP profiles). Additions and
+              modifications are sent in this order, deletions in reverse order.
+            - An instance with _action delete is removed if it exists.
+        required: true
+        type: list
+    purge:
+        description:
+            - If set to True, instances of the multi-instance objects listed in
+              config which are configured on config_path but not listed in
+              config are deleted. Instances inherited from the nodes above are
+              never deleted.
+        required: false
+        default: false
+        type: bool
+    commit:
+        description:
+            - If set to True, it does a write_memory to flash when changes are sent
+        required: false
+        default: false
+        type: bool
+    retry_failed:
+        description:
+            - Number of times the operations which failed in the response are
+              sent again, alone. The failed operations left are returned in
+              failures, with their object name, position in operations, key
+              and status.
+        required: false
+        default: 0
+        type: int
+    commit_mode:
+        description:
+            - When to do the write_memory requested by commit, see aos_api_config
+        required: false
+        default: immediate
+        choices:
+            - immediate
+            - deferred
+        type: str
+"""
+EXAMPLES = """
+#Usage Examples
+    - name: Converge the RADIUS servers and server group of /md/Boston
+      aos_config_state:
+        config_path: /md/Boston
+        purge: True
+        commit: True
+        config:
+          - rad_server:
+              - rad_server_name: radius-1
+                rad_host:
+                  host: 10.1.1.10
+              - rad_server_name: radius-2
+                rad_host:
+                  host: 10.1.1.11
+          - server_group_prof:
+              - sg_name: dot1x-servers
+                auth_server:
+                  - name: radius-1
+                  - name: radius-2
+"""
+
+import json
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.aos_http import AosApi
+from ansible.module_utils.aos_config import (apply_payload, compute_delta,
+                                             get_config_data, remove_inherited, strip_meta)
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            config_path=dict(required=True, type='str'),
+            config=dict(required=True, type='list', elements='dict'),
+            purge=dict(required=False, type='bool', default=False),
+            retry_failed=dict(required=False, type='int', default=0),
+            commit=dict(required=False, type='bool', default=False),
+            commit_mode=dict(required=False, type='str', choices=['immediate', 'deferred'],
+                             default='immediate')
+        ),
+        supports_check_mode=True)
+    config_path = module.params.get('config_path')
+    desired = module.params.get('config')
+    api = AosApi(module)
+
+    for part in desired:
+        for name, value in part.items():
+            if not isinstance(value, (dict, list)) or \
+                    isinstance(value, list) and not all(isinstance(entry, dict) for entry in value):
+                module.fail_json(msg="The configuration of %s must be a dictionary or a list "
+                                     "of dictionaries, got %r" % (name, value))
+
+    objects = sorted(set(name for part in desired for name in part))
+    snapshot = api.get_config_snapshot(config_path, objects)
+    if not isinstance(snapshot, dict) or 'Error' in snapshot:
+        api.fail_json(changed=False, response=snapshot,
+                      msg="Unable to fetch the configuration of " + str(config_path))
+    running = get_config_data(snapshot, objects)
+
+    operations = compute_delta(running, desired, module.params.get('purge'))
+    data = {"_list": [{name: payload} for name, payload in operations]}
+    result = dict(changed=bool(operations), operations=data["_list"])
+    if module._diff:
+        before = strip_meta(remove_inherited(running))
+        after = strip_meta(apply_payload(running, data))
+        result['diff'] = dict(before=json.dumps(before, indent=2, sort_keys=True) + '\n',
+                              after=json.dumps(after, indent=2, sort_keys=True) + '\n',
+                              before_header=config_path, after_header=config_path)
+    if not operations or module.check_mode:
+        api.exit_json(**result)
+
+    # The delta already tells what changes, no idempotency GETs around the POST
+    config_url = api.get_url('/configuration/object', params={'config_path': config_path})
+    resp, code = api.http_request(url=config_url, method="POST", data=json.dumps(data))
+    if module.params.get('retry_failed'):
+        retried = api.retry_failed(config_url, data, {'resp': resp, 'code': code},
+                                   module.params.get('retry_failed'))
+        resp, code = retried['resp'], retried['code']
+        result.update(failures=retried['failures'], attempts=retried['attempts'])
+    result.update(response=resp, response_code=code)
+    if code != 200 or not isinstance(resp, dict):
+        api.fail_json(msg="Failed to apply the configuration delta", **result)
+    res, pending, status_str = api.validate_response(resp)
+    if not res:
+        api.fail_json(msg=status_str, **result)
+    if module.params.get('commit') and pending != 0:
+        api.write_mem(defer=module.params.get('commit_mode') == 'deferred')
+    api.exit_json(msg=status_str, **result)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,283 @@
+#!/usr/bin/python3
+'''
+Module for gathering facts about ArubaOS controllers
+'''
+
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = """
+---
+module: aos_facts
+version_added: 2.8.1
+short_description: Gather facts about ArubaOS controllers
+description: Collects the selected subsets of facts and returns them as compact
+             host facts prefixed with aos_, available to the rest of the play
+             and to the fact cache. The show commands of all the subsets are
+             run in a single concurrent batch through the show command cache
+             of the connection, and the VLANs are read from its configuration
+             snapshot cache. Failures are returned in failed, keyed by show
+             command, node_hierarchy or configuration of config_path.
+options:
+    gather_subset:
+        description:
+            - Subsets of facts to gather, among hardware, version, hierarchy,
+              vlans, aps and interfaces, or all. A subset prefixed with ! is
+              excluded, like !aps.
+        required: false
+        default:
+            - all
+        type: list
+    config_path:
+        description:
+            - Path in the hierarchy of the node whose VLANs are gathered
+        required: false
+        default: /md
+        type: str
+    max_workers:
+        description:
+            - Maximum number of requests sent concurrently
+        required: false
+        default: 4
+        type: int
+"""
+EXAMPLES = """
+#Usage Examples
+    - name: Gather all the facts
+      aos_facts:
+
+    - name: Gather everything but the Access Points
+      aos_facts:
+        gather_subset:
+          - all
+          - "!aps"
+
+    - name: Gather the version and the VLANs of /md/Boston
+      aos_facts:
+        gather_subset:
+          - version
+          - vlans
+        config_path: /md/Boston
+
+    - debug:
+        msg: "{{ aos_hostname }} runs {{ aos_version }}"
+"""
+
+import re
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.aos_http import AosApi, get_node_paths
+from ansible.module_utils.aos_config import get_config_data
+
+SUBSETS = ('hardware', 'version', 'hierarchy', 'vlans', 'aps', 'interfaces')
+
+# Show commands needed by every subset
+SUBSET_COMMANDS = {
+    'hardware': ['show inventory'],
+    'version': ['show version', 'show hostname'],
+    'hierarchy': ['show switches'],
+    'aps': ['show ap database long'],
+    'interfaces': ['show ip interface brief'],
+}
+
+# Configuration objects of the vlans subset
+VLAN_OBJECTS = ['vlan_id', 'vlan_name_id']
+
+VERSION_RE = re.compile(r'Version\s+(\d+(?:\.\d+)+)')
+MODEL_RE = re.compile(r'MODEL:\s*([^)]+)\)')
+
+def get_subsets(gather_subset):
+    # Selected subsets from the gather_subset option, fails on unknown ones
+    selected = set()
+    excluded = set()
+    for subset in gather_subset:
+        exclude = subset.startswith('!')
+        name = subset[1:] if exclude else subset
+        if name == 'all':
+            names = set(SUBSETS)
+        elif name in SUBSETS:
+            names = set([name])
+        else:
+            return None, name
+        (excluded if exclude else selected).update(names)
+    if not selected:
+        selected = set(SUBSETS)
+    return sorted(selected - excluded), None
+
+def is_success(result):
+    # Whether a show command returned its output
+    return result['error'] is None and result['code'] == 200 and \
+        isinstance(result['response'], dict) and 'Error' not in result['response']
+
+def get_lines(response):
+    # Text lines of an unstructured show command output
+    lines = response.get('_data') if isinstance(response, dict) else None
+    return [str(line) for line in lines] if isinstance(lines, list) else []
+
+def get_table(response):
+    # Rows of the first table of a structured show command output, with keys
+    # in lower case snake case
+    for name, rows in (response.items() if isinstance(response, dict) else []):
+        if name.startswith('_') or not isinstance(rows, list):
+            continue
+        return [dict((re.sub(r'[^a-z0-9]+', '_', key.lower()).strip('_'), value)
+                     for key, value in row.items())
+                for row in rows if isinstance(row, dict)]
+    return []
+
+def get_key_values(lines):
+    # Key : value lines of a show command output, keys in lower case
+    values = {}
+    for line in lines:
+        key, sep, value = line.partition(':')
+        if sep:
+            values[key.strip().lower()] = value.strip()
+    return values
+
+def parse_hardware(outputs):
+    values = get_key_values(get_lines(outputs['show inventory']))
+    facts = {'aos_serial': None, 'aos_model': None, 'aos_mac_address': None}
+    for key, value in values.items():
+        if 'serial' in key and facts['aos_serial'] is None:
+            facts['aos_serial'] = value
+        elif 'model' in key and facts['aos_model'] is None:
+            facts['aos_model'] = value
+        elif 'mac address' in key and facts['aos_mac_address'] is None:
+            facts['aos_mac_address'] = value
+    return facts
+
+def parse_version(outputs):
+    text = "\n".join(get_lines(outputs['show version']))
+    version = VERSION_RE.search(text)
+    model = MODEL_RE.search(text)
+    hostname = None
+    for line in get_lines(outputs['show hostname']):
+        if line.lower().startswith('hostname is'):
+            hostname = line[len('hostname is'):].strip()
+    facts = {'aos_version': version.group(1) if version else None,
+             'aos_hostname': hostname}
+    if model:
+        facts['aos_platform'] = model.group(1).strip()
+    return facts
+
+def parse_aps(outputs):
+    aps = get_table(outputs['show ap database long'])
+    groups = {}
+    up = 0
+    for ap in aps:
+        group = ap.get('group') or ap.get('ap_group') or 'default'
+        groups[group] = groups.get(group, 0) + 1
+        if str(ap.get('status', '')).lower().startswith('up'):
+            up += 1
+    return {'aos_aps': {'total': len(aps), 'up': up, 'down': len(aps) - up, 'groups': groups}}
+
+def parse_interfaces(outputs):
+    return {'aos_interfaces': get_table(outputs['show ip interface brief'])}
+
+def parse_switches(outputs):
+    switches = []
+    for switch in get_table(outputs['show switches']):
+        switches.append({'name': switch.get('name'), 'ip_address': switch.get('ip_address'),
+                         'type': switch.get('type'), 'version': switch.get('version'),
+                         'status': switch.get('status', switch.get('configuration_state'))})
+    return switches
+
+def parse_vlans(snapshot):
+    data = get_config_data(snapshot)
+    vlan_ids = set()
+    vlans = data.get('vlan_id') or []
+    for vlan in vlans if isinstance(vlans, list) else [vlans]:
+        if isinstance(vlan, dict) and 'id' in vlan:
+            vlan_ids.add(int(vlan['id']))
+    named = {}
+    names = data.get('vlan_name_id') or []
+    for name in names if isinstance(names, list) else [names]:
+        if isinstance(name, dict) and 'name' in name:
+            named[name['name']] = name.get('vlan-ids')
+    return {'aos_vlans': sorted(vlan_ids), 'aos_named_vlans': named}
+
+PARSERS = {
+    'hardware': parse_hardware,
+    'version': parse_version,
+    'aps': parse_aps,
+    'interfaces': parse_interfaces,
+}
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            gather_subset=dict(required=False, type='list', elements='str', default=['all']),
+            config_path=dict(required=False, type='str', default='/md'),
+            max_workers=dict(required=False, type='int', default=4)
+        ),
+        supports_check_mode=True)
+    api = AosApi(module)
+    subsets, invalid = get_subsets(module.params.get('gather_subset'))
+    if invalid is not None:
+        api.fail_json(changed=False, msg="Unknown subset %s, use one of all, %s"
+                                         % (invalid, ", ".join(SUBSETS)))
+    config_path = module.params.get('config_path')
+    max_workers = module.params.get('max_workers')
+
+    # The show commands of all the subsets are sent in a single concurrent
+    # batch, through the show command cache of the connection
+    commands = []
+    for subset in subsets:
+        commands.extend(command for command in SUBSET_COMMANDS.get(subset, [])
+                        if command not in commands)
+    results = dict(zip(commands, api.show_commands(commands, max_workers)))
+    failed = dict((command, result['error'] or str(result['response']))
+                  for command, result in results.items() if not is_success(result))
+    outputs = dict((command, result['response']) for command, result in results.items())
+
+    if 'hierarchy' in subsets:
+        hierarchy = api.get(api.get_url('/configuration/object/node_hierarchy'))
+        if hierarchy['code'] != 200 or not isinstance(hierarchy['resp'], dict) or \
+                'Error' in hierarchy['resp']:
+            failed['node_hierarchy'] = str(hierarchy['resp'])
+    if 'vlans' in subsets:
+        # Through the snapshot cache of the connection, with the full
+        # configuration when the OBJECT filter is rejected
+        snapshot = api.get_config_snapshot(config_path, VLAN_OBJECTS)
+        if not isinstance(snapshot, dict) or 'Error' in snapshot:
+            snapshot = api.get_config_snapshot(config_path)
+        if not isinstance(snapshot, dict) or 'Error' in snapshot:
+            failed['configuration of ' + config_path] = str(snapshot)
+    if failed:
+        api.fail_json(changed=False, failed=failed,
+                      msg="Failed to gather " + ", ".join(sorted(failed)))
+
+    facts = {'aos_gather_subset': subsets}
+    for subset in subsets:
+        if subset in PARSERS:
+            facts.update(PARSERS[subset](outputs))
+    if 'hierarchy' in subsets:
+        facts['aos_nodes'] = get_node_paths(hierarchy['resp'])
+        facts['aos_switches'] = parse_switches(outputs)
+    if 'vlans' in subsets:
+        facts.update(parse_vlans(snapshot))
+    api.exit_json(changed=False, ansible_facts=facts)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,411 @@
+#!/usr/bin/python3
+'''
+Module for copying a new ArubaOS image to a partition, following the copy
+progress and reloading the controller
+'''
+
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = """
+---
+module: aos_firmware_upgrade
+version_added: 2.8.1
+short_description: Preload an ArubaOS image and reload the controller
+description: Starts the copy of an ArubaOS image to a partition and returns
+             once the controller reports the copy, or waits for the copy while
+             polling its progress with show commands. The copy request is sent
+             with a short timeout, as a controller may only answer it once the
+             image is copied, and every poll is a short request, so the task
+             never holds the persistent connection for the whole copy. The
+             module can run with async to preload many controllers in parallel
+             before a coordinated reload.
+options:
+    action:
+        description:
+            - copy starts the copy of the image, status returns the progress of
+              the copy and the image of every partition, reload reboots the
+              controller.
+        required: false
+        default: copy
+        choices:
+            - copy
+            - status
+            - reload
+        type: str
+    config_path:
+        description:
+            - Path of the controller in the configuration hierarchy
+        required: false
+        default: /mm
+        type: str
+    protocol:
+        description:
+            - Protocol used by the controller to fetch the image
+        required: false
+        default: scp
+        choices:
+            - scp
+            - tftp
+        type: str
+    host:
+        description:
+            - Address of the server holding the image, required to copy
+        required: false
+        type: str
+    username:
+        description:
+            - SCP user name
+        required: false
+        type: str
+    password:
+        description:
+            - SCP password
+        required: false
+        type: str
+    filename:
+        description:
+            - Path of the image on the server, required to copy
+        required: false
+        type: str
+    partition:
+        description:
+            - Partition the image is copied to. By default the partition which
+              is not the default boot partition.
+        required: false
+        choices:
+            - partition0
+            - partition1
+        type: str
+    version:
+        description:
+            - ArubaOS version of the image, like 8.6.0.0. The copy is skipped
+              if the partition, or any partition when partition is not given,
+              already holds this version, and reload fails if the default boot
+              partition does not hold it.
+        required: false
+        type: str
+    wait:
+        description:
+            - If set to True, copy and status wait for the end of the copy,
+              polling its progress every poll_interval seconds, doubled after
+              every poll up to poll_interval_max.
+        required: false
+        default: false
+        type: bool
+    poll_interval:
+        description:
+            - Seconds between the first polls of the copy progress
+        required: false
+        default: 5
+        type: float
+    poll_interval_max:
+        description:
+            - Maximum number of seconds between two polls of the copy progress
+        required: false
+        default: 60
+        type: float
+    timeout:
+        description:
+            - Maximum number of seconds to wait for the copy
+        required: false
+        default: 1800
+        type: int
+    request_timeout:
+        description:
+            - Seconds to wait for the answer to the copy request, which some
+              controllers only send once the image is copied. Without an
+              answer in time the copy is taken as started. Either way the
+              copy is confirmed with status_command, polled for as long
+              again until the controller reports it. Keep it below the
+              persistent connection command timeout.
+        required: false
+        default: 10
+        type: float
+    status_command:
+        description:
+            - Show command returning the progress of the copy
+        required: false
+        default: show copy status
+        type: str
+"""
+EXAMPLES = """
+#Usage Examples
+    - name: Start the copy of the image and return immediately
+      aos_firmware_upgrade:
+        action: copy
+        host: 10.10.10.10
+        username: admin
+        password: admin-passwd
+        filename: ArubaOS_70xx_8.6.0.0_74441
+        version: 8.6.0.0
+
+    - name: Wait until the copy started by the previous task is over
+      aos_firmware_upgrade:
+        action: status
+        wait: True
+
+    - name: Copy the image in the background on every controller
+      aos_firmware_upgrade:
+        action: copy
+        host: 10.10.10.10
+        username: admin
+        password: admin-passwd
+        filename: ArubaOS_70xx_8.6.0.0_74441
+        version: 8.6.0.0
+        wait: True
+      async: 3600
+      poll: 0
+      register: preload
+
+    - name: Reload the controller once it boots on the new image
+      aos_firmware_upgrade:
+        action: reload
+        version: 8.6.0.0
+"""
+
+import json
+import re
+import time
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.connection import ConnectionError
+from ansible.module_utils.aos_http import AosApi
+
+IMAGE_VERSION_COMMAND = "show image version"
+VERSION_RE = re.compile(r'\d+\.\d+\.\d+\.\d+')
+PARTITION_RE = re.compile(r'Partition\s*:\s*\d+:(\d+)')
+PROGRESS_RE = re.compile(r'(\d+)\s*%')
+
+def get_output(result):
+    # Text of a show command result, None if the command failed
+    if result['error'] is not None or not isinstance(result['response'], dict):
+        return None
+    lines = result['response'].get('_data')
+    if isinstance(lines, list):
+        return "\n".join(str(line) for line in lines)
+    return json.dumps(result['response'])
+
+def run_command(api, command):
+    # Run a show command bypassing the show command cache, the controller
+    # state changes between polls
+    return api.show_commands([command], ttl=0)[0]
+
+def get_partitions(api):
+    # Image version of every partition from show image version
+    result = run_command(api, IMAGE_VERSION_COMMAND)
+    output = get_output(result)
+    if output is None:
+        api.fail_json(changed=False, response=result['response'], response_code=result['code'],
+                      msg="Failed to run " + IMAGE_VERSION_COMMAND)
+    partitions = []
+    for line in output.splitlines():
+        match = PARTITION_RE.search(line)
+        if match:
+            partitions.append({'partition': 'partition' + match.group(1),
+                               'default_boot': 'default boot' in line.lower(),
+                               'version': None})
+        elif partitions and line.strip().lower().startswith('software version'):
+            version = VERSION_RE.search(line)
+            partitions[-1]['version'] = version.group(0) if version else None
+    return partitions
+
+def get_copy_status(api, command):
+    # Progress of the copy from the output of command: idle, in_progress,
+    # completed, failed or unknown, and the percentage when given
+    result = run_command(api, command)
+    output = get_output(result)
+    if output is None:
+        return {'copy_status': 'unknown', 'progress': None, 'status_output': result['error']}
+    text = output.lower()
+    if 'no copy' in text:
+        status = 'idle'
+    elif 'fail' in text or 'error' in text:
+        status = 'failed'
+    elif 'complete' in text or 'success' in text:
+        status = 'completed'
+    elif 'progress' in text or PROGRESS_RE.search(text):
+        status = 'in_progress'
+    else:
+        status = 'unknown'
+    progress = PROGRESS_RE.search(text)
+    if status == 'completed':
+        progress = 100
+    else:
+        progress = int(progress.group(1)) if progress else None
+    return {'copy_status': status, 'progress': progress, 'status_output': output}
+
+def wait_copy(module, api):
+    # Poll the copy progress with exponential backoff until it is over or
+    # timeout expires
+    interval = module.params.get('poll_interval')
+    deadline = time.time() + module.params.get('timeout')
+    polls = 0
+    while True:
+        status = get_copy_status(api, module.params.get('status_command'))
+        polls += 1
+        if status['copy_status'] in ('completed', 'failed', 'idle'):
+            break
+        remaining = deadline - time.time()
+        if remaining <= 0:
+            status['copy_status'] = 'timeout'
+            break
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, module.params.get('poll_interval_max'))
+    status['polls'] = polls
+    return status
+
+def confirm_copy(module, api):
+    # Poll the copy progress until the controller reports the copy or
+    # request_timeout expires, it may not right after the copy request
+    deadline = time.time() + module.params.get('request_timeout')
+    while True:
+        status = get_copy_status(api, module.params.get('status_command'))
+        remaining = deadline - time.time()
+        if status['copy_status'] != 'idle' or remaining <= 0:
+            return status
+        time.sleep(min(module.params.get('poll_interval'), remaining))
+
+def post_action(api, config_path, name, data, timeout=None):
+    # POST an action object, fails the module if it is rejected. With
+    # timeout, returns None for the response and its code if the controller
+    # did not answer in time.
+    url = api.get_url("/configuration/object/" + name, params={'config_path': config_path})
+    try:
+        resp, code = api.http_request(url=url, method="POST", data=json.dumps(data),
+                                      timeout=timeout)
+    except ConnectionError as err:
+        if timeout is None or getattr(err, 'code', None) != 'timeout':
+            raise
+        return None, None
+    if code != 200 or not isinstance(resp, dict):
+        api.fail_json(changed=False, response=resp, response_code=code,
+                      msg="Failed to send " + name)
+    res, _, status_str = api.validate_response(resp)
+    if not res:
+        api.fail_json(changed=False, response=resp, response_code=code, msg=status_str)
+    return resp, code
+
+def exit_status(module, api, changed, status, **kwargs):
+    # Exits with the copy status and the partitions, fails if the copy failed
+    status.update(kwargs)
+    status['partitions'] = get_partitions(api)
+    if status['copy_status'] in ('failed', 'timeout'):
+        api.fail_json(changed=changed, msg="Image copy " + status['copy_status'], **status)
+    api.exit_json(changed=changed, **status)
+
+def copy_image(module, api):
+    # Start the copy of the image unless the partition already holds version
+    params = module.params
+    for name in ('host', 'filename'):
+        if not params.get(name):
+            api.fail_json(changed=False, msg=name + " is required to copy an image")
+    partitions = get_partitions(api)
+    partition = params.get('partition')
+    version = params.get('version')
+    if partition is None:
+        # A partition already holding version, else the spare partition
+        spare = [entry['partition'] for entry in partitions if entry['version'] == version] + \
+            [entry['partition'] for entry in partitions if not entry['default_boot']]
+        partition = spare[0] if spare else 'partition1'
+    target = [entry for entry in partitions if entry['partition'] == partition]
+    if version and target and target[0]['version'] == version:
+        api.exit_json(changed=False, copy_status='completed', progress=100, partition=partition,
+                      partitions=partitions,
+                      msg="%s already holds %s" % (partition, version))
+    if module.check_mode:
+        api.exit_json(changed=True, copy_status='idle', partition=partition,
+                      partitions=partitions)
+
+    if params.get('protocol') == 'tftp':
+        name = "copy_tftp_system"
+        data = {"tftphost": params.get('host'), "filename": params.get('filename'),
+                "partition_num": partition}
+    else:
+        name = "copy_scp_system"
+        data = {"scphost": params.get('host'), "username": params.get('username'),
+                "passwd": params.get('password'), "filename": params.get('filename'),
+                "partition_num": partition}
+    resp, code = post_action(api, params.get('config_path'), name, data,
+                             timeout=params.get('request_timeout'))
+    # A copy request without an answer in time is still copying
+    status = confirm_copy(module, api)
+    if status['copy_status'] == 'idle':
+        api.fail_json(changed=False, partition=partition, response=resp, response_code=code,
+                      msg="The controller did not start the copy", **status)
+    if params.get('wait') and status['copy_status'] not in ('completed', 'failed'):
+        status = wait_copy(module, api)
+    exit_status(module, api, True, status, partition=partition, response=resp,
+                response_code=code)
+
+def reload_controller(module, api):
+    # Reload, after checking that the default boot partition holds version
+    version = module.params.get('version')
+    if version:
+        boot = [entry for entry in get_partitions(api) if entry['default_boot']]
+        if not boot or boot[0]['version'] != version:
+            api.fail_json(changed=False, partitions=boot,
+                          msg="The default boot partition does not hold " + version)
+    if module.check_mode:
+        api.exit_json(changed=True)
+    resp, code = post_action(api, module.params.get('config_path'), "reload", {"force": True})
+    api.exit_json(changed=True, response=resp, response_code=code)
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            action=dict(required=False, type='str', default='copy',
+                        choices=['copy', 'status', 'reload']),
+            config_path=dict(required=False, type='str', default='/mm'),
+            protocol=dict(required=False, type='str', default='scp', choices=['scp', 'tftp']),
+            host=dict(required=False, type='str'),
+            username=dict(required=False, type='str'),
+            password=dict(required=False, type='str', no_log=True),
+            filename=dict(required=False, type='str'),
+            partition=dict(required=False, type='str', choices=['partition0', 'partition1']),
+            version=dict(required=False, type='str'),
+            wait=dict(required=False, type='bool', default=False),
+            poll_interval=dict(required=False, type='float', default=5),
+            poll_interval_max=dict(required=False, type='float', default=60),
+            timeout=dict(required=False, type='int', default=1800),
+            request_timeout=dict(required=False, type='float', default=10),
+            status_command=dict(required=False, type='str', default='show copy status')
+        ),
+        supports_check_mode=True)
+    action = module.params.get('action')
+    api = AosApi(module)
+
+    if action == "copy":
+        copy_image(module, api)
+    elif action == "status":
+        if module.params.get('wait'):
+            status = wait_copy(module, api)
+        else:
+            status = get_copy_status(api, module.params.get('status_command'))
+        exit_status(module, api, False, status)
+    else:
+        reload_controller(module, api)
+
+if __name__ == '__main__':
+    main()
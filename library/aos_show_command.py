@@ -44,8 +44,40 @@ options:
               information you are looking for exists.
             - Make sure to use the correct show command.
             - Most of the show commands will fetch a JSON formated output
-        require: true
+            - One of command or commands is required
+        require: false
         type: str
+    commands:
+        description:
+            - List of CLI show commands run concurrently over the session.
+              Results are returned in a dictionary keyed by command with the
+              response, response code, latency and error of every command.
+        require: false
+        type: list
+    max_workers:
+        description:
+            - Maximum number of show commands running at the same time
+        require: false
+        default: 4
+        type: int
+    cache_ttl:
+        description:
+            - Seconds the results of the commands are kept in the show command
+              cache of the persistent connection and served to later tasks on
+              the same host. Defaults to ansible_aos_show_cache_ttl when the
+              ansible_aos_show_cache inventory variable is set, else the
+              results are not cached. 0 bypasses the cache.
+            - The cache is emptied by every configuration change sent on the
+              connection.
+        require: false
+        type: float
+    refresh:
+        description:
+            - If set to True, the commands are run even if their results are
+              cached, and the new results replace the cached ones
+        require: false
+        default: false
+        type: bool
 
 """
 EXAMPLES = """
@@ -57,30 +89,75 @@ EXAMPLES = """
     - name: Show command for fetching Web Server Profile
       aos_show_command:
        command: show web-server profile
+
+    - name: Health check, show commands run in parallel
+      aos_show_command:
+       commands:
+         - show version
+         - show switches
+         - show ap database long
+       max_workers: 3
+
+    - name: Reuse the output of show ap database fetched less than a minute ago
+      aos_show_command:
+       command: show ap database
+       cache_ttl: 60
 """
 
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.aos_http import AosApi
 
+def show_commands(module, api, commands):
+    # Run commands concurrently through the show command cache
+    return api.show_commands(commands, module.params.get('max_workers'),
+                             module.params.get('cache_ttl'), module.params.get('refresh'))
+
+def run_commands(module, api, commands):
+    # Run commands concurrently, each result is keyed by its command
+    results = {}
+    failed = []
+    for command, result in zip(commands, show_commands(module, api, commands)):
+        error = result['error']
+        if error is None and not result['response']:
+            error = "Empty response received. Check if a valid show command is given."
+        if error is not None:
+            failed.append(command)
+        results[command] = {'response': result['response'], 'response_code': result['code'],
+                            'latency': result['latency'], 'error': error,
+                            'cached': result['cached']}
+    if failed:
+        api.fail_json(changed=False, command_results=results,
+                      msg="Failed show command(s): " + ", ".join(failed))
+    api.exit_json(changed=False, command_results=results)
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
-            command=dict(required=True, type='str')
-        ))
+            command=dict(required=False, type='str'),
+            commands=dict(required=False, type='list', elements='str'),
+            max_workers=dict(required=False, type='int', default=4),
+            cache_ttl=dict(required=False, type='float'),
+            refresh=dict(required=False, type='bool', default=False)
+        ),
+        required_one_of=[['command', 'commands']],
+        mutually_exclusive=[['command', 'commands']])
     command = module.params.get('command')
     api = AosApi(module)
-    query_url = "/configuration/showcommand"
-    query_params = {"command": command}
-    request = api.get_url(query_url, params=query_params)
-    result = api.get(url=request)
+    if module.params.get('commands'):
+        run_commands(module, api, module.params.get('commands'))
+    result = show_commands(module, api, [command])[0]
+    if result['error'] is not None:
+        api.fail_json(changed=False, msg=result['error'], response_code=result['code'])
+    result['resp'] = result['response']
     if len(result['resp']) < 1:
-        module.exit_json(changed=False, msg=result['resp'], response="Empty response received."
-                                            " Check if a valid show command"
-                                            " is given in the playbook.")
+        api.exit_json(changed=False, msg=result['resp'], response="Empty response received."
+                                         " Check if a valid show command"
+                                         " is given in the playbook.")
     elif result['resp'] is not None:
-        module.exit_json(changed=False, msg=result['resp'], response_code=result['code'])
+        api.exit_json(changed=False, msg=result['resp'], response_code=result['code'],
+                      cached=result['cached'])
     else:
-        module.fail_json(changed=False, msg="Failed !!!", response_code=result['code'])
+        api.fail_json(changed=False, msg="Failed !!!", response_code=result['code'])
 
 if __name__ == '__main__':
     main()
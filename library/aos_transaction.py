@@ -0,0 +1,286 @@
+#!/usr/bin/python3
+'''
+Module for buffering the configuration POSTs of a run of tasks in the
+persistent connection and sending them as a single request per config_path
+'''
+
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = """
+---
+module: aos_transaction
+version_added: 2.8.1
+short_description: Buffer the configuration POSTs of several tasks and apply them at once
+description: begin opens a transaction in the persistent connection. Until the
+             commit task, aos_api_config POST requests are not sent, the
+             connection buffers them and every task reports the change it
+             predicts from the configuration the POSTs buffered before it lead
+             to. commit merges the buffered POSTs of every config_path, in
+             order, into a single multipart request, validates its response
+             once and returns the result of every buffered POST in entries.
+             abort drops the buffered POSTs. The transaction lives in the
+             persistent connection and does not survive a reset of the
+             connection, by meta reset_connection, its idle timeout or a
+             crash - its buffered POSTs are dropped. begin sets the
+             aos_transaction_id fact, which the action plugins of the role
+             pass to aos_api_config and to commit, so that they fail once the
+             transaction was lost, until abort clears the fact. The fact of
+             another playbook run, kept by fact caching after a failed play,
+             is ignored and cleared. In check mode begin opens no
+             transaction, and commit reports the POSTs buffered in an open
+             transaction without sending them and keeps it open.
+options:
+    action:
+        description:
+            - begin opens the transaction, commit sends the buffered POSTs,
+              abort drops them.
+        required: true
+        choices:
+            - begin
+            - commit
+            - abort
+        type: str
+    transaction_id:
+        description:
+            - Id of the transaction returned by begin, set by the action plugin
+              of the role from the aos_transaction_id fact. commit fails if the
+              persistent connection did not open this transaction, as when
+              the connection was reset since begin.
+        required: false
+        type: str
+    max_workers:
+        description:
+            - Maximum number of config_paths committed concurrently
+        required: false
+        default: 4
+        type: int
+    retry_failed:
+        description:
+            - Number of times the objects rejected at commit are sent again,
+              alone, see aos_api_config.
+        required: false
+        default: 0
+        type: int
+    commit:
+        description:
+            - If set to True, a write_memory is done on every config_path
+              changed by the transaction. Otherwise only on the config_paths
+              of the buffered POSTs whose task set commit.
+        required: false
+        default: false
+        type: bool
+    commit_mode:
+        description:
+            - When to do the write_memory, see aos_api_config
+        required: false
+        default: immediate
+        choices:
+            - immediate
+            - deferred
+        type: str
+"""
+EXAMPLES = """
+#Usage Examples
+    - name: Open a transaction
+      aos_transaction:
+        action: begin
+
+    - name: AAA profile, buffered by the connection
+      aos_api_config:
+        method: POST
+        config_path: /md/Boston
+        data:
+          - aaa_prof:
+              profile-name: corp-aaa
+
+    - name: SSID profile, buffered by the connection
+      aos_api_config:
+        method: POST
+        config_path: /md/Boston
+        data:
+          - ssid_prof:
+              profile-name: corp-ssid
+              essid:
+                essid: corp
+
+    - name: Send both profiles in a single request and save the configuration
+      aos_transaction:
+        action: commit
+        commit: True
+      register: transaction
+
+    - name: Drop the buffered POSTs if a task of the transaction failed
+      aos_transaction:
+        action: abort
+"""
+
+import json
+from collections import OrderedDict
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.aos_http import AosApi
+
+# Facts of a host once its transaction is ended
+CLEARED_FACTS = {'aos_transaction_id': None}
+
+def get_entry_result(position, entry):
+    # Result of a buffered POST before it is sent, with the predicted change
+    objects = set()
+    for part in entry['data'].get('_list', [entry['data']]):
+        objects.update(name for name in part if not name.startswith('_'))
+    return {'position': position, 'config_path': entry['config_path'],
+            'objects': sorted(objects), 'changed': entry['changed'], 'failed': False,
+            'status_str': ""}
+
+def merge_entries(entries):
+    # Parts of the buffered POSTs of every config_path in order, with the
+    # position of the POST each part comes from
+    payloads = OrderedDict()
+    for position, entry in enumerate(entries):
+        parts, owners = payloads.setdefault(entry['config_path'], ([], []))
+        for part in entry['data'].get('_list', [entry['data']]):
+            parts.append(part)
+            owners.append(position)
+    return payloads
+
+def commit_node(module, api, url, parts, owners, response, results):
+    # Validate the response to the merged POST of a config_path, retry the
+    # failed objects and mark the buffered POSTs they come from as failed.
+    # Returns the status of the config_path and its _pending flag.
+    data = {'_list': parts}
+    result = {'resp': response['response'], 'code': response['code']}
+    node = {'parts': len(parts), 'response_code': result['code']}
+    if response['error'] is None and result['code'] == 200 and module.params.get('retry_failed'):
+        result = api.retry_failed(url, data, result, module.params.get('retry_failed'))
+        node.update(response_code=result['code'], attempts=result['attempts'])
+    if response['error'] is not None or result['code'] != 200 or \
+            not isinstance(result['resp'], dict):
+        node['status_str'] = response['error'] or str(result['resp'])
+        for position in set(owners):
+            results[position].update(failed=True, status_str=node['status_str'])
+        return node, 0
+
+    res, pending, node['status_str'], failures = api.check_response(result['resp'])
+    # Failures left by retry_failed are in the positions of the merged POST
+    failures = result.get('failures', failures)
+    if not res and not failures:
+        # Rejected as a whole, no object to blame
+        for position in set(owners):
+            results[position].update(failed=True, status_str=node['status_str'])
+    for failure in failures:
+        entry = results[owners[failure['part']]]
+        key = ", ".join("%s %s" % item for item in (failure['key'] or {}).items())
+        status_str = "%s%s: %s" % (failure['object'], " " + key if key else "",
+                                   failure['status_str'])
+        entry['status_str'] = ", ".join(filter(None, [entry['status_str'], status_str]))
+        entry['failed'] = True
+    return node, pending
+
+def commit(module, api):
+    # Send the buffered POSTs as one multipart request per config_path. In
+    # check mode they are only reported and the transaction stays open.
+    api.get_transaction(transaction_id=module.params.get('transaction_id'))
+    if module.check_mode:
+        entries = api.get_buffered_posts() or []
+        api.exit_json(changed=any(entry['changed'] for entry in entries),
+                      entries=[get_entry_result(position, entry)
+                               for position, entry in enumerate(entries)],
+                      config_paths={})
+    entries = api.end_transaction()
+    if entries is None:
+        api.fail_json(changed=False, msg="No transaction is open")
+    results = [get_entry_result(position, entry) for position, entry in enumerate(entries)]
+    if not entries:
+        api.exit_json(changed=False, entries=results, config_paths={},
+                      ansible_facts=CLEARED_FACTS)
+
+    payloads = merge_entries(entries)
+    urls = dict((config_path, api.get_url('/configuration/object',
+                                          params={'config_path': config_path}))
+                for config_path in payloads)
+    requests = [{'url': urls[config_path], 'method': 'POST',
+                 'data': json.dumps({'_list': parts})}
+                for config_path, (parts, owners) in payloads.items()]
+    responses = api.http_requests(requests, module.params.get('max_workers'))
+
+    nodes = {}
+    for (config_path, (parts, owners)), response in zip(payloads.items(), responses):
+        nodes[config_path], pending = commit_node(module, api, urls[config_path], parts,
+                                                  owners, response, results)
+        owned = [results[position] for position in set(owners)]
+        requested = module.params.get('commit') or \
+            any(entries[position]['commit'] for position in set(owners))
+        if requested and pending != 0 and \
+                any(entry['changed'] and not entry['failed'] for entry in owned):
+            nodes[config_path]['commit'] = api.write_mem(
+                config_path=config_path, defer=module.params.get('commit_mode') == 'deferred')
+
+    for entry in results:
+        entry['changed'] = entry['changed'] and not entry['failed']
+    changed = any(entry['changed'] for entry in results)
+    failed = [str(entry['position']) for entry in results if entry['failed']]
+    if failed:
+        api.fail_json(changed=changed, entries=results, config_paths=nodes,
+                      ansible_facts=CLEARED_FACTS,
+                      msg="Buffered POSTs %s failed" % ", ".join(failed))
+    api.exit_json(changed=changed, entries=results, config_paths=nodes,
+                  ansible_facts=CLEARED_FACTS)
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            action=dict(required=True, type='str', choices=['begin', 'commit', 'abort']),
+            transaction_id=dict(required=False, type='str', default=None),
+            max_workers=dict(required=False, type='int', default=4),
+            retry_failed=dict(required=False, type='int', default=0),
+            commit=dict(required=False, type='bool', default=False),
+            commit_mode=dict(required=False, type='str', choices=['immediate', 'deferred'],
+                             default='immediate')
+        ),
+        supports_check_mode=True)
+    action = module.params.get('action')
+    api = AosApi(module)
+
+    if action == "begin":
+        if module.check_mode:
+            # aos_api_config does not buffer its POSTs in check mode
+            api.exit_json(changed=False, transaction_id=None)
+        transaction_id = api.begin_transaction()
+        if not transaction_id:
+            api.fail_json(changed=False, msg="A transaction is already open, commit or"
+                                             " abort it first")
+        api.exit_json(changed=False, transaction_id=transaction_id,
+                      ansible_facts={'aos_transaction_id': transaction_id})
+    elif action == "commit":
+        commit(module, api)
+    else:
+        transaction_id = module.params.get('transaction_id')
+        lost = bool(transaction_id) and not api.opened_transaction(transaction_id)
+        entries = api.end_transaction()
+        api.exit_json(changed=False, discarded=len(entries or []), lost=lost,
+                      ansible_facts=CLEARED_FACTS)
+
+if __name__ == '__main__':
+    main()
@@ -77,6 +77,26 @@ options:
             - all
             - named_vlan
         type: str
+    chunk_size:
+        description:
+            - Maximum number of VLAN IDs sent in a single multipart request
+              when creating or deleting a range of VLANs, at least 1.
+        required: false
+        default: 100
+        type: int
+    reconcile:
+        description:
+            - If set to True, the VLAN IDs and named VLANs of config_path are
+              read once and only the difference with vlan_id is sent, the
+              VLAN IDs missing for create, the configured ones for delete.
+              changed is computed from these differences, without fetching
+              the configuration before and after the requests. The VLAN IDs
+              sent are returned in vlan_delta as a range string like 5,10-15.
+            - VLANs inherited from a node above config_path are considered
+              present by create and are never deleted.
+        required: false
+        default: false
+        type: bool
 """
 EXAMPLES = """
 #Usage Examples
@@ -92,6 +112,20 @@ EXAMPLES = """
        vlan_id: 5,10, 15-20
        config_path: /md/Boston
 
+    - name: Create a range of VLANs, 50 VLAN IDs per multipart request
+      aos_vlan:
+       action: create
+       vlan_id: 15-200
+       chunk_size: 50
+       config_path: /md/Boston
+
+    - name: Create only the VLANs of the range which do not exist yet
+      aos_vlan:
+       action: create
+       vlan_id: 2-1000
+       reconcile: True
+       config_path: /md/Boston
+
     - name: Create a named VLAN
       aos_vlan:
        action: create
@@ -149,15 +183,155 @@ EXAMPLES = """
 
 
 """
+import json
 from ansible.module_utils.basic import AnsibleModule
 from ansible.module_utils.aos_http import AosApi
+from ansible.module_utils.aos_config import get_config_data, is_inherited
 
 def get_vlan_list(vlan_id):
-    vlan_id = vlan_id.replace(" ", "")
-    vlan_id_list = sum(((list(range(*[int(b) + c for c, b in enumerate(a.split('-'))]))
-                         if '-' in a else [int(a)]) for a in vlan_id.split(',')), [])
+    vlan_id_list = []
+    for vlan_range in vlan_id.replace(" ", "").split(','):
+        if '-' in vlan_range:
+            start, end = vlan_range.split('-')
+            vlan_id_list.extend(range(int(start), int(end) + 1))
+        else:
+            vlan_id_list.append(int(vlan_range))
     return vlan_id_list
 
+def encode_vlan_list(vlan_id_list):
+    # Compact range string of VLAN IDs, like 5,10-15
+    ranges = []
+    for vlan in sorted(set(vlan_id_list)):
+        if ranges and vlan == ranges[-1][1] + 1:
+            ranges[-1][1] = vlan
+        else:
+            ranges.append([vlan, vlan])
+    return ",".join(str(start) if start == end else "%d-%d" % (start, end)
+                    for start, end in ranges)
+
+def get_running_vlans(api, config_path):
+    # Locally configured and inherited VLAN IDs, and VLAN IDs of every named
+    # VLAN of config_path, from a single GET of vlan_id and vlan_name_id
+    snapshot = api.get_config_snapshot(config_path, ['vlan_id', 'vlan_name_id'])
+    if not isinstance(snapshot, dict) or 'Error' in snapshot:
+        api.fail_json(changed=False, response=snapshot,
+                      msg="Unable to fetch the VLANs of " + str(config_path))
+    data = get_config_data(snapshot)
+    local = set()
+    inherited = set()
+    vlans = data.get('vlan_id') or []
+    for vlan in vlans if isinstance(vlans, list) else [vlans]:
+        if isinstance(vlan, dict) and 'id' in vlan:
+            (inherited if is_inherited(vlan) else local).add(int(vlan['id']))
+    named = {}
+    names = data.get('vlan_name_id') or []
+    for name in names if isinstance(names, list) else [names]:
+        if isinstance(name, dict) and 'name' in name:
+            vlan_ids = str(name.get('vlan-ids') or '')
+            named[name['name']] = set(get_vlan_list(vlan_ids)) if vlan_ids else set()
+    return local, inherited, named
+
+def reconcile_vlans(module, api, config_url):
+    # Sends only the difference between vlan_id and the running VLANs
+    action = module.params.get('action')
+    vlan_name = module.params.get('vlan_name')
+    vlan_id = module.params.get('vlan_id')
+    local, inherited, named = get_running_vlans(api, module.params.get('config_path'))
+    requested = set(get_vlan_list(vlan_id)) if vlan_id else set()
+
+    if vlan_name:
+        if action == "create" and named.get(vlan_name) != requested:
+            vlan_ids = encode_vlan_list(requested)
+            data = {"vlan_name": [{"_action": "modify", "name": vlan_name}],
+                    "vlan_range": {"_action": "modify", "WORD": vlan_ids},
+                    "vlan_name_id": [{"_action": "modify", "name": vlan_name,
+                                      "vlan-ids": vlan_ids}]}
+        elif action == "delete" and vlan_name in named:
+            data = {"vlan_name_id": [{"_action": "delete", "name": vlan_name}],
+                    "vlan_name": [{"_action": "delete", "name": vlan_name}]}
+        else:
+            api.exit_json(changed=False, vlan_delta="")
+        resp, code = api.http_request(url=config_url, method="POST", data=json.dumps(data))
+        res, _, status_str = api.validate_response(resp) if code == 200 and \
+            isinstance(resp, dict) else (False, 0, str(resp))
+        if not res:
+            api.fail_json(changed=False, response=resp, response_code=code, msg=status_str)
+        api.exit_json(changed=True, response=resp, response_code=code,
+                      vlan_delta=encode_vlan_list(requested))
+
+    if action == "create":
+        delta = sorted(requested - local - inherited)
+    else:
+        delta = sorted(requested & local)
+    if not delta:
+        api.exit_json(changed=False, vlan_delta="", vlan_status={})
+    result, changed, resp, vlan_status = post_vlan_list(
+        api, config_url, delta, module.params.get('chunk_size'),
+        action="delete" if action == "delete" else None, reconcile=True)
+    exit_vlan_status(api, changed, resp, result, vlan_status,
+                     vlan_delta=encode_vlan_list(delta))
+
+def get_vlan_status(resp, vlan_id_list):
+    # Status of every VLAN in a multipart response, falls back to the
+    # _global_result when the controller does not return per object results
+    global_result = resp.get("_global_result", {"status": 1, "status_str": str(resp)})
+    vlan_status = dict((str(vlan), global_result) for vlan in vlan_id_list)
+    for part in resp.get("_list", [resp]):
+        vlans = part.get("vlan_id", [])
+        if isinstance(vlans, dict):
+            vlans = [vlans]
+        for vlan in vlans:
+            if "_result" in vlan and "id" in vlan:
+                vlan_status[str(vlan["id"])] = vlan["_result"]
+    return vlan_status
+
+def post_vlan_list(api, config_url, vlan_id_list, chunk_size, action=None, reconcile=False):
+    # Sends vlan_id objects in multipart requests of at most chunk_size VLANs.
+    # When reconciling, every VLAN sent is a change if the controller accepts it
+    responses = []
+    vlan_status = {}
+    changed = False
+    result = None
+    for index in range(0, len(vlan_id_list), chunk_size):
+        chunk = vlan_id_list[index:index + chunk_size]
+        vlan_list = []
+        for vlan in chunk:
+            vlan_data = {"id": vlan}
+            if action:
+                vlan_data["_action"] = action
+            vlan_list.append({"vlan_id": vlan_data})
+        if reconcile:
+            resp, code = api.http_request(url=config_url, method="POST",
+                                          data=json.dumps({"_list": vlan_list}))
+            result = {'resp': resp, 'code': code}
+        else:
+            result, chunk_changed = api.post(url=config_url, data={"_list": vlan_list})
+            changed = changed or chunk_changed
+        responses.append(result['resp'])
+        if isinstance(result['resp'], dict):
+            chunk_status = get_vlan_status(result['resp'], chunk)
+        else:
+            chunk_status = dict((str(vlan), {"status": 1, "status_str": str(result['resp'])})
+                                for vlan in chunk)
+        vlan_status.update(chunk_status)
+        if reconcile:
+            changed = changed or any(str(status["status"]) == "0"
+                                     for status in chunk_status.values())
+    return result, changed, responses, vlan_status
+
+def exit_vlan_status(api, changed, resp, result, vlan_status, **kwargs):
+    # Exits with per VLAN results, fails if any VLAN was rejected
+    failed = dict((vlan, status["status_str"]) for vlan, status in vlan_status.items()
+                  if str(status["status"]) != "0")
+    vlan_status = dict((vlan, status["status_str"]) for vlan, status in vlan_status.items())
+    if failed:
+        api.fail_json(changed=changed, response=resp, response_code=result['code'],
+                      vlan_status=vlan_status,
+                      msg="Failed to configure VLAN(s) " + ", ".join(sorted(failed, key=int)),
+                      **kwargs)
+    api.exit_json(changed=changed, response=resp, response_code=result['code'],
+                  vlan_status=vlan_status, **kwargs)
+
 def main():
     module = AnsibleModule(
         argument_spec=dict(
@@ -165,15 +339,30 @@ def main():
             vlan_id=dict(required=False, type='str'),
             config_path=dict(required=True, type='str'),
             action=dict(required=False, type='str', choices=['get', 'create', 'delete']),
-            type=dict(required=False, type='str', choices=['all', 'named_vlan'], default='all')
+            type=dict(required=False, type='str', choices=['all', 'named_vlan'], default='all'),
+            chunk_size=dict(required=False, type='int', default=100),
+            reconcile=dict(required=False, type='bool', default=False)
         ))
     vlan_name = module.params.get('vlan_name')
     vlan_id = module.params.get('vlan_id')
     action = module.params.get('action')
     type_vlan = module.params.get('type')
     config_path = module.params.get('config_path')
+    chunk_size = module.params.get('chunk_size')
     api = AosApi(module)
     config_url = "/v1/configuration/object/vlan_id?config_path=" + str(config_path)
+    if chunk_size < 1:
+        api.fail_json(changed=False, msg="chunk_size must be at least 1")
+
+    if module.params.get('reconcile') and action in ("create", "delete"):
+        if vlan_id and vlan_name and action == "delete":
+            api.fail_json(changed=False,
+                          msg="To delete named VLAN, first delete a valid vlan_name."
+                              " Then use the vlan_id in a subsequent task if"
+                              " you wish to remove the VLAN ID associated to the"
+                              " named VLAN.")
+        reconcile_vlans(module, api,
+                        "/v1/configuration/object?config_path=" + str(config_path))
 
     if action == "create":
         if vlan_name:
@@ -185,23 +374,22 @@ def main():
             result, changed = api.post(url=config_url, data=data)
             resp = result['resp']
         else:
-            resp = []
+            config_url = "/v1/configuration/object?config_path=" + str(config_path)
             vlan_id_list = get_vlan_list(vlan_id)
-            for vlan in vlan_id_list:
-                data = {"id": vlan}
-                result, changed = api.post(url=config_url, data=data)
-                resp.append(result['resp'])
+            result, changed, resp, vlan_status = post_vlan_list(api, config_url,
+                                                                vlan_id_list, chunk_size)
+            exit_vlan_status(api, changed, resp, result, vlan_status)
 
-        module.exit_json(changed=changed, response=resp,
-                               response_code=result['code'])
+        api.exit_json(changed=changed, response=resp,
+                            response_code=result['code'])
 
     elif action == "delete":
         if vlan_id and vlan_name:
-            module.fail_json(change=False, response= result['resp'],
-                             msg="To delete named VLAN, first delete a valid vlan_name."
-                                 " Then use the vlan_id in a subsequent task if"
-                                 " you wish to remove the VLAN ID associated to the"
-                                 " named VLAN.")
+            api.fail_json(change=False, response= result['resp'],
+                          msg="To delete named VLAN, first delete a valid vlan_name."
+                              " Then use the vlan_id in a subsequent task if"
+                              " you wish to remove the VLAN ID associated to the"
+                              " named VLAN.")
         elif vlan_name and vlan_id is None:
             config_url = "/v1/configuration/object?config_path=" + str(config_path)
             data = {"vlan_name_id": [{"_action":"delete", "name": vlan_name}],
@@ -209,13 +397,12 @@ def main():
             result, changed = api.post(url=config_url, data=data)
             resp = result['resp']
         else:
+            config_url = "/v1/configuration/object?config_path=" + str(config_path)
             vlan_id_list = get_vlan_list(vlan_id)
-            resp = []
-            for vlan in vlan_id_list:
-                data = {"id": int(vlan), "_action": "delete"}
-                result, changed = api.post(url=config_url, data=data)
-                resp.append(result['resp'])
-        module.exit_json(changed=changed, response=resp, response_code=result['code'])
+            result, changed, resp, vlan_status = post_vlan_list(api, config_url, vlan_id_list,
+                                                                chunk_size, action="delete")
+            exit_vlan_status(api, changed, resp, result, vlan_status)
+        api.exit_json(changed=changed, response=resp, response_code=result['code'])
 
     elif action == "get":
         if type_vlan == "named_vlan":
@@ -223,19 +410,19 @@ def main():
         result = api.get(url=config_url)
         resp = result['resp']
         if "_data" in resp.keys():
-            module.exit_json(changed=False, response=resp, response_code=result['code'],
-                             msg="Response shows the VLANs configured on the "
-                                 "given config_path along with the ones inherited "
-                                 "from the hierarchy above")
+            api.exit_json(changed=False, response=resp, response_code=result['code'],
+                          msg="Response shows the VLANs configured on the "
+                              "given config_path along with the ones inherited "
+                              "from the hierarchy above")
         else:
-            module.fail_json(changed=False, response=result['resp'],
-                             response_code=result['code'])
+            api.fail_json(changed=False, response=result['resp'],
+                          response_code=result['code'])
 
     else:
-        module.fail_json(changed=False, response=result['resp'],
-                         response_code=result['code'],
-                         msg=str("Verify the playbook based on the playbook example"
-                                 " in the module documentation."))
+        api.fail_json(changed=False, response=result['resp'],
+                      response_code=result['code'],
+                      msg=str("Verify the playbook based on the playbook example"
+                              " in the module documentation."))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,108 @@
+#!/usr/bin/python3
+'''
+Module for saving the configuration of nodes to flash with write_memory
+'''
+
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+
+ANSIBLE_METADATA = {'metadata_version': '1.0',
+                    'status': ['preview'],
+                    'supported_by': 'community'}
+
+DOCUMENTATION = """
+---
+module: aos_write_memory
+version_added: 2.8.1
+short_description: Flush the write_memory deferred by the other AOS modules
+description: Sends a single write_memory for every config_path with pending changes
+             recorded in the persistent connection by tasks using
+             commit_mode deferred, or a write_memory on the given config_paths.
+options:
+    config_path:
+        description:
+            - List of paths in the configuration hierarchy to save. If not given,
+              all the config_paths with deferred changes are saved.
+        required: false
+        type: list
+    pending_only:
+        description:
+            - If set to True, only the given config_paths that have deferred
+              changes are saved. If set to False, write_memory is sent on the
+              given config_paths even if no change was deferred for them.
+        required: false
+        default: true
+        type: bool
+"""
+EXAMPLES = """
+#Usage Examples
+    - name: Save all the nodes changed by earlier tasks
+      aos_write_memory:
+
+    - name: Save /md/Boston at the end of the play with the handler of the role
+      aos_api_config:
+        method: POST
+        config_path: /md/Boston
+        data:
+          - hostname:
+              hostname: md-boston
+        commit: True
+        commit_mode: deferred
+      notify: aos write memory
+
+    - name: Save /md/Boston now, other pending nodes are saved at the end of the play
+      aos_write_memory:
+        config_path:
+          - /md/Boston
+
+    - name: Save /md even if no task recorded a change on it
+      aos_write_memory:
+        config_path:
+          - /md
+        pending_only: False
+"""
+
+from ansible.module_utils.basic import AnsibleModule
+from ansible.module_utils.aos_http import AosApi
+
+def main():
+    module = AnsibleModule(
+        argument_spec=dict(
+            config_path=dict(required=False, type='list', elements='str'),
+            pending_only=dict(required=False, type='bool', default=True)
+        ))
+    config_paths = module.params.get('config_path')
+    pending_only = module.params.get('pending_only')
+    api = AosApi(module)
+
+    if config_paths and not pending_only:
+        for config_path in config_paths:
+            api.write_mem(config_path=config_path, defer=True)
+    results = api.flush_write_mem(config_paths)
+
+    failed = [config_path for config_path, result in results.items() if not result['status']]
+    if failed:
+        api.fail_json(changed=len(failed) < len(results), write_memory=results,
+                      msg="write_memory failed on " + ", ".join(sorted(failed)))
+    api.exit_json(changed=bool(results), write_memory=results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+#!/usr/bin/python
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import copy
+import json
+
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+# Parameters identifying an instance of a multi-instance object, in order of
+# preference. Objects not listed use the first parameter ending with _name or
+# -name, else the first parameter holding a plain value.
+KEY_FIELDS = ('profile-name', 'name', 'id', 'rname', 'dstname', 'sg_name',
+              'rad_server_name', 'tacacs_server_name', 'node-path', 'ipaddr')
+
+def strip_meta(value):
+    """
+    Copy of value without the _action, _flags, _result, ... metadata keys
+    """
+    if isinstance(value, dict):
+        return dict((key, strip_meta(val)) for key, val in value.items()
+                    if not key.startswith('_'))
+    if isinstance(value, list):
+        return [strip_meta(val) for val in value]
+    return value
+
+def canonical(value):
+    """
+    Canonical JSON text of value: sorted keys, compact separators
+    """
+    return json.dumps(value, sort_keys=True, separators=(',', ':'))
+
+def get_key_field(instance):
+    """
+    Name of the parameter identifying instance, None if it has none
+    """
+    for field in KEY_FIELDS:
+        if field in instance:
+            return field
+    for field in instance:
+        if field.endswith(('_name', '-name')) and not isinstance(instance[field], (dict, list)):
+            return field
+    for field, value in instance.items():
+        if not field.startswith('_') and not isinstance(value, (dict, list)):
+            return field
+    return None
+
+def is_multi_instance(instance):
+    """
+    True if the payload instance of an object missing from the running
+    configuration is one instance of a multi-instance object, which the
+    controller returns as a list: it has a KEY_FIELDS parameter or a plain
+    parameter ending with _name or -name
+    """
+    if not isinstance(instance, dict):
+        return False
+    return any(field in KEY_FIELDS or (field.endswith(('_name', '-name')) and
+                                       not isinstance(value, (dict, list)))
+               for field, value in instance.items())
+
+def find_instance(entries, instance):
+    """
+    Index in entries of the entry with the same key as instance, or None
+    """
+    key_field = get_key_field(instance)
+    if key_field is None:
+        return None
+    for index, entry in enumerate(entries):
+        if isinstance(entry, dict) and str(entry.get(key_field)) == str(instance[key_field]):
+            return index
+    return None
+
+def merge(current, update):
+    """
+    Deep merge of the update payload into current. Sub-objects with
+    _action delete are removed, lists of sub-objects gain the missing items.
+    """
+    if not isinstance(current, dict) or not isinstance(update, dict):
+        return strip_meta(update)
+    result = dict(current)
+    for key, value in update.items():
+        if key.startswith('_'):
+            continue
+        if isinstance(value, dict) and value.get('_action') == 'delete':
+            result.pop(key, None)
+        elif isinstance(value, list) and isinstance(result.get(key), list):
+            items = list(result[key])
+            for item in value:
+                item = strip_meta(item)
+                if item not in strip_meta(items):
+                    items.append(item)
+            result[key] = items
+        elif isinstance(value, dict):
+            result[key] = merge(result.get(key, {}), value)
+        else:
+            result[key] = value
+    return result
+
+def apply_object(config, name, value, multi=None):
+    """
+    Apply the POST payload value of object name to config, in place. multi
+    tells if the object is a multi-instance one, guessed from config and the
+    payload when not given.
+    """
+    instances = value if isinstance(value, list) else [value]
+    if multi is None:
+        multi = isinstance(config.get(name), list) if name in config \
+            else is_multi_instance(value)
+    multi = multi or isinstance(value, list)
+    for instance in instances:
+        if not isinstance(instance, dict):
+            continue
+        action = instance.get('_action', 'add')
+        if not multi:
+            if action == 'delete':
+                config.pop(name, None)
+            else:
+                config[name] = merge(config.get(name, {}), instance)
+            continue
+        entries = config.setdefault(name, [])
+        if not isinstance(entries, list):
+            entries = config[name] = [entries]
+        index = find_instance(entries, instance)
+        if action == 'delete':
+            if index is not None:
+                del entries[index]
+            if not entries:
+                del config[name]
+        elif index is None:
+            entries.append(strip_meta(instance))
+        else:
+            entries[index] = merge(entries[index], instance)
+
+def apply_payload(config, data):
+    """
+    Return the local configuration of config, a dictionary of objects as
+    found in the _data of a configuration GET, after applying the POST
+    payload data, single or multipart, with the add, modify and delete
+    _action semantics. Inherited instances are left out, a POST creates a
+    local instance even if the same one is inherited, compare the result
+    with remove_inherited(config).
+    """
+    # Objects only inherited keep the shape the controller returns them in
+    shapes = dict((name, isinstance(value, list)) for name, value in config.items())
+    config = remove_inherited(config)
+    for part in data.get('_list', [data]):
+        for name, value in part.items():
+            if not name.startswith('_'):
+                apply_object(config, name, value, shapes.get(name))
+    return config
+
+def get_config_data(snapshot, objects=None):
+    """
+    Objects of a configuration GET response, restricted to objects if given
+    """
+    data = snapshot.get('_data', snapshot) if isinstance(snapshot, dict) else {}
+    if not isinstance(data, dict):
+        return {}
+    return dict((name, value) for name, value in data.items()
+                if not name.startswith('_') and (objects is None or name in objects))
+
+def is_subset(desired, running):
+    """
+    True if every parameter of desired has the same value in running
+    """
+    if isinstance(desired, dict):
+        if not isinstance(running, dict):
+            return False
+        return all(key.startswith('_') or (key in running and is_subset(value, running[key]))
+                   for key, value in desired.items())
+    if isinstance(desired, list):
+        if not isinstance(running, list):
+            return False
+        return all(any(is_subset(item, entry) for entry in running) for item in desired)
+    return desired == running or str(desired) == str(running)
+
+def is_inherited(entry):
+    """
+    True if a running instance is inherited from a node above config_path
+    """
+    flags = entry.get('_flags', {}) if isinstance(entry, dict) else {}
+    return bool(flags.get('inherited'))
+
+def remove_inherited(config):
+    """
+    Copy of config without the instances inherited from the nodes above
+    config_path, objects left without instance are removed
+    """
+    local = {}
+    for name, value in config.items():
+        if isinstance(value, list):
+            value = [copy.deepcopy(entry) for entry in value if not is_inherited(entry)]
+            if value:
+                local[name] = value
+        elif not is_inherited(value):
+            local[name] = copy.deepcopy(value)
+    return local
+
+def get_local_config(snapshot):
+    """
+    Objects of a configuration GET response configured on the node itself,
+    without the instances inherited from the nodes above and without
+    metadata keys, as saved by aos_config_backup
+    """
+    return strip_meta(remove_inherited(get_config_data(snapshot)))
+
+def compute_delta(running, desired, purge=False):
+    """
+    Minimal list of (object name, payload) operations turning the running
+    configuration into the desired one, the payload of multi-instance objects
+    is a list with a single instance. desired is a list of {object: value}
+    dictionaries in dependency order, as the data of a POST request.
+    Additions and modifications come first in desired order, deletions last
+    in reverse order so that referencing objects go before the objects they
+    use. With purge, instances of the desired multi-instance objects missing
+    from desired are deleted as well. Instances only inherited from the
+    nodes above count as absent, the desired ones are configured locally.
+    """
+    running = remove_inherited(running)
+    updates = []
+    deletes = []
+    for part in desired:
+        for name, value in part.items():
+            current = running.get(name)
+            multi = isinstance(value, list) or isinstance(current, list)
+            instances = value if isinstance(value, list) else [value]
+            if not multi:
+                instance = instances[0]
+                if instance.get('_action') == 'delete':
+                    if current is not None:
+                        deletes.append([(name, {'_action': 'delete'})])
+                elif not is_subset(instance, current):
+                    updates.append((name, instance))
+                continue
+
+            entries = current if isinstance(current, list) else \
+                [current] if current is not None else []
+            matched = set()
+            part_deletes = []
+            for instance in instances:
+                index = find_instance(entries, instance)
+                if index is not None:
+                    matched.add(index)
+                if instance.get('_action') == 'delete':
+                    if index is not None:
+                        part_deletes.append((name, [instance]))
+                elif index is None:
+                    updates.append((name, [instance]))
+                elif not is_subset(instance, entries[index]):
+                    instance = dict(instance)
+                    instance['_action'] = 'modify'
+                    updates.append((name, [instance]))
+            if purge:
+                for index, entry in enumerate(entries):
+                    if index in matched:
+                        continue
+                    key_field = get_key_field(instances[0] if instances else strip_meta(entry))
+                    if key_field not in entry:
+                        continue
+                    part_deletes.append((name, [{key_field: entry[key_field],
+                                                 '_action': 'delete'}]))
+            deletes.append(part_deletes)
+    operations = updates
+    for part_deletes in reversed(deletes):
+        operations.extend(part_deletes)
+    return operations
@@ -4,8 +4,13 @@ from __future__ import (absolute_import, division, print_function)
 __metaclass__ = type
 
 import json
+import os
+import time
+from fnmatch import fnmatchcase
 from ansible.module_utils.connection import Connection
-from ansible.module_utils.six.moves.urllib.parse import urlencode
+from ansible.module_utils.aos_config import apply_payload, get_config_data, get_key_field, \
+    remove_inherited, strip_meta
+from ansible.module_utils.six.moves.urllib.parse import urlencode, urlparse
 
 # -*- coding: utf-8 -*-
 #
@@ -24,34 +29,244 @@ from ansible.module_utils.six.moves.urllib.parse import urlencode
 # specific language governing permissions and limitations
 # under the License.
 
+# Objects which trigger an action on the controller instead of being stored
+# in the configuration tree of a node. Their effect can not be fetched with an
+# OBJECT filter, so changes are detected by comparing the full configuration.
+ACTION_OBJECTS = frozenset([
+    'write_memory',
+    'wdb_cpsec_add_mac',
+    'wdb_cpsec_del_mac',
+    'wdb_cpsec_modify_mac',
+    'configuration_node',
+    'copy_scp_system',
+    'copy_flash_tftp',
+    'copy_tftp_system',
+    'reload',
+])
+
+# Number of objects fetched per request when paginating without a limit
+PAGE_LIMIT = 100
+
+# Pages fetched at most by a paginated GET, in case the offset is not honored
+MAX_PAGES = 10000
+
+def get_records(resp):
+    """
+    Return the list of object instances in the _data of a GET response
+    """
+    records = []
+    if isinstance(resp, dict) and isinstance(resp.get('_data'), dict):
+        for value in resp['_data'].values():
+            if isinstance(value, list):
+                records.extend(value)
+            elif value is not None:
+                records.append(value)
+    return records
+
+def get_node_paths(node_hierarchy):
+    """
+    Sorted paths of the nodes of a node_hierarchy GET response
+    """
+    paths = []
+    pending = [('', node_hierarchy)] if isinstance(node_hierarchy, dict) else []
+    while pending:
+        parent, node = pending.pop()
+        name = node.get('name', '')
+        path = '/' if name == '/' else parent.rstrip('/') + '/' + name
+        if path != '/':
+            paths.append(path)
+        for child in node.get('childnodes') or []:
+            pending.append((path, child))
+    return sorted(paths)
+
+def get_ancestry_waves(config_paths):
+    """
+    config_paths split in lists where no path is an ancestor of another, in
+    order: the paths without ancestor in config_paths first, then the paths
+    with one ancestor in config_paths, and so on
+    """
+    waves = []
+    for config_path in config_paths:
+        depth = len([path for path in config_paths
+                     if path != config_path and
+                     config_path.startswith(path.rstrip('/') + '/')])
+        while len(waves) <= depth:
+            waves.append([])
+        waves[depth].append(config_path)
+    return [wave for wave in waves if wave]
+
+def get_failures(resp_data):
+    """
+    Index of the failed objects of a POST response. Returns a dictionary per
+    instance with a _result of non zero status, in response order: object
+    name, part (position in the _list of a multipart request), position
+    (in the list of instances of the object, None for a single instance),
+    key (identifying parameter and value of the instance), status and
+    status_str. The response is walked iteratively, the sub-objects of an
+    instance only until its first failure.
+    """
+    failures = []
+    if not isinstance(resp_data, dict):
+        return failures
+    parts = resp_data['_list'] if isinstance(resp_data.get('_list'), list) else [resp_data]
+    for part_index, part in enumerate(parts):
+        if not isinstance(part, dict):
+            continue
+        for name, value in part.items():
+            if name.startswith('_'):
+                continue
+            instances = value if isinstance(value, list) else [value]
+            for position, instance in enumerate(instances):
+                stack = [instance]
+                while stack:
+                    node = stack.pop()
+                    if isinstance(node, list):
+                        stack.extend(reversed(node))
+                        continue
+                    if not isinstance(node, dict):
+                        continue
+                    result = node.get('_result')
+                    if isinstance(result, dict) and str(result.get('status', 0)) != '0':
+                        key_field = get_key_field(strip_meta(instance)) \
+                            if isinstance(instance, dict) else None
+                        failures.append({
+                            'object': name, 'part': part_index,
+                            'position': position if isinstance(value, list) else None,
+                            'key': {key_field: instance[key_field]} if key_field else None,
+                            'status': result.get('status'),
+                            'status_str': result.get('status_str', '')})
+                        break
+                    stack.extend(val for key, val in node.items()
+                                 if key != '_result' and isinstance(val, (dict, list)))
+    return failures
+
+def get_failed_payload(data, failures):
+    """
+    Multipart payload with only the instances of the POST payload data
+    listed in failures, in their original order. Also returns the origin of
+    each of its instances, a dictionary mapping (part, object, position) in
+    the new payload to the same tuple in data, to map the failures of a
+    response to it back to data.
+    """
+    wanted = {}
+    for failure in failures:
+        wanted.setdefault((failure['part'], failure['object']), set()).add(failure['position'])
+    parts = []
+    origin = {}
+    for part_index, part in enumerate(data.get('_list', [data])):
+        new_part = {}
+        for name, value in part.items():
+            positions = wanted.get((part_index, name))
+            if not positions:
+                continue
+            if isinstance(value, list):
+                kept = [position for position in sorted(p for p in positions if p is not None)
+                        if position < len(value)]
+                new_part[name] = [value[position] for position in kept]
+                for new_position, position in enumerate(kept):
+                    origin[(len(parts), name, new_position)] = (part_index, name, position)
+            else:
+                new_part[name] = value
+                origin[(len(parts), name, None)] = (part_index, name, None)
+        if new_part:
+            parts.append(new_part)
+    return {'_list': parts}, origin
+
 class HttpHelper(object):
     def __init__(self, module):
         self._module = module
         self._connection_obj = None
+        self._stats_baseline = None
+        self._calls = []
 
     @property
     def _connection(self):
         if not self._connection_obj:
             self._connection_obj = Connection(self._module._socket_path)
+            # Counters of the connection are shared by all tasks on the host
+            self._stats_baseline = self._connection_obj.get_request_stats()
         return self._connection_obj
 
-    def http_request(self, url, method, data=None):
-        return self._connection.send_request(data=data, method=method, path=url)
+    def request_stats(self):
+        """
+        Retry and rate limit counters of the requests sent by this task
+        """
+        if not self._connection_obj:
+            return {}
+        stats = self._connection.get_request_stats()
+        for counter, value in self._stats_baseline.items():
+            if counter != 'rate':
+                stats[counter] = round(stats.get(counter, 0) - value, 3)
+        return stats
+
+    def timings(self):
+        """
+        Timings of the requests sent by this task: their number, total
+        latency and totals per endpoint. When the connection returns every
+        request sent, retries included, the calls of http_request with their
+        latency seen from the module are added as well.
+        """
+        if not self._connection_obj:
+            return {}
+        timings = self._connection.get_timings(self._stats_baseline.get('requests', 0))
+        if 'requests' in timings:
+            timings['calls'] = self._calls
+        return timings
+
+    def exit_json(self, **kwargs):
+        kwargs.setdefault('request_stats', self.request_stats())
+        kwargs.setdefault('timings', self.timings())
+        self._module.exit_json(**kwargs)
+
+    def fail_json(self, **kwargs):
+        kwargs.setdefault('request_stats', self.request_stats())
+        kwargs.setdefault('timings', self.timings())
+        self._module.fail_json(**kwargs)
+
+    def http_request(self, url, method, data=None, select=None, timeout=None):
+        connection = self._connection
+        call = {'method': method, 'path': urlparse(url).path, 'status': None,
+                'request_bytes': len(data) if data else 0}
+        start = time.time()
+        try:
+            resp, call['status'] = connection.send_request(data=data, method=method, path=url,
+                                                           select=select, timeout=timeout)
+        finally:
+            # Includes the time spent in the connection, retries and rate limit
+            call['latency'] = round(time.time() - start, 4)
+            self._calls.append(call)
+        return resp, call['status']
+
+    def http_requests(self, requests, max_workers=4):
+        """
+        Send a list of {'url', 'method', 'data'} requests concurrently over
+        the persistent session, see HttpApi.send_requests for the results
+        """
+        requests = [{'path': request['url'], 'method': request.get('method', 'GET'),
+                     'data': request.get('data')} for request in requests]
+        return self._connection.send_requests(requests, max_workers)
+
+    def show_commands(self, commands, max_workers=4, ttl=None, refresh=False):
+        """
+        Run show commands concurrently through the show command cache of the
+        connection, see HttpApi.show_commands for ttl, refresh and the results
+        """
+        return self._connection.show_commands(commands, max_workers, ttl, refresh)
 
 class AosApi(HttpHelper):
     def __init__(self, module):
         super(AosApi, self).__init__(module)
         self.api_version = "/v1"
 
-    def get_query_params(self):
+    def get_query_params(self, offset=None, limit=None):
         query_params = {}
         params = dict(
             config_path=self._module.params.get('config_path'),
             filter=json.dumps(self._module.params.get('filter')),
             sort=self._module.params.get('sort'),
             count=self._module.params.get('count'),
-            limit=self._module.params.get('limit'),
-            offset=self._module.params.get('offset'),
+            limit=limit if limit is not None else self._module.params.get('limit'),
+            offset=offset if offset is not None else self._module.params.get('offset'),
             total=self._module.params.get('total')
             )
         query_params.update({key: value for key, value in params.items() if value is not None})
@@ -74,83 +289,366 @@ class AosApi(HttpHelper):
             data = {'_list': params_data}
         return data
 
-    def write_mem(self):
-        config_path = self._module.params.get('config_path')
+    def write_mem(self, config_path=None, defer=False):
+        """
+        write_memory on config_path, or only record it in the connection to
+        be flushed later, once per config_path, when defer is set
+        """
+        if config_path is None:
+            config_path = self._module.params.get('config_path')
+        if defer:
+            self._connection.defer_write_memory(config_path)
+            return True
+        # Saving the configuration never changes it, no idempotency check
         url = "/configuration/object/write_memory"
         config_url = self.get_url(url, params={'config_path': config_path})
-        result, changed = self.post(url=config_url)
+        res, code = self.http_request(url=config_url, method="POST", data=json.dumps({}))
         status = False
-        if 'Error' not in result['resp'] and result['code'] == 200:
+        if 'Error' not in res and code == 200:
             status = True
         return status
 
-    def validate_response(self, resp_data):
+    def flush_write_mem(self, config_paths=None):
+        """
+        Send the deferred write_memory of the connection, returns their
+        status keyed by config_path
+        """
+        return self._connection.flush_write_memory(config_paths)
+
+    def begin_transaction(self):
+        """
+        Open a transaction in the connection and return its id, False if one
+        is already open
+        """
+        return self._connection.begin_transaction()
+
+    def opened_transaction(self, transaction_id):
+        """
+        False if the connection never opened the transaction transaction_id,
+        as when the connection was reset since, see HttpApi.opened_transaction
+        """
+        return self._connection.opened_transaction(transaction_id)
+
+    def get_transaction(self, config_path=None, transaction_id=None):
+        """
+        State of the open transaction of the connection for config_path,
+        None if no transaction is open, see HttpApi.get_transaction. Fails
+        the module if the connection never opened the transaction
+        transaction_id of the aos_transaction begin task: the connection was
+        reset since and the POSTs buffered in it were dropped.
+        """
+        transaction = self._connection.get_transaction(config_path, transaction_id)
+        if transaction is not None and transaction.get('lost'):
+            self.fail_json(changed=False, msg="Transaction %s was lost, the connection was"
+                                              " reset since it was opened and the POSTs"
+                                              " buffered in it were dropped, abort it"
+                                              % transaction_id)
+        return transaction
+
+    def get_buffered_posts(self):
+        """
+        Buffered POSTs of the open transaction, which stays open, None if no
+        transaction is open
+        """
+        return self._connection.get_buffered_posts()
+
+    def end_transaction(self):
+        """
+        Close the open transaction and return its buffered POSTs, None if no
+        transaction is open
+        """
+        return self._connection.end_transaction()
+
+    def buffer_post(self, config_path, data, transaction, commit=False):
+        """
+        Buffer the POST of data on config_path in the open transaction of the
+        connection instead of sending it. The change is predicted from the
+        configuration the POSTs buffered before lead to, only the objects
+        the transaction did not fetch yet are fetched. Returns the result of
+        the task, failed if the objects could not be fetched.
+        """
+        objects = self.get_payload_objects(self.get_url('/configuration/object'), data)
+        config = transaction['config'] or {'objects': [], 'data': {}}
+        if objects is None:
+            # Changes made by action objects can not be predicted
+            changed = True
+        else:
+            missing = sorted(set(objects) - set(config['objects']))
+            if missing:
+                snapshot = self.get_config_snapshot(config_path, missing)
+                if not isinstance(snapshot, dict) or 'Error' in snapshot:
+                    return dict(changed=False, failed=True, response=snapshot,
+                                msg="Unable to fetch the configuration of " + config_path)
+                config['data'].update(strip_meta(remove_inherited(
+                    get_config_data(snapshot, missing))))
+                config['objects'] = sorted(set(config['objects']) | set(missing))
+            after = strip_meta(apply_payload(config['data'], data))
+            changed = after != config['data']
+            config['data'] = after
+        position = self._connection.buffer_post(config_path, data, config, changed, commit)
+        return dict(changed=changed, transaction={'config_path': config_path,
+                                                  'position': position, 'buffered': True})
+
+    def check_response(self, resp_data):
+        """
+        Validate the response of a POST, returns True if the request and all
+        its objects succeeded, the _pending flag, the status strings joined
+        and the index of the failed objects, see get_failures
+        """
         res = True
         pending = 0
         status_str = []
-
-        def status_check(resp_data, res):
-            # Recursively check status in response data
-            # Returns True if all status check passes
-            # else return False
-            if not res:
-                return False
-            if isinstance(resp_data, list):
-                for ele in resp_data:
-                    res = status_check(ele, res)
-            elif isinstance(resp_data, dict):
-                if "_result" in resp_data.keys():
-                    if resp_data["_result"]["status"] != 0:
-                        status_str.append(resp_data["_result"]["status_str"])
-                        res = False
-                for ele, val in resp_data.items():
-                    if isinstance(val, (dict, list)):
-                        res = status_check(val, res)
-            return res
+        failures = []
 
         if "_global_result" in resp_data:
-            if resp_data["_global_result"]["status"] == 0:
-                res = status_check(resp_data, True)
-                if "_pending" in resp_data["_global_result"]:
-                    pending = resp_data["_global_result"]["_pending"]
-            else:
+            global_result = resp_data["_global_result"]
+            pending = global_result.get("_pending", 0)
+            if global_result["status"] != 0:
                 res = False
-
-                if "_pending" in resp_data["_global_result"]:
-                    pending = resp_data["_global_result"]["_pending"]
-                status_str.append(resp_data["_global_result"]["status_str"])
+                status_str.append(global_result["status_str"])
+            failures = get_failures(resp_data)
+            if failures:
+                res = False
+            for failure in failures:
+                key = ", ".join("%s %s" % item for item in (failure['key'] or {}).items())
+                status_str.append("%s%s: %s" % (failure['object'], " " + key if key else "",
+                                                failure['status_str']))
         elif "Error" in resp_data:
             res = False
             status_str.append(resp_data["Error"])
 
-        if status_str:
-            status_str = ", ".join(status_str)
-        else:
-            status_str = ""
+        return res, pending, ", ".join(status_str), failures
 
+    def validate_response(self, resp_data):
+        res, pending, status_str, _ = self.check_response(resp_data)
         return res, pending, status_str
 
-    def get(self, url, data=None):
-        res, code = self.http_request(url=url, method="GET", data=data)
+    def retry_failed(self, url, data, result, retries):
+        """
+        Send again, up to retries times, only the objects of the POST payload
+        data which failed in result, the result of its POST. Returns result
+        with the response of the last POST in resp, the failures left, in
+        the positions of data, and the number of objects sent and failed by
+        every attempt.
+        """
+        failures = get_failures(result['resp']) if result['code'] == 200 else []
+        result = dict(result, failures=failures, attempts=[])
+        attempt = 0
+        while failures and attempt < retries:
+            attempt += 1
+            # Leave the controller time to release a lock or finish a commit
+            time.sleep(min(attempt, 5))
+            retry_data, origin = get_failed_payload(data, failures)
+            resp, code = self.http_request(url=url, method="POST", data=json.dumps(retry_data))
+            attempt_result = {'objects': len(origin), 'response_code': code}
+            result['attempts'].append(attempt_result)
+            if code != 200:
+                break
+            failures = []
+            for failure in get_failures(resp):
+                part, name, position = origin.get(
+                    (failure['part'], failure['object'], failure['position']),
+                    (failure['part'], failure['object'], failure['position']))
+                failures.append(dict(failure, part=part, position=position))
+            attempt_result['failed'] = len(failures)
+            result.update(resp=resp, code=code, failures=failures)
+        return result
+
+    def get(self, url, data=None, select=None):
+        res, code = self.http_request(url=url, method="GET", data=data, select=select)
         result = {'resp': res, 'code': code}
         return result
 
+    def save_records(self, url, dest, select, append=False):
+        """
+        GET url and write the records of the list at the dotted path select of
+        the response, like _data.netdst, to dest as JSON lines from the
+        connection, without returning them to the module
+        """
+        result = self._connection.save_records(url, dest, select, append)
+        return {'resp': result['response'], 'code': result['code'],
+                'records': result['records'], 'digest': result.get('digest')}
+
+    def get_payload_objects(self, url, data):
+        """
+        Return the sorted list of configuration objects a POST to url with
+        data modifies, or None if they can not be determined
+        """
+        path = urlparse(url).path
+        prefix = self.api_version + '/configuration/object'
+        if not path.startswith(prefix):
+            return None
+        url_object = path[len(prefix):].strip('/')
+        if url_object:
+            objects = set([url_object])
+        elif isinstance(data, dict):
+            objects = set()
+            for part in data.get('_list', [data]):
+                if not isinstance(part, dict):
+                    return None
+                objects.update(key for key in part if not key.startswith('_'))
+        else:
+            return None
+        if not objects or objects & ACTION_OBJECTS:
+            return None
+        return sorted(objects)
+
+    def get_config_snapshot(self, config_path, objects=None, refresh=False):
+        """
+        Fetch the configuration of config_path, restricted to objects with an
+        OBJECT filter when given, through the snapshot cache of the connection
+        """
+        return self._connection.get_config(config_path, objects, refresh)
+
+    def get_pages(self, url, select=None, dest=None):
+        """
+        Generator walking the offset of a GET on url in pages of limit
+        objects. Yields the result of every page until a page returns less
+        than limit records, the total of the _meta of the response is
+        reached, a page repeats the previous one or MAX_PAGES pages were
+        fetched. Only the select subtree of the responses is decoded, with
+        dest the records are appended to this file by the connection
+        instead, see save_records.
+        """
+        limit = self._module.params.get('limit') or PAGE_LIMIT
+        start = offset = self._module.params.get('offset') or 0
+        previous = None
+        for page in range(MAX_PAGES):
+            params = self.get_query_params(offset=offset, limit=limit)
+            if dest:
+                size = os.path.getsize(dest) if offset != start else 0
+                result = self.save_records(self.get_url(url, params=params), dest, select,
+                                           append=offset != start)
+                count = result['records']
+                records = result['digest']
+            else:
+                result = self.get(self.get_url(url, params=params), select=select)
+                records = get_records(result['resp'])
+                count = len(records)
+            if page and count and records == previous:
+                # The offset is ignored, the records of the repeated page are dropped
+                if dest:
+                    with open(dest, 'r+') as dest_file:
+                        dest_file.truncate(size)
+                break
+            yield result
+            offset += limit
+            meta = result['resp'].get('_meta') if isinstance(result['resp'], dict) else None
+            total = meta.get('total') if isinstance(meta, dict) else None
+            if count < limit or (isinstance(total, int) and offset >= total):
+                break
+            previous = records
+        else:
+            self._module.warn("Stopped after %d pages of %s, the offset may not be honored"
+                              % (MAX_PAGES, url))
+
+    def get_node_paths(self):
+        """
+        Paths of all the nodes of the configuration hierarchy
+        """
+        return get_node_paths(self.get(self.get_url('/configuration/object/node_hierarchy'))['resp'])
+
+    def expand_config_paths(self, patterns):
+        """
+        Expand the glob patterns in a list of config_paths, matched one level
+        of the hierarchy at a time, so that /md/*/* only matches nodes two
+        levels below /md. The node hierarchy is only fetched if needed.
+        """
+        node_paths = None
+        config_paths = []
+        for pattern in patterns:
+            if not any(char in pattern for char in '*?['):
+                matches = [pattern]
+            else:
+                if node_paths is None:
+                    node_paths = self.get_node_paths()
+                levels = pattern.rstrip('/').split('/')
+                matches = [path for path in node_paths
+                           if len(path.split('/')) == len(levels) and
+                           all(fnmatchcase(name, level)
+                               for name, level in zip(path.split('/'), levels))]
+            config_paths.extend(path for path in matches if path not in config_paths)
+        return config_paths
+
+    def get_config_snapshots(self, config_paths, objects=None, refresh=False, max_workers=4):
+        """
+        get_config_snapshot of several config_paths fetched concurrently
+        """
+        return self._connection.get_configs(config_paths, objects, refresh, max_workers)
+
+    def backup_configs(self, backups, max_workers=4):
+        """
+        Write the configuration of nodes to files from the connection, see
+        HttpApi.backup_configs for backups and the results
+        """
+        return self._connection.backup_configs(backups, max_workers)
+
+    def post_nodes(self, config_paths, data, max_workers=4):
+        """
+        POST data to the /configuration/object of every config_path
+        concurrently, with the idempotency logic of post() per node.
+        Returns {'resp', 'code', 'changed', 'error'} keyed by config_path.
+        A POST on a node changes the configuration its descendants inherit,
+        so the nodes are posted in waves, ancestors before descendants, each
+        wave after the previous one is over.
+        """
+        results = {}
+        for wave in get_ancestry_waves(config_paths):
+            results.update(self._post_wave(wave, data, max_workers))
+        return results
+
+    def _post_wave(self, config_paths, data, max_workers):
+        # post_nodes on config_paths, none of them an ancestor of another
+        idempotency = self._module.params.get('idempotency') or 'scoped'
+        url = self.get_url('/configuration/object')
+        objects = self.get_payload_objects(url, data) if idempotency == 'scoped' else None
+        before = self.get_config_snapshots(config_paths, objects, max_workers=max_workers)
+        if objects and any(not isinstance(snapshot, dict) or 'Error' in snapshot
+                           for snapshot in before.values()):
+            objects = None
+            before = self.get_config_snapshots(config_paths, max_workers=max_workers)
+
+        body = json.dumps(data)
+        requests = [{'url': self.get_url('/configuration/object',
+                                         params={'config_path': config_path}),
+                     'method': 'POST', 'data': body} for config_path in config_paths]
+        responses = self.http_requests(requests, max_workers)
+
+        after = self.get_config_snapshots(config_paths, objects, refresh=True,
+                                          max_workers=max_workers)
+        results = {}
+        for config_path, response in zip(config_paths, responses):
+            results[config_path] = {'resp': response['response'], 'code': response['code'],
+                                    'error': response['error'],
+                                    'changed': before[config_path] != after[config_path]}
+        return results
+
     def post(self, url, data={}):
-        data = json.dumps(data)
         config_path = self._module.params.get('config_path')
-        idempotency_url = self.get_url('/configuration/object/config',
-                                      params={'config_path': config_path})
+        idempotency = self._module.params.get('idempotency') or 'scoped'
 
         # Idemptency logic contributed by author sachaboudjema
         # Description: Check configuration in a node path
         #              before and after config push
         # Date Referenced: May 01 2020
-        before = self.get(idempotency_url)['resp']
+        objects = None
+        if idempotency == 'scoped':
+            objects = self.get_payload_objects(url, data)
+        # The snapshot cached by the previous task on this node is reused as
+        # before, after is always fetched and becomes the next task's before
+        before = self.get_config_snapshot(config_path, objects)
+        if objects and (not isinstance(before, dict) or 'Error' in before):
+            # OBJECT filter rejected by the controller, compare full config
+            objects = None
+            before = self.get_config_snapshot(config_path)
 
-        res, code = self.http_request(url=url, method="POST", data=data)
+        res, code = self.http_request(url=url, method="POST", data=json.dumps(data))
         result = {'resp': res, 'code': code}
+        retries = self._module.params.get('retry_failed')
+        if retries:
+            result = self.retry_failed(url, data, result, retries)
 
-        after = self.get(idempotency_url)['resp']
+        after = self.get_config_snapshot(config_path, objects, refresh=True)
 
         changed = (before != after)
 
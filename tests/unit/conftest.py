@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import os
+import sys
+from importlib.util import module_from_spec, spec_from_file_location
+
+ROLE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# The module_utils of the role are imported from ansible.module_utils by the
+# modules, as AnsiballZ would package them
+for _name in ('aos_config', 'aos_http'):
+    if 'ansible.module_utils.' + _name not in sys.modules:
+        _spec = spec_from_file_location('ansible.module_utils.' + _name,
+                                        os.path.join(ROLE_DIR, 'module_utils', _name + '.py'))
+        sys.modules['ansible.module_utils.' + _name] = module_from_spec(_spec)
+        _spec.loader.exec_module(sys.modules['ansible.module_utils.' + _name])
+
+# The httpapi plugin, as loaded by Ansible from the role
+if 'ansible.plugins.httpapi.aos' not in sys.modules:
+    _spec = spec_from_file_location('ansible.plugins.httpapi.aos',
+                                    os.path.join(ROLE_DIR, 'httpapi_plugins', 'aos.py'))
+    sys.modules['ansible.plugins.httpapi.aos'] = module_from_spec(_spec)
+    _spec.loader.exec_module(sys.modules['ansible.plugins.httpapi.aos'])
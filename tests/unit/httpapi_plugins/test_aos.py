@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+import datetime
+import gzip
+import io
+import json
+import ssl
+import threading
+import zlib
+
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.x509.oid import NameOID
+
+from ansible.module_utils.connection import ConnectionError
+from ansible.module_utils.six.moves.BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from ansible.module_utils.six.moves.socketserver import ThreadingMixIn
+from ansible.module_utils.six.moves.urllib.error import HTTPError
+from ansible.module_utils.six.moves.urllib.parse import urlencode
+from ansible.parsing.vault import VaultLib, VaultSecret
+from ansible.plugins.httpapi import aos
+from ansible.plugins.httpapi.aos import HttpApi, InflateStream, RateLimiter, ResponseStream, \
+    decompress_stream, select_json
+
+
+class FakeConnection(object):
+    """
+    httpapi connection with only the options of options, get_option raises
+    KeyError for the others like the connection of Ansible 2.9
+    """
+
+    def __init__(self, options):
+        self.options = options
+        self._auth = None
+        self._connected = True
+        self._url = '%s://%s:%s' % ('https' if options.get('use_ssl') else 'http',
+                                    options['host'], options['port'])
+        self.user_agents = []
+
+    def get_option(self, option):
+        return self.options[option]
+
+    def _log_messages(self, message):
+        pass
+
+    def queue_message(self, level, message):
+        pass
+
+
+class ShowHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.server.user_agents.append(self.headers.get('User-Agent'))
+        self.send_json({'_data': ['Output of show clock']})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        self.send_json({'_global_result': {'status': 0, 'status_str': 'Success'}})
+
+    def send_json(self, document):
+        body = json.dumps(document).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadedServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+@pytest.fixture(scope='module')
+def certfile(tmp_path_factory):
+    # Self-signed certificate and key of 127.0.0.1 in a PEM file
+    key = ec.generate_private_key(ec.SECP256R1())
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u'127.0.0.1')])
+    now = datetime.datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(name) \
+        .public_key(key.public_key()).serial_number(x509.random_serial_number()) \
+        .not_valid_before(now).not_valid_after(now + datetime.timedelta(days=1)) \
+        .sign(key, hashes.SHA256())
+    path = tmp_path_factory.mktemp('tls') / 'cert.pem'
+    path.write_bytes(key.private_bytes(serialization.Encoding.PEM,
+                                       serialization.PrivateFormat.PKCS8,
+                                       serialization.NoEncryption()) +
+                     cert.public_bytes(serialization.Encoding.PEM))
+    return str(path)
+
+
+@pytest.fixture
+def tls_server(certfile):
+    server = ThreadedServer(('127.0.0.1', 0), ShowHandler)
+    server.user_agents = []
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def get_plugin(port, **options):
+    # Only the options of the httpapi connection of Ansible 2.9
+    options.update(host='127.0.0.1', port=port, use_ssl=True, validate_certs=False,
+                   use_proxy=False, persistent_command_timeout=10)
+    return HttpApi(FakeConnection(options))
+
+
+def show_clock(plugin):
+    return plugin.send_request(None, path='/v1/configuration/showcommand?command=show+clock',
+                               method='GET')
+
+
+def test_tls_keepalive_reuses_and_resumes(tls_server):
+    plugin = get_plugin(tls_server.server_address[1])
+    assert show_clock(plugin) == ({'_data': ['Output of show clock']}, 200)
+    assert show_clock(plugin)[1] == 200
+    stats = plugin.get_request_stats()
+    assert (stats['connections'], stats['tls_handshakes'], stats['reused']) == (1, 1, 1)
+
+    # A new connection resumes the TLS session of the previous one
+    plugin._transport.close()
+    assert show_clock(plugin)[1] == 200
+    stats = plugin.get_request_stats()
+    assert (stats['connections'], stats['tls_handshakes'], stats['tls_resumed']) == (2, 1, 1)
+    assert tls_server.user_agents == ['ansible-httpapi'] * 3
+    plugin._transport.close()
+
+
+def test_tls_connection_options(tls_server):
+    plugin = get_plugin(tls_server.server_address[1], http_agent='aos-test', ciphers=None,
+                        ca_path=None, client_cert=None, client_key=None)
+    assert show_clock(plugin)[1] == 200
+    assert tls_server.user_agents == ['aos-test']
+    plugin._transport.close()
+
+    # Certificates are validated unless validate_certs is false
+    plugin = get_plugin(tls_server.server_address[1])
+    plugin.connection.options['validate_certs'] = True
+    with pytest.raises(Exception, match='CERTIFICATE_VERIFY_FAILED'):
+        show_clock(plugin)
+
+
+def test_config_cache_invalidation():
+    plugin = get_plugin(443)
+    requests = []
+
+    def send_request(data, path, method):
+        requests.append(path)
+        return {'_data': {'vlan_id': [{'id': len(requests)}]}}, 200
+
+    plugin.send_request = send_request
+    for config_path in ('/md', '/md/Boston', '/md/Boston/00:1a:1e:00:00:01', '/md/Bost'):
+        plugin.get_config(config_path)
+    plugin.get_config('/md/Boston', ['vlan_id'])
+    assert plugin.get_config('/md/Boston') == {'_data': {'vlan_id': [{'id': 2}]}}
+    assert len(requests) == 5
+
+    # A POST to a node drops the snapshots of the node and of the nodes below it
+    plugin._invalidate_posted_path('/v1/configuration/object?' +
+                                   urlencode({'config_path': '/md/Boston/'}))
+    assert sorted(plugin._config_cache) == [('/md', None), ('/md/Bost', None)]
+    plugin._invalidate_posted_path('/v1/configuration/object/write_memory?' +
+                                   urlencode({'config_path': '/md'}))
+    assert len(plugin._config_cache) == 2
+    plugin.invalidate_config_cache('/')
+    assert not plugin._config_cache
+
+
+def http_error(code, headers=None):
+    return HTTPError('https://127.0.0.1/v1/configuration/object', code, 'Error', headers or {},
+                     None)
+
+
+def test_is_retryable():
+    plugin = get_plugin(443)
+    assert plugin._is_retryable(http_error(503), b'')
+    assert plugin._is_retryable(http_error(429), b'')
+    assert plugin._is_retryable(http_error(500), b'Configuration is locked by another session')
+    assert not plugin._is_retryable(http_error(500), b'Internal Server Error')
+    assert not plugin._is_retryable(http_error(404), b'Try again')
+    assert plugin._is_retryable(None, {'_global_result': {'status': 1,
+                                                          'status_str': 'Config lock held'}})
+    assert not plugin._is_retryable(None, {'_global_result': {'status': '1',
+                                                              'status_str': 'Invalid vlan'}})
+    assert plugin._is_retryable(None, {'Error': 'Controller busy'})
+    assert not plugin._is_retryable(None, {'_global_result': {'status': '0'}})
+    assert not plugin._is_retryable(None, b'Internal Server Error')
+
+
+def test_backoff(monkeypatch):
+    plugin = get_plugin(443)
+    plugin._options.update(retry_backoff=0.5, retry_backoff_max=3)
+    # Upper bound of the jitter
+    monkeypatch.setattr(aos.random, 'uniform', lambda low, high: high)
+    assert [plugin._backoff(attempt, None) for attempt in range(5)] == [0.5, 1, 2, 3, 3]
+    assert plugin._backoff(0, http_error(503, {'Retry-After': '2'})) == 2
+    assert plugin._backoff(0, http_error(503, {'Retry-After': '120'})) == 3
+    assert plugin._backoff(1, http_error(503, {'Retry-After': 'soon'})) == 1
+
+
+class FakeTime(object):
+    """
+    Clock of the rate limiter, advanced by sleep
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_rate_limiter(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(aos, 'time', clock)
+    limiter = RateLimiter(max_rate=2, min_rate=1, latency=1)
+    # A burst of max_rate requests, then one every 1 / rate seconds
+    assert [limiter.acquire() for _ in range(4)] == [0, 0, 0.5, 0.5]
+    assert clock.sleeps == [0.5, 0.5]
+    clock.now += 10
+    assert limiter.acquire() == 0
+    assert limiter.tokens == 1
+
+    limiter.success(latency=2)
+    assert limiter.rate == 1
+    limiter.failure()
+    assert limiter.rate == 1
+    limiter.success(latency=0.1)
+    limiter.success(latency=0.1)
+    assert limiter.rate == 2
+    limiter.failure()
+    assert limiter.rate == 1
+
+
+CONFIG = {'_data': {'vlan_id': [{'id': vlan_id} for vlan_id in range(1, 200)],
+                    'hostname': {'hostname': 'md-boston'}},
+          '_meta': {'total': 199}}
+SELECTED = {'_data': {'vlan_id': CONFIG['_data']['vlan_id']}, '_meta': {'total': 199}}
+
+
+def compress_raw_deflate(body):
+    compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(body) + compressor.flush()
+
+
+@pytest.mark.parametrize('encoding, compress', [
+    ('gzip', gzip.compress),
+    ('deflate', zlib.compress),
+    ('deflate', compress_raw_deflate),
+    (None, lambda body: body),
+    ('gzip', lambda body: body),
+])
+def test_decompress_stream_and_select_json(encoding, compress):
+    body = json.dumps(CONFIG).encode()
+    wire = compress(body)
+    stream = ResponseStream(io.BytesIO(wire))
+    decompressed = decompress_stream(stream, encoding)
+    assert select_json(decompressed, '_data.vlan_id') == SELECTED
+    assert decompressed.bytes_read == len(body)
+    assert stream.bytes_read == len(wire)
+
+
+def test_select_json_invalid_json():
+    # A body read at once is decoded again after the error, a streamed one is not
+    body = b'{"_data": {"vlan_id": [1, 2,]}}'
+    assert select_json(ResponseStream(io.BytesIO(body)), '_data.vlan_id') == body
+    assert select_json(ResponseStream(io.BytesIO(b'Internal Server Error')), '_data') == \
+        b'Internal Server Error'
+    stream = ResponseStream(InflateStream(io.BytesIO(zlib.compress(body)), zlib.MAX_WBITS))
+    with pytest.raises(ConnectionError, match='Invalid JSON in the response'):
+        select_json(stream, '_data.vlan_id')
+
+
+def test_show_cache(monkeypatch):
+    clock = FakeTime()
+    monkeypatch.setattr(aos, 'time', clock)
+    plugin = get_plugin(443)
+    plugin._options.update(show_cache=True, show_cache_ttl=30, show_cache_size=2)
+    sent = []
+
+    def send_requests(requests, max_workers):
+        sent.extend(request['path'] for request in requests)
+        return [{'response': {'_data': [request['path']]}, 'code': 200, 'error': None,
+                 'latency': 0.1} for request in requests]
+
+    def show(*commands, **kwargs):
+        return [result['cached'] for result in plugin.show_commands(list(commands), **kwargs)]
+
+    plugin.send_requests = send_requests
+    assert show('show clock') == [False]
+    clock.now += 10
+    # Commands are normalized, the age of a cached result is returned
+    assert plugin.show_commands(['show  clock '])[0]['age'] == 10
+    assert show('show clock', refresh=True) == [False]
+    assert show('show clock', ttl=0) == [False]
+    assert len(sent) == 3
+
+    # The least recently used result is evicted beyond show_cache_size
+    assert show('show version') == [False]
+    assert show('show clock') == [True]
+    assert show('show switches') == [False]
+    assert [key[1] for key in plugin._show_cache] == ['show clock', 'show switches']
+    # Expired results are run again
+    clock.now += 31
+    assert show('show clock', 'show switches') == [False, False]
+
+
+def test_show_cache_invalidated_by_config_post(tls_server):
+    plugin = get_plugin(tls_server.server_address[1])
+    plugin._options.update(show_cache=True)
+    assert [result['cached'] for result in plugin.show_commands(['show clock'] * 2)] == \
+        [False, False]
+    assert plugin.show_commands(['show clock'])[0]['cached']
+    plugin.send_request(json.dumps({'vlan_id': {'id': 10}}), method='POST',
+                        path='/v1/configuration/object/vlan_id?config_path=%2Fmd')
+    assert not plugin._show_cache
+    assert not plugin.show_commands(['show clock'])[0]['cached']
+    plugin._transport.close()
+
+
+@pytest.mark.parametrize('session', [{'created': 1600000000}, {'UIDARUBA': ''}, ['UIDARUBA']])
+def test_load_session_without_token(tmp_path, session):
+    plugin = get_plugin(443)
+    plugin._options.update(session_cache_dir=str(tmp_path))
+    plugin.send_request = pytest.fail
+    vault = VaultLib([('default', VaultSecret(b'password'))])
+    session_file = plugin._session_file('admin')
+    with open(session_file, 'wb') as cache:
+        cache.write(vault.encrypt(json.dumps(session).encode()))
+    assert plugin._load_session('admin', 'password') is False
+    assert plugin.connection._auth is None
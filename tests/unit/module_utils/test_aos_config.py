@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible.module_utils.aos_config import (apply_payload, compute_delta, get_config_data,
+                                             get_key_field, is_subset, remove_inherited,
+                                             strip_meta)
+
+# _data of a configuration GET on /md/Boston, as returned by AOS 8
+RUNNING = {
+    'ssid_prof': [
+        {'profile-name': 'default', 'essid': {'essid': 'aruba-ap'},
+         '_flags': {'inherited': True, 'default': True}},
+        {'profile-name': 'corp-ssid', 'essid': {'essid': 'corp'},
+         'opmode': {'wpa2-aes': True}},
+    ],
+    'vlan_id': [
+        {'id': 1, '_flags': {'inherited': True, 'default': True}},
+        {'id': 10},
+    ],
+    'hostname': {'hostname': 'md-boston'},
+    'clock_timezone': {'timezone-name': 'PST', 'hours': -8, 'minutes': 0,
+                       '_flags': {'inherited': True}},
+}
+
+
+def test_get_key_field_known_fields():
+    assert get_key_field({'profile-name': 'corp', 'essid': {'essid': 'corp'}}) == 'profile-name'
+    assert get_key_field({'id': 10, 'descr': 'users'}) == 'id'
+    assert get_key_field({'rad_server_name': 'nps1', 'rad_host': {'host': '10.1.1.1'}}) \
+        == 'rad_server_name'
+    assert get_key_field({'ipaddr': '10.1.1.50', 'category': 'security'}) == 'ipaddr'
+
+
+def test_get_key_field_fallbacks():
+    # First parameter ending with _name or -name, else the first plain value
+    assert get_key_field({'acl_sess': {}, 'accname': 'corp', 'pool_name': 'p1'}) == 'pool_name'
+    assert get_key_field({'_action': 'delete', 'dhcp': {}, 'domain': 'corp'}) == 'domain'
+    assert get_key_field({'essid': {'essid': 'corp'}}) is None
+
+
+def test_get_config_data_restricts_objects():
+    snapshot = {'_data': RUNNING, '_meta': {'total': 4}}
+    assert sorted(get_config_data(snapshot)) == ['clock_timezone', 'hostname', 'ssid_prof',
+                                                 'vlan_id']
+    assert list(get_config_data(snapshot, ['vlan_id'])) == ['vlan_id']
+    assert get_config_data({'Error': 'Invalid config_path'}) == {'Error': 'Invalid config_path'}
+
+
+def test_remove_inherited():
+    local = remove_inherited(RUNNING)
+    assert [entry['profile-name'] for entry in local['ssid_prof']] == ['corp-ssid']
+    assert local['vlan_id'] == [{'id': 10}]
+    assert 'clock_timezone' not in local
+    assert local['hostname'] == {'hostname': 'md-boston'}
+
+
+def test_apply_payload_modifies_local_instance():
+    data = {'ssid_prof': [{'profile-name': 'corp-ssid', 'opmode': {'wpa3-sae-aes': True}}]}
+    after = strip_meta(apply_payload(RUNNING, data))
+    assert after['ssid_prof'] == [{'profile-name': 'corp-ssid', 'essid': {'essid': 'corp'},
+                                   'opmode': {'wpa2-aes': True, 'wpa3-sae-aes': True}}]
+    # The running configuration is not modified
+    assert RUNNING['ssid_prof'][1]['opmode'] == {'wpa2-aes': True}
+
+
+def test_apply_payload_unchanged_local_instance():
+    data = {'vlan_id': [{'id': 10}]}
+    assert strip_meta(apply_payload(RUNNING, data)) == strip_meta(remove_inherited(RUNNING))
+
+
+def test_apply_payload_creates_local_copy_of_inherited_instance():
+    # The same instance is inherited, the POST still creates a local one
+    data = {'ssid_prof': {'profile-name': 'default', 'essid': {'essid': 'aruba-ap'}}}
+    before = strip_meta(remove_inherited(RUNNING))
+    after = strip_meta(apply_payload(RUNNING, data))
+    assert before != after
+    assert after['ssid_prof'] == [{'profile-name': 'corp-ssid', 'essid': {'essid': 'corp'},
+                                   'opmode': {'wpa2-aes': True}},
+                                  {'profile-name': 'default', 'essid': {'essid': 'aruba-ap'}}]
+    data = {'clock_timezone': {'timezone-name': 'PST', 'hours': -8, 'minutes': 0}}
+    assert strip_meta(apply_payload(RUNNING, data))['clock_timezone'] == \
+        {'timezone-name': 'PST', 'hours': -8, 'minutes': 0}
+
+
+def test_apply_payload_new_multi_instance_object_is_a_list():
+    data = {'_list': [{'aaa_prof': {'profile-name': 'corp-aaa'}},
+                      {'server_group_prof': {'sg_name': 'corp-sg'}}]}
+    after = apply_payload({}, data)
+    assert after['aaa_prof'] == [{'profile-name': 'corp-aaa'}]
+    assert after['server_group_prof'] == [{'sg_name': 'corp-sg'}]
+
+
+def test_apply_payload_single_instance_object():
+    after = apply_payload(RUNNING, {'hostname': {'hostname': 'md-boston-1'}})
+    assert after['hostname'] == {'hostname': 'md-boston-1'}
+    after = apply_payload(RUNNING, {'hostname': {'_action': 'delete'}})
+    assert 'hostname' not in after
+
+
+def test_apply_payload_delete_and_sub_objects():
+    data = {'_list': [{'vlan_id': [{'id': 10, '_action': 'delete'}]},
+                      {'ssid_prof': [{'profile-name': 'corp-ssid',
+                                      'opmode': {'wpa2-aes': True, '_action': 'delete'}}]}]}
+    after = strip_meta(apply_payload(RUNNING, data))
+    assert 'vlan_id' not in after
+    assert after['ssid_prof'] == [{'profile-name': 'corp-ssid', 'essid': {'essid': 'corp'}}]
+
+
+def test_is_subset():
+    running = RUNNING['ssid_prof'][1]
+    assert is_subset({'profile-name': 'corp-ssid', 'essid': {'essid': 'corp'}}, running)
+    assert is_subset({'profile-name': 'corp-ssid', '_action': 'modify'}, running)
+    assert not is_subset({'profile-name': 'corp-ssid', 'essid': {'essid': 'guest'}}, running)
+    assert not is_subset({'profile-name': 'corp-ssid', 'max-clients': 64}, running)
+    # Numbers and their text compare equal, as returned by the controller
+    assert is_subset({'id': '10'}, {'id': 10})
+    assert is_subset({'vlan': [{'id': 10}]}, {'vlan': [{'id': 20}, {'id': 10}]})
+    assert not is_subset({'vlan': [{'id': 30}]}, {'vlan': [{'id': 20}, {'id': 10}]})
+    assert not is_subset({'essid': {'essid': 'corp'}}, None)
+
+
+def test_compute_delta_no_change():
+    desired = [{'ssid_prof': [{'profile-name': 'corp-ssid', 'essid': {'essid': 'corp'}}]},
+               {'hostname': {'hostname': 'md-boston'}}]
+    assert compute_delta(RUNNING, desired) == []
+
+
+def test_compute_delta_add_and_modify_in_desired_order():
+    desired = [{'aaa_prof': [{'profile-name': 'corp-aaa'}]},
+               {'ssid_prof': [{'profile-name': 'corp-ssid', 'essid': {'essid': 'corp2'}}]},
+               {'hostname': {'hostname': 'md-boston-1'}}]
+    assert compute_delta(RUNNING, desired) == [
+        ('aaa_prof', [{'profile-name': 'corp-aaa'}]),
+        ('ssid_prof', [{'profile-name': 'corp-ssid', 'essid': {'essid': 'corp2'},
+                        '_action': 'modify'}]),
+        ('hostname', {'hostname': 'md-boston-1'}),
+    ]
+
+
+def test_compute_delta_pushes_instances_only_inherited():
+    desired = [{'ssid_prof': [{'profile-name': 'default', 'essid': {'essid': 'aruba-ap'}}]},
+               {'clock_timezone': {'timezone-name': 'PST', 'hours': -8, 'minutes': 0}},
+               {'vlan_id': [{'id': 1}, {'id': 10}]}]
+    assert compute_delta(RUNNING, desired) == [
+        ('ssid_prof', [{'profile-name': 'default', 'essid': {'essid': 'aruba-ap'}}]),
+        ('clock_timezone', {'timezone-name': 'PST', 'hours': -8, 'minutes': 0}),
+        ('vlan_id', [{'id': 1}]),
+    ]
+
+
+def test_compute_delta_deletes_last_in_reverse_order():
+    desired = [{'vlan_id': [{'id': 10, '_action': 'delete'}]},
+               {'ssid_prof': [{'profile-name': 'corp-ssid', '_action': 'delete'}]},
+               {'hostname': {'_action': 'delete'}},
+               {'aaa_prof': [{'profile-name': 'missing', '_action': 'delete'}]}]
+    assert compute_delta(RUNNING, desired) == [
+        ('hostname', {'_action': 'delete'}),
+        ('ssid_prof', [{'profile-name': 'corp-ssid', '_action': 'delete'}]),
+        ('vlan_id', [{'id': 10, '_action': 'delete'}]),
+    ]
+
+
+def test_compute_delta_purge_keeps_inherited_instances():
+    desired = [{'vlan_id': [{'id': 20}]}]
+    assert compute_delta(RUNNING, desired) == [('vlan_id', [{'id': 20}])]
+    assert compute_delta(RUNNING, desired, purge=True) == [
+        ('vlan_id', [{'id': 20}]),
+        ('vlan_id', [{'id': 10, '_action': 'delete'}]),
+    ]
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+#
+# (C) Copyright 2020 Hewlett Packard Enterprise Development LP.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing,
+# software distributed under the License is distributed on an
+# "AS IS" BASIS, WITHOUT WARRANTIES OR CONDITIONS OF ANY
+# KIND, either express or implied. See the License for the
+# specific language governing permissions and limitations
+# under the License.
+
+from __future__ import (absolute_import, division, print_function)
+__metaclass__ = type
+
+from ansible.module_utils import aos_http
+from ansible.module_utils.aos_http import AosApi, get_ancestry_waves, get_failed_payload, \
+    get_failures
+from ansible.module_utils.six.moves.urllib.parse import parse_qs, urlparse
+
+OK = {'status': 0, 'status_str': 'Success'}
+LOCKED = {'status': 1, 'status_str': 'Configuration is locked by another session'}
+
+# Multipart POST payload and the response of AOS 8 to it, the second VLAN
+# and the SSID profile failed
+PAYLOAD = {'_list': [
+    {'vlan_id': [{'id': 10}, {'id': 20}, {'id': 30}]},
+    {'ssid_prof': {'profile-name': 'corp-ssid', 'essid': {'essid': 'corp'}}},
+    {'hostname': {'hostname': 'md-boston'}},
+]}
+RESPONSE = {
+    '_global_result': {'status': 1, 'status_str': 'Failed to apply configuration',
+                       '_pending': True},
+    '_list': [
+        {'vlan_id': [{'id': 10, '_result': OK}, {'id': 20, '_result': LOCKED},
+                     {'id': 30, '_result': OK}]},
+        {'ssid_prof': {'profile-name': 'corp-ssid', '_result': OK,
+                       'essid': {'essid': 'corp', '_result': LOCKED}}},
+        {'hostname': {'hostname': 'md-boston', '_result': OK}},
+    ]}
+
+
+def test_get_failures():
+    assert get_failures(RESPONSE) == [
+        {'object': 'vlan_id', 'part': 0, 'position': 1, 'key': {'id': 20},
+         'status': 1, 'status_str': LOCKED['status_str']},
+        {'object': 'ssid_prof', 'part': 1, 'position': None,
+         'key': {'profile-name': 'corp-ssid'},
+         'status': 1, 'status_str': LOCKED['status_str']},
+    ]
+
+
+def test_get_failures_single_request_and_success():
+    response = {'_global_result': {'status': 0},
+                'vlan_id': {'id': 10, '_result': {'status': '0'}}}
+    assert get_failures(response) == []
+    response = {'_global_result': {'status': 1},
+                'vlan_id': {'id': 5000, '_result': {'status': '1', 'status_str': 'Invalid'}}}
+    assert get_failures(response) == [{'object': 'vlan_id', 'part': 0, 'position': None,
+                                       'key': {'id': 5000}, 'status': '1',
+                                       'status_str': 'Invalid'}]
+    assert get_failures("Internal Server Error") == []
+
+
+def test_get_failed_payload():
+    data, origin = get_failed_payload(PAYLOAD, get_failures(RESPONSE))
+    assert data == {'_list': [
+        {'vlan_id': [{'id': 20}]},
+        {'ssid_prof': {'profile-name': 'corp-ssid', 'essid': {'essid': 'corp'}}},
+    ]}
+    assert origin == {(0, 'vlan_id', 0): (0, 'vlan_id', 1),
+                      (1, 'ssid_prof', None): (1, 'ssid_prof', None)}
+
+
+def test_get_failed_payload_nothing_failed():
+    assert get_failed_payload(PAYLOAD, []) == ({'_list': []}, {})
+
+
+def test_get_ancestry_waves():
+    assert get_ancestry_waves(['/md/Boston/b1', '/md', '/md/Boston', '/md/Paris', '/mm']) == \
+        [['/md', '/mm'], ['/md/Boston', '/md/Paris'], ['/md/Boston/b1']]
+    assert get_ancestry_waves(['/md/Boston', '/md/Bos']) == [['/md/Boston', '/md/Bos']]
+    assert get_ancestry_waves([]) == []
+
+
+class FakeModule(object):
+    def __init__(self, **params):
+        self.params = params
+        self.warnings = []
+
+    def warn(self, warning):
+        self.warnings.append(warning)
+
+
+class FakeConnection(object):
+    """
+    Connection serving the GET of a list of count VLANs in pages, ignoring
+    the offset unless honor_offset
+    """
+
+    def __init__(self, count, honor_offset=True, meta_total=None):
+        self.vlans = [{'id': vlan_id} for vlan_id in range(1, count + 1)]
+        self.honor_offset = honor_offset
+        self.meta_total = meta_total
+        self.offsets = []
+
+    def send_request(self, data, method, path, select, timeout):
+        query = parse_qs(urlparse(path).query)
+        offset, limit = int(query['offset'][0]), int(query['limit'][0])
+        self.offsets.append(offset)
+        start = offset if self.honor_offset else 0
+        resp = {'_data': {'vlan_id': self.vlans[start:start + limit]}}
+        if self.meta_total is not None:
+            resp['_meta'] = {'total': self.meta_total}
+        return resp, 200
+
+
+def get_pages(connection, **params):
+    api = AosApi(FakeModule(**params))
+    api._connection_obj = connection
+    pages = api.get_pages('/configuration/object/vlan_id')
+    return [page['resp']['_data']['vlan_id'] for page in pages], api._module.warnings
+
+
+
+def test_get_pages_stops_on_short_or_empty_page():
+    connection = FakeConnection(5)
+    pages, _ = get_pages(connection, limit=2)
+    assert [len(page) for page in pages] == [2, 2, 1]
+    connection = FakeConnection(4)
+    pages, _ = get_pages(connection, limit=2)
+    assert [len(page) for page in pages] == [2, 2, 0]
+    assert connection.offsets == [0, 2, 4]
+
+
+def test_get_pages_stops_at_meta_total():
+    connection = FakeConnection(4, meta_total=4)
+    pages, _ = get_pages(connection, limit=2)
+    assert [len(page) for page in pages] == [2, 2]
+    assert connection.offsets == [0, 2]
+
+
+def test_get_pages_stops_on_repeated_page():
+    connection = FakeConnection(10, honor_offset=False)
+    pages, _ = get_pages(connection, limit=2)
+    assert pages == [[{'id': 1}, {'id': 2}]]
+    assert connection.offsets == [0, 2]
+
+
+def test_get_pages_stops_at_max_pages(monkeypatch):
+    monkeypatch.setattr(aos_http, 'MAX_PAGES', 3)
+    connection = FakeConnection(10)
+    pages, warnings = get_pages(connection, limit=2)
+    assert len(pages) == 3
+    assert warnings == ["Stopped after 3 pages of /configuration/object/vlan_id, "
+                        "the offset may not be honored"]